@@ -0,0 +1,154 @@
+"""
+Activity retention and archival for CocoCRM
+
+Activities older than ACTIVITY_RETENTION_DAYS are moved out of the hot
+`activity` table into one archive table per month (activity_archive_2025_01,
+...), keeping their ids, so the hot table - and every query that reads
+recent activity - stays small no matter how long the CRM has been in use.
+Archive tables have the same columns and are only read when a caller asks
+for archived history. Whole months can be dropped once they are older than
+ACTIVITY_ARCHIVE_MONTHS, and on SQLite the freed pages are returned to the
+filesystem with incremental VACUUM.
+
+Run `python archive_activities.py` from cron (e.g. nightly).
+"""
+import os
+import re
+from datetime import date, datetime, timedelta
+
+TABLE_PREFIX = 'activity_archive_'
+TABLE_PATTERN = re.compile(r'^activity_archive_(\d{4})_(\d{2})$')
+
+
+class ActivityArchive:
+    """Moves old rows of `model` into monthly archive tables and reads them back"""
+
+    def __init__(self, app, db, model):
+        app.config.setdefault('ACTIVITY_RETENTION_DAYS', int(os.environ.get('ACTIVITY_RETENTION_DAYS', '180')))
+        # 0 keeps archived months forever
+        app.config.setdefault('ACTIVITY_ARCHIVE_MONTHS', int(os.environ.get('ACTIVITY_ARCHIVE_MONTHS', '0')))
+        app.config.setdefault('ACTIVITY_ARCHIVE_BATCH_SIZE', 2000)
+        self.app = app
+        self.db = db
+        self.model = model
+        self.metadata = db.MetaData()
+        self._tables = {}
+
+    def table_name(self, month):
+        return f'{TABLE_PREFIX}{month.year:04d}_{month.month:02d}'
+
+    def table(self, month):
+        """Table object for the archive of `month` (a date; the day is ignored)"""
+        name = self.table_name(month)
+        if name not in self._tables:
+            db = self.db
+            columns = [db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable)
+                       for c in self.model.__table__.columns]
+            self._tables[name] = db.Table(
+                name, self.metadata, *columns,
+                db.Index(f'ix_{name}_contact_created', 'contact_id', 'created_at'),
+                db.Index(f'ix_{name}_deal', 'deal_id'),
+            )
+        return self._tables[name]
+
+    def months(self):
+        """Months that have an archive table, newest first"""
+        found = []
+        # The session's connection, so a tenant shard lists its own archives (see shards.py)
+        for name in self.db.inspect(self.db.session.connection()).get_table_names():
+            match = TABLE_PATTERN.match(name)
+            if match:
+                found.append(date(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(found, reverse=True)
+
+    def tables(self):
+        """(first day of month, Table) for every archive table, newest first"""
+        return [(month, self.table(month)) for month in self.months()]
+
+    def archive(self, cutoff=None, on_archived=None):
+        """
+        Move activities created before cutoff (default: now - retention) into
+        their monthly archive tables, one committed batch at a time
+
+        on_archived(user_ids) is called inside each batch's transaction, e.g.
+        to bump data versions. Returns the number of rows moved.
+        """
+        db, model = self.db, self.model
+        cutoff = cutoff or datetime.utcnow() - timedelta(days=self.app.config['ACTIVITY_RETENTION_DAYS'])
+        batch_size = self.app.config['ACTIVITY_ARCHIVE_BATCH_SIZE']
+        columns = [c.name for c in model.__table__.columns]
+        moved = 0
+        # The newest row always stays: SQLite hands out max(id) + 1, so archiving
+        # it would let the next insert reuse an id that is already archived
+        newest = db.session.execute(db.select(db.func.max(model.id))).scalar()
+        if newest is None:
+            return 0
+
+        while True:
+            batch = db.session.execute(
+                db.select(model.id, model.created_at, model.user_id)
+                .where(model.created_at < cutoff, model.id < newest)
+                .order_by(model.created_at, model.id).limit(batch_size)
+            ).all()
+            if not batch:
+                break
+
+            by_month = {}
+            for row in batch:
+                by_month.setdefault(row.created_at.replace(day=1).date(), []).append(row.id)
+            connection = db.session.connection()
+            for month, ids in by_month.items():
+                table = self.table(month)
+                table.create(connection, checkfirst=True)
+                connection.execute(table.insert().from_select(
+                    columns, db.select(*[model.__table__.c[name] for name in columns]).where(model.id.in_(ids))
+                ))
+            ids = [row.id for row in batch]
+            db.session.execute(db.delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+            if on_archived:
+                on_archived({row.user_id for row in batch if row.user_id})
+            db.session.commit()
+            moved += len(batch)
+            print(f"  ... archived {moved} activities")
+        return moved
+
+    def purge(self, keep_months=None):
+        """Drop archive tables older than keep_months (config ACTIVITY_ARCHIVE_MONTHS; 0 keeps all)"""
+        keep_months = self.app.config['ACTIVITY_ARCHIVE_MONTHS'] if keep_months is None else keep_months
+        if not keep_months:
+            return []
+        today = date.today()
+        first_kept = today.year * 12 + today.month - 1 - keep_months
+        dropped = []
+        for month, table in self.tables():
+            if month.year * 12 + month.month - 1 < first_kept:
+                table.drop(self.db.session.connection())
+                dropped.append(table.name)
+        self.db.session.commit()
+        return dropped
+
+    def delete_where(self, condition):
+        """Delete archived rows matching condition(columns) from every month (caller commits)"""
+        for _, table in self.tables():
+            self.db.session.execute(table.delete().where(condition(table.c)))
+
+    def update_where(self, condition, **values):
+        """Apply an UPDATE to archived rows matching condition(columns) in every month (caller commits)"""
+        for _, table in self.tables():
+            self.db.session.execute(table.update().where(condition(table.c)).values(**values))
+
+    def compact(self, engine=None):
+        """Return free pages to the filesystem (SQLite incremental VACUUM) of engine (default: the main database)"""
+        engine = engine or self.db.engine
+        if engine.dialect.name != 'sqlite':
+            print("ℹ️  Not SQLite - leaving compaction to the database's autovacuum")
+            return
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+                # auto_vacuum can only be switched on by rebuilding the file once
+                print("🔧 Enabling incremental auto_vacuum (one-time full VACUUM)...")
+                connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+                connection.exec_driver_sql('VACUUM')
+            free_pages = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+            connection.exec_driver_sql('PRAGMA incremental_vacuum')
+        print(f"✅ Compacted database ({free_pages} free pages released)")
@@ -1,28 +1,71 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, g
 import csv
 import io
 from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user, user_logged_in
 from werkzeug.security import generate_password_hash, check_password_hash
+import base64
 import hashlib
 import hmac
 import os
 import requests as http_requests
 import json
 import threading
-from datetime import datetime, timedelta
-import jwt
-
-app = Flask(__name__)
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import numpy as np
+from activity_archive import ActivityArchive
+from assets import init_assets
+from bulk_export import EXPORT_FORMATS, available_formats, jsonl_chunks, parquet_chunks
+from compression import init_compression
+from dedupe import ContactDeduper, normalize_email, normalize_phone
+from fragment_cache import init_fragment_cache
+from forecasting import forecast, load_open_deals
+from fuzzy_search import TrigramIndex
+from instrumentation import init_sql_instrumentation
+from job_queue import JobQueue
+from live_events import EventHub
+from read_routing import configure_read_bind, init_read_routing, read_only
+from shards import ShardedSession, TenantShards
+from snapshots import SnapshotStore
+from token_service import TokenService
+from typeahead import PrefixIndex
+from metrics import (
+    AUTOMATION_RUNS, TELEGRAM_SEND_FAILURES, TELEGRAM_SEND_LATENCY, init_metrics, record_cache, register_job_metrics
+)
+
+# INSTANCE_PATH moves crm.db, shards and backups elsewhere (the test scripts use a temporary directory)
+app = Flask(__name__, instance_path=os.environ.get('INSTANCE_PATH') or None)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///crm.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Per-request SQL instrumentation (query count, DB time, N+1 detection)
+app.config['SQL_INSTRUMENTATION'] = os.environ.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 50))
+
 # Telegram Bot Token (set this in environment variables)
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_BOT_USERNAME = os.environ.get('TELEGRAM_BOT_USERNAME', '')
 
-db = SQLAlchemy(app)
+# Read-only views (@read_only) query a separate read engine - see read_routing.py
+configure_read_bind(app)
+
+# With SHARDING=1 each user's data lives in its own database file - see shards.py
+db = SQLAlchemy(app, session_options={'class_': ShardedSession})
+# Logins and the job queue are shared; everything else is per tenant when sharding
+shards = TenantShards(app, db, ['user', 'job'], lambda engine, tables: upgrade_schema(engine, tables))
+init_read_routing(app, db)
+init_sql_instrumentation(app, db)
+init_metrics(app, db)
+init_compression(app)
+# Online backups of the SQLite database (backup.py, /api/admin/backups)
+snapshots = SnapshotStore(app, db)
+init_assets(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -48,6 +91,10 @@ class User(UserMixin, db.Model):
             return False
         return check_password_hash(self.password_hash, password)
 
+# Every way of signing up gets its tenant database as soon as the user is committed
+shards.provision_new(User)
+token_service = TokenService(app, db, User)
+
 # Contact Model
 class Contact(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -61,9 +108,25 @@ class Contact(db.Model):
     tags = db.Column(db.String(500), nullable=True)  # Comma-separated tags
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Lookup copies of email / phone (lower-cased, E.164), set on every save
+    email_normalized = db.Column(db.String(120), nullable=True)
+    phone_e164 = db.Column(db.String(20), nullable=True)
 
     user = db.relationship('User', backref='contacts')
 
+    __table_args__ = (
+        db.Index('ix_contact_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_contact_user_email_normalized', 'user_id', 'email_normalized'),
+        db.Index('ix_contact_user_phone_e164', 'user_id', 'phone_e164'),
+    )
+
+@event.listens_for(Contact, 'before_insert')
+@event.listens_for(Contact, 'before_update')
+def _normalize_contact(mapper, connection, contact):
+    """Keep the lookup columns in step with email / phone as typed"""
+    contact.email_normalized = normalize_email(contact.email)
+    contact.phone_e164 = normalize_phone(contact.phone)
+
 # Deal Model (Sales Pipeline)
 class Deal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -81,6 +144,11 @@ class Deal(db.Model):
     user = db.relationship('User', backref='deals')
     contact = db.relationship('Contact', backref='deals')
 
+    __table_args__ = (
+        db.Index('ix_deal_contact_created', 'contact_id', 'created_at'),
+        db.Index('ix_deal_user_updated', 'user_id', 'updated_at'),
+    )
+
 # Task Model (for automation and reminders)
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -93,11 +161,17 @@ class Task(db.Model):
     completed = db.Column(db.Boolean, default=False)
     priority = db.Column(db.String(20), default='medium')  # low, medium, high
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = db.relationship('User', backref='tasks')
     contact = db.relationship('Contact', backref='tasks')
     deal = db.relationship('Deal', backref='tasks')
 
+    __table_args__ = (
+        db.Index('ix_task_contact_created', 'contact_id', 'created_at'),
+        db.Index('ix_task_user_updated', 'user_id', 'updated_at'),
+    )
+
 # Activity Log
 class Activity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -112,6 +186,75 @@ class Activity(db.Model):
     contact = db.relationship('Contact', backref='activities')
     deal = db.relationship('Deal', backref='activities')
 
+    __table_args__ = (
+        db.Index('ix_activity_contact_created', 'contact_id', 'created_at'),
+        db.Index('ix_activity_user_created', 'user_id', 'created_at'),
+        db.Index('ix_activity_created', 'created_at'),
+    )
+
+# Activities past the retention horizon live in monthly archive tables (see activity_archive.py)
+activity_archive = ActivityArchive(app, db, Activity)
+
+# Deal stage history - one row per stage a deal enters (from_stage is NULL
+# when the deal is created). Written automatically on every flush and by
+# bulk stage moves; drives funnel, time-in-stage and velocity analytics.
+class DealStageHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    deal_id = db.Column(db.Integer, db.ForeignKey('deal.id'), nullable=False)
+    from_stage = db.Column(db.String(50), nullable=True)
+    to_stage = db.Column(db.String(50), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stage_history_deal_changed', 'deal_id', 'changed_at'),
+        db.Index('ix_stage_history_user_stage', 'user_id', 'to_stage', 'changed_at'),
+    )
+
+# Duplicate detection (see dedupe.py): blocking keys per contact, and scored
+# candidate pairs (contact_id < duplicate_id) awaiting merge or dismissal
+class ContactMatchKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    contact_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(300), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_contact_match_key_user_key', 'user_id', 'key'),
+        db.Index('ix_contact_match_key_contact', 'contact_id'),
+    )
+
+class ContactDuplicate(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    contact_id = db.Column(db.Integer, nullable=False)
+    duplicate_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    dismissed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('contact_id', 'duplicate_id', name='uq_contact_duplicate_pair'),
+        db.Index('ix_contact_duplicate_user_score', 'user_id', 'score'),
+        db.Index('ix_contact_duplicate_duplicate', 'duplicate_id'),
+    )
+
+deduper = ContactDeduper(db, Contact, ContactMatchKey, ContactDuplicate)
+
+# Trigram index for fuzzy contact search (see fuzzy_search.py); the primary
+# key doubles as the (user_id, trigram) posting-list index
+class ContactTrigram(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    trigram = db.Column(db.String(3), primary_key=True)
+    contact_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    __table_args__ = (
+        db.Index('ix_contact_trigram_contact', 'contact_id'),
+        {'sqlite_with_rowid': False},
+    )
+
+contact_search = TrigramIndex(db, Contact, ContactTrigram)
+
 # Notification Settings
 class NotificationSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,9 +280,322 @@ class Automation(db.Model):
 
     user = db.relationship('User', backref='automations')
 
+# Tombstones - one row per deleted contact/deal/task so sync clients can
+# learn about deletions. The autoincrement id doubles as the sync cursor.
+class Tombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    collection = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_tombstone_user_id', 'user_id', 'id'),
+    )
+
+# Live events - short-lived rows that push changes to open pipeline / task pages
+# (see live_events.py); pruned by the job worker after a few minutes
+class LiveEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+live_events = EventHub(app, db, LiveEvent)
+
+# Background jobs - durable queue run by worker.py (see job_queue.py); finished
+# jobs are pruned after JOB_RETENTION_DAYS
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(100))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_priority_run_at', 'status', 'priority', 'run_at'),
+        db.Index('ix_job_status_locked_until', 'status', 'locked_until'),
+    )
+
+# With SHARDING on, jobs enqueued during a tenant's transaction are staged in
+# that tenant's database and moved to `job` once it commits (see job_queue.py)
+class JobOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+jobs = JobQueue(app, db, Job, outbox=JobOutbox)
+register_job_metrics(jobs)
+
+def _backfill_contacts(target, source, normalize, batch_size=5000):
+    """Backfill for a column computed in Python from another contact column"""
+    table = Contact.__table__
+
+    def backfill(connection):
+        rows = connection.execute(db.select(table.c.id, table.c[source]).where(table.c[source].isnot(None))).all()
+        update = table.update().where(table.c.id == db.bindparam('row_id')).values({target: db.bindparam('value')})
+        for start in range(0, len(rows), batch_size):
+            connection.execute(update, [{'row_id': row_id, 'value': normalize(value)}
+                                        for row_id, value in rows[start:start + batch_size]])
+    return backfill
+
+# One-off data fixes to run right after a column is added to an existing table
+# (SQL text, or a callable taking the connection)
+COLUMN_BACKFILLS = {
+    ('task', 'updated_at'): 'UPDATE task SET updated_at = created_at WHERE updated_at IS NULL',
+    ('contact', 'email_normalized'): _backfill_contacts('email_normalized', 'email', normalize_email),
+    ('contact', 'phone_e164'): _backfill_contacts('phone_e164', 'phone', normalize_phone),
+}
+
+def upgrade_schema(engine=None, tables=None):
+    """Bring an existing database (default: the main one) up to date - create_all() only adds missing tables"""
+    engine = engine or db.engine
+    inspector = db.inspect(engine)
+    for table in tables or db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                if callable(backfill):
+                    backfill(connection)
+                elif backfill:
+                    connection.execute(db.text(backfill))
+            print(f"✅ Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+# Data versions - per-user, per-collection counters bumped in the same
+# transaction as every write. They drive ETag / Last-Modified so unchanged
+# pages and API lists can answer 304 before running their queries.
+class DataVersion(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    collection = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+VERSIONED_COLLECTIONS = {
+    Contact: 'contacts',
+    Deal: 'deals',
+    Task: 'tasks',
+    Activity: 'activities',
+}
+
+def _bump_versions(connection, keys):
+    """Increment DataVersion rows for (user_id, collection) keys, creating missing ones"""
+    now = datetime.utcnow()
+    for user_id, collection in sorted(keys):
+        if connection.dialect.name in ('sqlite', 'postgresql'):
+            upsert = sqlite_insert if connection.dialect.name == 'sqlite' else postgresql_insert
+            stmt = upsert(DataVersion.__table__).values(user_id=user_id, collection=collection, version=1, updated_at=now)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id', 'collection'],
+                set_={'version': DataVersion.__table__.c.version + 1, 'updated_at': now}
+            ))
+            continue
+        result = connection.execute(db.update(DataVersion.__table__).where(
+            DataVersion.__table__.c.user_id == user_id, DataVersion.__table__.c.collection == collection
+        ).values(version=DataVersion.__table__.c.version + 1, updated_at=now))
+        if result.rowcount == 0:
+            connection.execute(db.insert(DataVersion.__table__).values(
+                user_id=user_id, collection=collection, version=1, updated_at=now))
+
+def touch_collections(user_id, *collections):
+    """Bump data versions for writes that bypass the unit of work (bulk UPDATE/DELETE/INSERT)"""
+    if user_id:
+        _bump_versions(db.session.connection(), {(user_id, c) for c in collections})
+
+# Collections exposed through the /api/changes feed (deletions leave tombstones)
+SYNCED_COLLECTIONS = {
+    Contact: 'contacts',
+    Deal: 'deals',
+    Task: 'tasks',
+}
+
+def record_tombstones(model, ids):
+    """Write tombstones for the rows of model matched by ids (list or SELECT) before a bulk delete"""
+    db.session.execute(db.insert(Tombstone).from_select(
+        ['user_id', 'collection', 'record_id', 'deleted_at'],
+        db.select(model.user_id, db.literal(SYNCED_COLLECTIONS[model]), model.id, db.literal(datetime.utcnow()))
+        .where(model.id.in_(ids))
+    ))
+
+def _live_event(session, obj):
+    """(user_id, kind, data) pushed to live pages for a flushed deal or task, or None"""
+    name = {Deal: 'deal', Task: 'task'}.get(type(obj))
+    if not name or not obj.user_id:
+        return None
+    if obj in session.deleted:
+        return obj.user_id, f'{name}.deleted', {'id': obj.id}
+    if obj in session.new:
+        return obj.user_id, f'{name}.created', {name: SERIALIZERS[type(obj)](obj)}
+    data = {name: SERIALIZERS[type(obj)](obj)}
+    if name == 'deal':
+        previous = db.inspect(obj).attrs.stage.history.deleted
+        data['previous_stage'] = previous[0] if previous else obj.stage
+    return obj.user_id, f'{name}.updated', data
+
+def _stage_change(session, obj):
+    """DealStageHistory row for a flushed deal that was created or changed stage, or None"""
+    if type(obj) is not Deal or obj in session.deleted or not obj.user_id:
+        return None
+    if obj in session.new:
+        from_stage = None
+    else:
+        history = db.inspect(obj).attrs.stage.history
+        if not history.deleted or history.deleted[0] == obj.stage:
+            return None
+        from_stage = history.deleted[0]
+    return {'user_id': obj.user_id, 'deal_id': obj.id, 'from_stage': from_stage,
+            'to_stage': obj.stage or 'lead', 'changed_at': datetime.utcnow()}
+
+DEDUPE_FIELDS = ('name', 'email', 'phone', 'company')
+SEARCH_FIELDS = ('name', 'company')
+
+def _contact_changed(session, obj, fields):
+    """True for a new contact, or one whose given fields changed in this flush"""
+    if type(obj) is not Contact or obj in session.deleted or not obj.user_id:
+        return False
+    state = db.inspect(obj)
+    return obj in session.new or any(state.attrs[field].history.has_changes() for field in fields)
+
+@event.listens_for(db.session, 'after_flush')
+def _track_changes(session, flush_context):
+    keys = set()
+    tombstones = []
+    pushes = []
+    stage_changes = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        collection = VERSIONED_COLLECTIONS.get(type(obj))
+        if collection and obj.user_id:
+            keys.add((obj.user_id, collection))
+        if obj in session.deleted and type(obj) in SYNCED_COLLECTIONS:
+            tombstones.append({'user_id': obj.user_id, 'collection': SYNCED_COLLECTIONS[type(obj)],
+                               'record_id': obj.id, 'deleted_at': datetime.utcnow()})
+        push = _live_event(session, obj)
+        if push:
+            pushes.append(push)
+        change = _stage_change(session, obj)
+        if change:
+            stage_changes.append(change)
+        if _contact_changed(session, obj, DEDUPE_FIELDS):
+            deduper.check(session.connection(), obj)
+        if _contact_changed(session, obj, SEARCH_FIELDS):
+            contact_search.index(session.connection(), obj)
+    if keys:
+        _bump_versions(session.connection(), keys)
+    if tombstones:
+        session.connection().execute(db.insert(Tombstone.__table__), tombstones)
+    if stage_changes:
+        session.connection().execute(db.insert(DealStageHistory.__table__), stage_changes)
+    if pushes:
+        # Same transaction as the change (the tenant's database when sharding)
+        live_events.publish_many(pushes, session.connection(bind_arguments={'mapper': LiveEvent}))
+
+def collection_versions(user_id, collections):
+    """Return {collection: DataVersion or None} with one query"""
+    rows = DataVersion.query.filter(DataVersion.user_id == user_id, DataVersion.collection.in_(collections)).all()
+    found = {row.collection: row for row in rows}
+    return {collection: found.get(collection) for collection in collections}
+
+# Changes whenever the code/templates are redeployed so cached pages are not reused across releases
+BUILD_ID = os.environ.get('RENDER_GIT_COMMIT') or str(int(os.path.getmtime(__file__)))
+
+def conditional_get(*collections, user=None):
+    """
+    Decorator adding ETag / Last-Modified to a GET view from data versions
+
+    When the client already has the current version the view is skipped and
+    a 304 is returned. `user` is a callable returning the user id the view
+    serves (defaults to current_user); return None to skip caching.
+    """
+    from functools import wraps
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user_id = user() if user else (current_user.id if current_user.is_authenticated else None)
+            if user_id is None:
+                return f(*args, **kwargs)
+
+            versions = collection_versions(user_id, collections)
+            parts = [f"{c}.{v.version if v else 0}" for c, v in versions.items()]
+            # Pending flash messages are part of the rendered page, so they vary the ETag too
+            variant = hashlib.sha1(f"{request.full_path}|{session.get('_flashes')}".encode()).hexdigest()[:12]
+            etag = hashlib.sha1(f"{BUILD_ID}|{user_id}|{variant}|{'|'.join(parts)}".encode()).hexdigest()[:24]
+            stamps = [v.updated_at for v in versions.values() if v]
+            last_modified = max(stamps).replace(microsecond=0) if stamps else None
+
+            not_modified = request.if_none_match.contains_weak(etag) if request.if_none_match else (
+                last_modified is not None and request.if_modified_since is not None
+                and last_modified <= request.if_modified_since.replace(tzinfo=None)
+            )
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+def api_user_id():
+    """User id of the `username` query param used by the REST API (for conditional_get)"""
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    return user.id if user else None
+
+# ---------- Template fragment cache ----------
+def fragment_key_prefix():
+    """Added to every {% cache %} key so fragments never leak across users or releases"""
+    return BUILD_ID, current_user.get_id()
+
+init_fragment_cache(app, fragment_key_prefix)
+
+@app.template_global()
+def data_version(*collections):
+    """Version stamp of the current user's collections, for use in {% cache %} keys"""
+    stamps = g.setdefault('data_version_stamps', {})
+    if collections not in stamps:
+        versions = collection_versions(current_user.id, collections)
+        stamps[collections] = ','.join(f'{name}:{row.version if row else 0}' for name, row in versions.items())
+    return stamps[collections]
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    if user:
+        shards.activate(user.id)
+    return user
+
+@user_logged_in.connect_via(app)
+def _activate_logged_in_tenant(sender, user, **extra):
+    # Brings the tenant's database up to date if a deploy changed the schema
+    shards.provision(user.id)
+    shards.activate(user.id)
 
 # Verify Telegram authentication
 def verify_telegram_auth(auth_data):
@@ -168,42 +624,12 @@ def verify_telegram_auth(auth_data):
 
     return calculated_hash == check_hash
 
-def generate_temp_token(user_id, username, expires_in_minutes=180):
-    """Generate a temporary JWT token for auto-login"""
-    expiration = datetime.utcnow() + timedelta(minutes=expires_in_minutes)
-
-    payload = {
-        'user_id': user_id,
-        'username': username,
-        'exp': expiration,
-        'iat': datetime.utcnow(),
-        'type': 'temp_login'
-    }
-
-    token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
-    return token
-
-def verify_temp_token(token):
-    """Verify and decode a temporary JWT token"""
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-
-        if payload.get('type') != 'temp_login':
-            return None
-
-        return payload
-    except jwt.ExpiredSignatureError:
-        print("❌ Token expired")
-        return None
-    except jwt.InvalidTokenError as e:
-        print(f"❌ Invalid token: {e}")
-        return None
-
 # ========== TELEGRAM BOT API HELPERS ==========
 def send_telegram_message(chat_id, text, parse_mode='HTML'):
     """Send a message to a Telegram user via Bot API"""
     if not TELEGRAM_BOT_TOKEN:
         print("WARNING: No TELEGRAM_BOT_TOKEN configured, cannot send message")
+        TELEGRAM_SEND_FAILURES.labels('not_configured').inc()
         return False
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
@@ -212,15 +638,18 @@ def send_telegram_message(chat_id, text, parse_mode='HTML'):
             'text': text,
             'parse_mode': parse_mode
         }
-        resp = http_requests.post(url, json=payload, timeout=10)
+        with TELEGRAM_SEND_LATENCY.time():
+            resp = http_requests.post(url, json=payload, timeout=10)
         if resp.status_code == 200:
             print(f"Telegram message sent to {chat_id}")
             return True
         else:
             print(f"Failed to send Telegram message: {resp.status_code} {resp.text}")
+            TELEGRAM_SEND_FAILURES.labels('http_error').inc()
             return False
     except Exception as e:
         print(f"Error sending Telegram message: {e}")
+        TELEGRAM_SEND_FAILURES.labels('exception').inc()
         return False
 
 
@@ -272,8 +701,10 @@ def handle_bot_command(message):
             f"<i>Click /crm to get your personal login link!</i>"
         )
         # Auto-create user in database if not exists
-        with app.app_context():
-            _ensure_telegram_user(telegram_id, username, first_name, last_name)
+        if telegram_id:
+            with app.app_context():
+                token_service.telegram_users([{'telegram_id': telegram_id, 'username': username,
+                                               'first_name': first_name, 'last_name': last_name}])
         return
 
     # /help command
@@ -295,16 +726,14 @@ def handle_bot_command(message):
     # /crm or /login command - generate login link
     if text.startswith('/crm') or text.startswith('/login'):
         with app.app_context():
-            user = _ensure_telegram_user(telegram_id, username, first_name, last_name)
-            if user:
-                token = generate_temp_token(user.id, user.username, expires_in_minutes=180)
-                base_url = os.environ.get('BASE_URL', 'https://cococrm.onrender.com')
-                login_url = f"{base_url}/?token={token}"
+            # Cached links answer without touching the database
+            link = token_service.telegram_login_link(telegram_id, username, first_name, last_name)
+            if link:
                 send_telegram_message(chat_id,
                     f"<b>Your CocoCRM Login Link</b>\n\n"
-                    f"<a href=\"{login_url}\">Click here to open CocoCRM</a>\n\n"
-                    f"Valid for: 3 hours\n"
-                    f"User: {user.username}\n\n"
+                    f"<a href=\"{link['url']}\">Click here to open CocoCRM</a>\n\n"
+                    f"Valid for: {link['expires_in']} minutes\n"
+                    f"User: {link['username']}\n\n"
                     f"<i>This link is personal - don't share it!</i>"
                 )
             else:
@@ -318,6 +747,7 @@ def handle_bot_command(message):
         with app.app_context():
             user = User.query.filter_by(telegram_id=telegram_id).first()
             if user:
+                shards.activate(user.id)
                 task_count = Task.query.filter_by(user_id=user.id, completed=False).count()
                 deal_count = Deal.query.filter_by(user_id=user.id).filter(
                     Deal.stage.in_(['lead', 'qualified', 'proposal', 'negotiation'])
@@ -349,30 +779,6 @@ def handle_bot_command(message):
         )
 
 
-def _ensure_telegram_user(telegram_id, username, first_name, last_name):
-    """Find or create a user from Telegram data"""
-    if not telegram_id:
-        return None
-    user = User.query.filter_by(telegram_id=str(telegram_id)).first()
-    if not user:
-        uname = username or f"user_{telegram_id}"
-        # Check if username exists, add suffix if needed
-        existing = User.query.filter_by(username=uname).first()
-        if existing:
-            uname = f"{uname}_{telegram_id}"
-        user = User(
-            username=uname,
-            telegram_id=str(telegram_id),
-            telegram_username=username,
-            first_name=first_name,
-            last_name=last_name
-        )
-        db.session.add(user)
-        db.session.commit()
-        print(f"Created new user from Telegram: {uname} (ID: {telegram_id})")
-    return user
-
-
 def run_automations(trigger, user_id, contact_id=None, deal_id=None, extra_data=None):
     """Execute active automations matching the given trigger"""
     try:
@@ -394,13 +800,55 @@ def run_automations(trigger, user_id, contact_id=None, deal_id=None, extra_data=
                 elif auto.action == 'send_email':
                     log_activity('email', f'[Automation] Email trigger: {auto.name}', contact_id=contact_id, deal_id=deal_id, user_id=user_id)
                 db.session.commit()
+                AUTOMATION_RUNS.labels(auto.action, 'success').inc()
                 print(f"✅ Automation executed: {auto.name}")
             except Exception as e:
                 print(f"⚠️ Automation '{auto.name}' failed: {e}")
+                AUTOMATION_RUNS.labels(auto.action, 'error').inc()
                 db.session.rollback()
     except Exception as e:
         print(f"⚠️ Error checking automations: {e}")
 
+def run_automations_batch(trigger, user_id, targets):
+    """
+    Batch version of run_automations for bulk operations
+
+    targets is a list of (contact_id, deal_id). Rules are loaded once and all
+    resulting tasks/activities are inserted with one executemany each; the
+    caller commits.
+    """
+    if not targets:
+        return
+    automations = Automation.query.filter_by(user_id=user_id, trigger=trigger, active=True).all()
+    tasks, activities = [], []
+    for auto in automations:
+        for contact_id, deal_id in targets:
+            if auto.action == 'create_task':
+                tasks.append({
+                    'user_id': user_id, 'contact_id': contact_id, 'deal_id': deal_id,
+                    'title': f'[Auto] {auto.name}',
+                    'description': f'Automatically created by automation: {auto.name}',
+                    'priority': 'medium'
+                })
+            elif auto.action == 'send_notification':
+                activities.append({'activity_type': 'note', 'description': f'[Automation] {auto.name} triggered',
+                                   'contact_id': contact_id, 'deal_id': deal_id, 'user_id': user_id})
+            elif auto.action == 'send_email':
+                activities.append({'activity_type': 'email', 'description': f'[Automation] Email trigger: {auto.name}',
+                                   'contact_id': contact_id, 'deal_id': deal_id, 'user_id': user_id})
+        AUTOMATION_RUNS.labels(auto.action, 'success').inc(len(targets))
+    if tasks:
+        db.session.execute(db.insert(Task), tasks)
+        touch_collections(user_id, 'tasks')
+    log_activities(activities)
+
+def log_activities(rows):
+    """Insert many activity rows with a single executemany (caller commits)"""
+    if rows:
+        db.session.execute(db.insert(Activity), rows)
+        for user_id in {row['user_id'] for row in rows}:
+            touch_collections(user_id, 'activities')
+
 def log_activity(activity_type, description, contact_id=None, deal_id=None, user_id=None):
     """Helper function to log activities"""
     try:
@@ -417,13 +865,37 @@ def log_activity(activity_type, description, contact_id=None, deal_id=None, user
         print(f"⚠️ Failed to log activity: {e}")
         db.session.rollback()
 
+# ========== BACKGROUND JOBS ==========
+# Run by worker.py; enqueue with jobs.enqueue(name, payload) and commit
+@jobs.task('telegram.send_message')
+def send_telegram_message_job(chat_id, text, parse_mode='HTML'):
+    if not send_telegram_message(chat_id, text, parse_mode) and TELEGRAM_BOT_TOKEN:
+        raise RuntimeError(f'Telegram message to {chat_id} not sent')
+
+@jobs.task('telegram.webhook')
+def telegram_webhook_job(message):
+    handle_bot_command(message)
+
+@jobs.task('db.backup')
+def backup_job():
+    snapshots.take()
+
+@jobs.every(60)
+def prune_live_events():
+    live_events.prune()
+
+@jobs.task('automations.run')
+def run_automations_job(trigger, user_id, contact_id=None, deal_id=None):
+    with shards.tenant(user_id):
+        run_automations(trigger, user_id, contact_id=contact_id, deal_id=deal_id)
+
 @app.route('/')
 def index():
     # Check for token in URL parameters
     token = request.args.get('token')
 
     if token and not current_user.is_authenticated:
-        payload = verify_temp_token(token)
+        payload = token_service.verify(token)
         if payload:
             user = User.query.get(payload['user_id'])
             if user:
@@ -549,17 +1021,16 @@ def telegram_auth():
 
         # Send welcome message via Telegram bot
         if telegram_id:
-            thread = threading.Thread(target=send_telegram_message, args=(
-                telegram_id,
-                f"<b>Welcome to CocoCRM!</b>\n\n"
-                f"You've been logged in successfully.\n\n"
-                f"<b>Quick commands:</b>\n"
-                f"/crm - Get a new login link anytime\n"
-                f"/status - Check your CRM stats\n\n"
-                f"<i>Enjoy managing your business!</i>"
-            ))
-            thread.daemon = True
-            thread.start()
+            jobs.enqueue('telegram.send_message', {
+                'chat_id': telegram_id,
+                'text': f"<b>Welcome to CocoCRM!</b>\n\n"
+                        f"You've been logged in successfully.\n\n"
+                        f"<b>Quick commands:</b>\n"
+                        f"/crm - Get a new login link anytime\n"
+                        f"/status - Check your CRM stats\n\n"
+                        f"<i>Enjoy managing your business!</i>"
+            })
+            db.session.commit()
 
         return jsonify({'success': True, 'redirect': url_for('dashboard')})
 
@@ -613,10 +1084,9 @@ def telegram_webhook():
         # Handle messages with commands
         message = update.get('message')
         if message:
-            # Process in background thread so we don't block the webhook response
-            thread = threading.Thread(target=handle_bot_command, args=(message,))
-            thread.daemon = True
-            thread.start()
+            # Queue it so the webhook answers at once and the update survives a restart
+            jobs.enqueue('telegram.webhook', {'message': message}, priority=10)
+            db.session.commit()
 
         return jsonify({'ok': True})
     except Exception as e:
@@ -662,11 +1132,66 @@ def require_api_key(f):
                 'docs': 'See OPENCLAW_API.md for authentication details'
             }), 401
 
+        if shards.enabled:
+            # The API acts for the `username` it is given (query string or JSON body)
+            username = request.args.get('username') or (request.get_json(silent=True) or {}).get('username') or 'admin'
+            user = User.query.filter_by(username=username).first()
+            shards.activate(user.id if user else None)
         return f(*args, **kwargs)
     return decorated_function
 
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+def serialize_contact(c):
+    return {
+        'id': c.id,
+        'name': c.name,
+        'email': c.email,
+        'phone': c.phone,
+        'company': c.company,
+        'position': c.position,
+        'tags': c.tags,
+        'created_at': _isoformat(c.created_at),
+        'updated_at': _isoformat(c.updated_at)
+    }
+
+def serialize_deal(d):
+    return {
+        'id': d.id,
+        'title': d.title,
+        'value': d.value,
+        'stage': d.stage,
+        'probability': d.probability,
+        'contact_id': d.contact_id,
+        'created_at': _isoformat(d.created_at),
+        'updated_at': _isoformat(d.updated_at)
+    }
+
+def serialize_task(t):
+    return {
+        'id': t.id,
+        'title': t.title,
+        'description': t.description,
+        'priority': t.priority,
+        'completed': t.completed,
+        'contact_id': t.contact_id,
+        'deal_id': t.deal_id,
+        'due_date': _isoformat(t.due_date),
+        'created_at': _isoformat(t.created_at),
+        'updated_at': _isoformat(t.updated_at)
+    }
+
+SERIALIZERS = {
+    Contact: serialize_contact,
+    Deal: serialize_deal,
+    Task: serialize_task,
+}
+
 @app.route('/api/contacts', methods=['GET'])
+@read_only
 @require_api_key
+@conditional_get('contacts', user=api_user_id)
 def api_list_contacts():
     """List all contacts - for OpenClaw integration"""
     username = request.args.get('username', 'admin')
@@ -677,16 +1202,7 @@ def api_list_contacts():
     contacts = Contact.query.filter_by(user_id=user.id).all()
     return jsonify({
         'success': True,
-        'contacts': [{
-            'id': c.id,
-            'name': c.name,
-            'email': c.email,
-            'phone': c.phone,
-            'company': c.company,
-            'position': c.position,
-            'tags': c.tags,
-            'created_at': c.created_at.isoformat() if c.created_at else None
-        } for c in contacts]
+        'contacts': [serialize_contact(c) for c in contacts]
     })
 
 @app.route('/api/contacts', methods=['POST'])
@@ -722,8 +1238,99 @@ def api_create_contact():
         }
     }), 201
 
+@app.route('/api/contacts/lookup', methods=['GET'])
+@read_only
+@require_api_key
+def api_lookup_contacts():
+    """Exact contact match by phone and/or email (caller ID, inbound messages) - for OpenClaw integration"""
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    if not request.args.get('phone') and not request.args.get('email'):
+        return jsonify({'error': 'phone or email is required'}), 400
+    phone = normalize_phone(request.args.get('phone'))
+    email = normalize_email(request.args.get('email'))
+
+    # One (user_id, column) condition per key so each is answered from its own index
+    matches = []
+    if phone:
+        matches.append(db.and_(Contact.user_id == user.id, Contact.phone_e164 == phone))
+    if email:
+        matches.append(db.and_(Contact.user_id == user.id, Contact.email_normalized == email))
+    contacts = Contact.query.filter(db.or_(*matches)).order_by(Contact.id).limit(50).all() if matches else []
+    return jsonify({
+        'success': True,
+        'phone': phone,
+        'email': email,
+        'contacts': [serialize_contact(c) for c in contacts]
+    })
+
+@app.route('/api/contacts/search', methods=['GET'])
+@read_only
+@require_api_key
+def api_search_contacts():
+    """Typo-tolerant name/company search, best match first - for OpenClaw integration"""
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    min_score = request.args.get('min_score', 0.3, type=float)
+
+    matches = contact_search.search(user.id, query, limit=limit, min_score=min_score)
+    return jsonify({
+        'success': True,
+        'contacts': [dict(serialize_contact(contact), score=score) for contact, score in matches]
+    })
+
+@app.route('/api/contacts/duplicates', methods=['GET'])
+@read_only
+@require_api_key
+def api_contact_duplicates():
+    """Candidate duplicate contact pairs, best first - for OpenClaw integration"""
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    min_score = request.args.get('min_score', 0, type=float)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+
+    pairs = ContactDuplicate.query.filter(
+        ContactDuplicate.user_id == user.id, ContactDuplicate.dismissed == False, ContactDuplicate.score >= min_score  # noqa: E712
+    ).order_by(ContactDuplicate.score.desc()).limit(limit).all()
+    ids = {pair.contact_id for pair in pairs} | {pair.duplicate_id for pair in pairs}
+    contacts = {c.id: serialize_contact(c) for c in Contact.query.filter(Contact.id.in_(ids))} if ids else {}
+    return jsonify({
+        'success': True,
+        'duplicates': [{'score': pair.score, 'contact': contacts.get(pair.contact_id),
+                        'duplicate': contacts.get(pair.duplicate_id)} for pair in pairs]
+    })
+
+@app.route('/api/contacts/merge', methods=['POST'])
+@require_api_key
+def api_merge_contacts():
+    """Merge duplicates into one contact: {"keep_id": 1, "merge_ids": [2, 3]}"""
+    data = request.json or {}
+    user = User.query.filter_by(username=data.get('username', 'admin')).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    try:
+        keep_id = int(data['keep_id'])
+        merge_ids = [int(i) for i in data.get('merge_ids') or []]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'keep_id and merge_ids are required'}), 400
+
+    merged = merge_contacts(user.id, keep_id, merge_ids)
+    if not merged:
+        return jsonify({'error': 'Nothing to merge'}), 404
+    db.session.commit()
+    return jsonify({'success': True, 'merged': merged, 'contact': serialize_contact(Contact.query.get(keep_id))})
+
 @app.route('/api/deals', methods=['GET'])
+@read_only
 @require_api_key
+@conditional_get('deals', user=api_user_id)
 def api_list_deals():
     """List all deals - for OpenClaw integration"""
     username = request.args.get('username', 'admin')
@@ -734,15 +1341,7 @@ def api_list_deals():
     deals = Deal.query.filter_by(user_id=user.id).all()
     return jsonify({
         'success': True,
-        'deals': [{
-            'id': d.id,
-            'title': d.title,
-            'value': d.value,
-            'stage': d.stage,
-            'probability': d.probability,
-            'contact_id': d.contact_id,
-            'created_at': d.created_at.isoformat() if d.created_at else None
-        } for d in deals]
+        'deals': [serialize_deal(d) for d in deals]
     })
 
 @app.route('/api/deals', methods=['POST'])
@@ -778,7 +1377,9 @@ def api_create_deal():
     }), 201
 
 @app.route('/api/tasks', methods=['GET'])
+@read_only
 @require_api_key
+@conditional_get('tasks', user=api_user_id)
 def api_list_tasks():
     """List all tasks - for OpenClaw integration"""
     username = request.args.get('username', 'admin')
@@ -789,15 +1390,7 @@ def api_list_tasks():
     tasks = Task.query.filter_by(user_id=user.id).all()
     return jsonify({
         'success': True,
-        'tasks': [{
-            'id': t.id,
-            'title': t.title,
-            'description': t.description,
-            'priority': t.priority,
-            'completed': t.completed,
-            'due_date': t.due_date.isoformat() if t.due_date else None,
-            'created_at': t.created_at.isoformat() if t.created_at else None
-        } for t in tasks]
+        'tasks': [serialize_task(t) for t in tasks]
     })
 
 @app.route('/api/tasks', methods=['POST'])
@@ -835,6 +1428,238 @@ def api_create_task():
         }
     }), 201
 
+# ---------- Change feed ----------
+# Agents keep a sync token and ask only for what changed since it, instead of
+# re-downloading whole collections. The token stores an (updated_at, id)
+# keyset position per collection plus the last tombstone id seen.
+SYNC_FEEDS = [
+    ('contacts', Contact, serialize_contact),
+    ('deals', Deal, serialize_deal),
+    ('tasks', Task, serialize_task),
+]
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+# Rows younger than this are held back: updated_at is stamped at flush time, so
+# a slow transaction can commit a row older than one a client already synced
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '2'))
+
+def encode_sync_token(state):
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_sync_token(token):
+    """Return the feed state stored in a sync token (empty token = full sync)"""
+    state = {'tombstone': 0}
+    if not token:
+        return state
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    data = json.loads(raw)
+    state['tombstone'] = int(data.get('tombstone', 0))
+    for name, _, _ in SYNC_FEEDS:
+        if data.get(name):
+            ts, record_id = data[name]
+            datetime.fromisoformat(ts)
+            state[name] = [ts, int(record_id)]
+    return state
+
+def collect_changes(user_id, state, limit):
+    """Return (changes, deleted, next_state, has_more) for one page of the feed"""
+    horizon = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    next_state = dict(state)
+    changes, has_more = {}, False
+
+    for name, model, serialize in SYNC_FEEDS:
+        query = model.query.filter(model.user_id == user_id, model.updated_at <= horizon)
+        if state.get(name):
+            ts, record_id = datetime.fromisoformat(state[name][0]), state[name][1]
+            query = query.filter(db.or_(model.updated_at > ts,
+                                        db.and_(model.updated_at == ts, model.id > record_id)))
+        rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+        if len(rows) > limit:
+            rows, has_more = rows[:limit], True
+        changes[name] = [serialize(row) for row in rows]
+        if rows:
+            next_state[name] = [rows[-1].updated_at.isoformat(), rows[-1].id]
+
+    tombstones = Tombstone.query.filter(
+        Tombstone.user_id == user_id, Tombstone.id > state['tombstone']
+    ).order_by(Tombstone.id).limit(limit + 1).all()
+    if len(tombstones) > limit:
+        tombstones, has_more = tombstones[:limit], True
+    deleted = []
+    for tombstone in tombstones:
+        if tombstone.deleted_at > horizon:
+            break  # keep the cursor behind deletions that may not have settled yet
+        deleted.append({
+            'collection': tombstone.collection,
+            'id': tombstone.record_id,
+            'deleted_at': tombstone.deleted_at.isoformat()
+        })
+        next_state['tombstone'] = tombstone.id
+
+    return changes, deleted, next_state, has_more
+
+@app.route('/api/changes', methods=['GET'])
+@read_only
+@require_api_key
+def api_changes():
+    """Records created, updated or deleted since a sync token - for OpenClaw integration"""
+    username = request.args.get('username', 'admin')
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    try:
+        state = decode_sync_token(request.args.get('since', ''))
+        limit = min(max(int(request.args.get('limit', SYNC_PAGE_SIZE)), 1), SYNC_MAX_PAGE_SIZE)
+    except (ValueError, TypeError, KeyError):
+        return jsonify({'error': 'Invalid sync token or limit'}), 400
+
+    changes, deleted, next_state, has_more = collect_changes(user.id, state, limit)
+    return jsonify({
+        'success': True,
+        'changes': changes,
+        'deleted': deleted,
+        'next_token': encode_sync_token(next_state),
+        'has_more': has_more
+    })
+
+# Bulk exports: collection -> (model, timestamp column for incremental `since` exports)
+BULK_EXPORTS = {
+    'contacts': (Contact, 'updated_at'),
+    'deals': (Deal, 'updated_at'),
+    'tasks': (Task, 'updated_at'),
+    'activities': (Activity, 'created_at'),
+    'stage_history': (DealStageHistory, 'changed_at'),
+    'deletions': (Tombstone, 'deleted_at'),
+}
+# Rows per cursor batch, and per Parquet row group
+BULK_EXPORT_BATCH_SIZE = 5000
+BULK_EXPORT_PARAMS = {'username', 'since', 'until', 'api_key'}
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None) if value else None
+
+def _filter_value(column, value):
+    """Query string value converted to the column's type (ValueError if it does not fit)"""
+    python_type = column.type.python_type
+    if python_type is bool:
+        return value.lower() in ('1', 'true', 'yes')
+    if python_type is datetime:
+        return _parse_timestamp(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+@app.route('/api/export/<collection>.<fmt>', methods=['GET'])
+@read_only
+@require_api_key
+def api_bulk_export(collection, fmt):
+    """
+    Stream every column of a collection as JSON Lines or Parquet - for warehouse loads
+
+    ?since= exports only rows changed at or after that time (deletions come
+    from the `deletions` collection), other query params filter on column
+    equality. X-Export-Until is the `since` for the next incremental run.
+    Activities include the monthly archive tables (oldest month first, then
+    the hot table), so ids come out ascending.
+    """
+    if collection not in BULK_EXPORTS:
+        return jsonify({'error': f'Unknown collection, use one of: {", ".join(BULK_EXPORTS)}'}), 404
+    if fmt not in available_formats():
+        return jsonify({'error': f'Unsupported format, use one of: {", ".join(available_formats())}'}), 400
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    model, stamp = BULK_EXPORTS[collection]
+    table = model.__table__
+    try:
+        since = _parse_timestamp(request.args.get('since'))
+        # Rows still being committed get a settle window, so the next run picks them up
+        until = _parse_timestamp(request.args.get('until')) or datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
+
+    filters = {}
+    for name, value in request.args.items():
+        if name in BULK_EXPORT_PARAMS:
+            continue
+        if name not in table.c:
+            return jsonify({'error': f'Unknown filter: {name}'}), 400
+        try:
+            filters[name] = _filter_value(table.c[name], value)
+        except ValueError:
+            return jsonify({'error': f'Invalid value for {name}'}), 400
+
+    sources = [table]
+    if model is Activity:
+        # Archived months hold only rows created in that month; skip those outside since/until
+        sources = [archived for month, archived in reversed(activity_archive.tables())
+                   if datetime(month.year, month.month, 1) < until
+                   and (since is None or _next_month(month) > since)] + sources
+
+    def select_from(source):
+        query = db.select(*source.columns).where(source.c.user_id == user.id, source.c[stamp] < until)
+        if since is not None:
+            query = query.where(source.c[stamp] >= since)
+        for name, value in filters.items():
+            query = query.where(source.c[name] == value)
+        return query.order_by(source.c.id).execution_options(yield_per=BULK_EXPORT_BATCH_SIZE)
+
+    def batches():
+        # One cursor at a time
+        for source in sources:
+            yield from db.session.execute(select_from(source)).partitions()
+
+    encode = parquet_chunks if fmt == 'parquet' else jsonl_chunks
+    return Response(
+        stream_with_context(encode(list(table.columns), batches())),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename={collection}_export.{fmt}',
+            'X-Export-Until': until.isoformat()
+        }
+    )
+
+@app.route('/api/admin/backups', methods=['GET'])
+@require_api_key
+def api_list_backups():
+    """Database snapshots, newest first"""
+    return jsonify({
+        'success': True,
+        'backups': [dict(snapshot, created_at=_isoformat(snapshot['created_at'])) for snapshot in snapshots.list()]
+    })
+
+@app.route('/api/admin/backups', methods=['POST'])
+@require_api_key
+def api_create_backup():
+    """Queue an online snapshot of the database (taken by the job worker)"""
+    try:
+        snapshots.database_path()
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 400
+    # Not a tenant's job: enqueued straight into the main database, so its id is known
+    with shards.tenant(None):
+        job = jobs.enqueue('db.backup', priority=-10, max_attempts=2)
+        db.session.commit()
+    return jsonify({'success': True, 'job_id': job.id}), 202
+
+def _login_link_response(link):
+    return {
+        'success': True,
+        'token': link['token'],
+        'url': link['url'],
+        'expires_in': link['expires_in'],
+        'user': {
+            'id': link['user_id'],
+            'username': link['username']
+        }
+    }
+
 @app.route('/api/telegram/generate-token', methods=['POST'])
 def generate_token_endpoint():
     """
@@ -852,7 +1677,7 @@ def generate_token_endpoint():
         "success": true,
         "token": "jwt_token_here",
         "url": "https://cococrm.onrender.com/?token=jwt_token_here",
-        "expires_in": 180
+        "expires_in": 180             // minutes left (cached links are reused)
     }
     """
     try:
@@ -868,13 +1693,22 @@ def generate_token_endpoint():
 
         # Check for API key authentication (recommended for bot access)
         expected_api_key = os.environ.get('TELEGRAM_API_KEY', 'dev-api-key-change-me')
+        link_key = ('telegram', str(telegram_id)) if telegram_id else None
         if api_key and api_key == expected_api_key:
-            # API key is valid, find or create user
+            # A fresh cached link for this Telegram user needs no database work
+            link = token_service.cached_link(link_key) if link_key else None
+            if link:
+                return jsonify(_login_link_response(link))
+
+            # API key is valid, find (telegram_id first, then username) or create user
             user = None
-            if telegram_id:
-                user = User.query.filter_by(telegram_id=str(telegram_id)).first()
-            if not user and username:
-                user = User.query.filter_by(username=username).first()
+            if telegram_id or username:
+                candidates = User.query.filter(db.or_(
+                    User.telegram_id == str(telegram_id) if telegram_id else db.false(),
+                    User.username == username if username else db.false()
+                )).all()
+                user = next((u for u in candidates if telegram_id and u.telegram_id == str(telegram_id)), None) \
+                    or next((u for u in candidates if username and u.username == username), None)
             if not user:
                 # Create service user
                 uname = username or f"agent_{telegram_id or 'unknown'}"
@@ -904,26 +1738,11 @@ def generate_token_endpoint():
         else:
             return jsonify({'success': False, 'message': 'Must provide telegram_id, username, or api_key'}), 400
 
-        # Generate temporary token
-        token = generate_temp_token(user.id, user.username, expires_in_minutes=180)
-
-        # Get base URL (support both local and production)
-        base_url = os.environ.get('BASE_URL', 'https://cococrm.onrender.com')
-        login_url = f"{base_url}/?token={token}"
-
-        print(f"✅ Generated token for user: {user.username}")
-        print(f"🔗 Login URL: {login_url}")
-
-        return jsonify({
-            'success': True,
-            'token': token,
-            'url': login_url,
-            'expires_in': 180,
-            'user': {
-                'id': user.id,
-                'username': user.username
-            }
-        })
+        # Reuse the user's login link while it is fresh, otherwise issue a new token
+        link_key = link_key if link_key and user.telegram_id == str(telegram_id) else None
+        link = token_service.login_link(user.id, user.username, key=link_key)
+        print(f"✅ Login link for user: {user.username}")
+        return jsonify(_login_link_response(link))
 
     except Exception as e:
         print(f"💥 Error generating token: {str(e)}")
@@ -980,8 +1799,17 @@ def debug_status():
         'secret_key_configured': bool(app.config['SECRET_KEY']),
         'database_uri': app.config['SQLALCHEMY_DATABASE_URI'],
         'total_users': User.query.count(),
-        'environment': 'production' if not app.debug else 'development'
+        'environment': 'production' if not app.debug else 'development',
+        'sharding': shards.enabled
     }
+    if shards.enabled:
+        # Cross-shard totals: one small query per tenant database
+        counts = shards.query_all(db.select(*[db.select(db.func.count()).select_from(model).scalar_subquery()
+                                              for model in (Contact, Deal, Task)]))
+        status['shard_count'] = len(counts)
+        status['shards_open'] = shards.open_count()
+        status['total_contacts'], status['total_deals'], status['total_tasks'] = [
+            sum(rows[0][i] for rows in counts.values()) for i in range(3)]
 
     html = """
     <!DOCTYPE html>
@@ -1072,6 +1900,16 @@ def debug_status():
                 <span class="label">Total Users:</span>
                 <span class="value">{{ status['total_users'] }}</span>
             </div>
+            {% if status['sharding'] %}
+            <div class="status-item">
+                <span class="label">Tenant Shards:</span>
+                <span class="value">{{ status['shard_count'] }} ({{ status['shards_open'] }} open)</span>
+            </div>
+            <div class="status-item">
+                <span class="label">Contacts / Deals / Tasks:</span>
+                <span class="value">{{ status['total_contacts'] }} / {{ status['total_deals'] }} / {{ status['total_tasks'] }}</span>
+            </div>
+            {% endif %}
             <div class="status-item">
                 <span class="label">Environment:</span>
                 <span class="value">{{ status['environment'] }}</span>
@@ -1085,6 +1923,7 @@ def debug_status():
 
 @app.route('/dashboard')
 @login_required
+@conditional_get('contacts', 'deals', 'tasks')
 def dashboard():
     # Get statistics for dashboard
     total_contacts = Contact.query.filter_by(user_id=current_user.id).count()
@@ -1100,7 +1939,297 @@ def dashboard():
                          total_revenue=total_revenue,
                          completed_tasks=completed_tasks)
 
+# ========== BULK SELECTION & CASCADING DELETES ==========
+def contact_filters(user_id, filters):
+    """SQL conditions for the contacts list filters (search, tag)"""
+    conditions = [Contact.user_id == user_id]
+    search = (filters.get('search') or '').strip()
+    tag = (filters.get('tag') or '').strip()
+    if search:
+        search_pattern = f'%{search}%'
+        matches = [
+            Contact.name.ilike(search_pattern),
+            Contact.email.ilike(search_pattern),
+            Contact.company.ilike(search_pattern),
+            Contact.phone.ilike(search_pattern)
+        ]
+        # "(555) 010-2000" also finds a contact saved as "+1 555 010 2000"
+        phone = normalize_phone(search) if not any(c.isalpha() for c in search) else None
+        if phone:
+            matches.append(Contact.phone_e164 == phone)
+        conditions.append(db.or_(*matches))
+    if tag:
+        conditions.append(Contact.tags.ilike(f'%{tag}%'))
+    return conditions
+
+def deal_filters(user_id, filters):
+    """SQL conditions for deal selections (stage, contact_id, search)"""
+    conditions = [Deal.user_id == user_id]
+    if filters.get('stage'):
+        conditions.append(Deal.stage == filters['stage'])
+    if filters.get('contact_id'):
+        conditions.append(Deal.contact_id == int(filters['contact_id']))
+    if (filters.get('search') or '').strip():
+        conditions.append(Deal.title.ilike(f"%{filters['search'].strip()}%"))
+    return conditions
+
+def task_filters(user_id, filters):
+    """SQL conditions for task selections (status, priority, contact_id, deal_id, search)"""
+    conditions = [Task.user_id == user_id]
+    if filters.get('status') in ('pending', 'completed'):
+        conditions.append(Task.completed == (filters['status'] == 'completed'))
+    if filters.get('priority'):
+        conditions.append(Task.priority == filters['priority'])
+    if filters.get('contact_id'):
+        conditions.append(Task.contact_id == int(filters['contact_id']))
+    if filters.get('deal_id'):
+        conditions.append(Task.deal_id == int(filters['deal_id']))
+    if (filters.get('search') or '').strip():
+        conditions.append(Task.title.ilike(f"%{filters['search'].strip()}%"))
+    return conditions
+
+SELECTION_FILTERS = {
+    Contact: contact_filters,
+    Deal: deal_filters,
+    Task: task_filters,
+}
+
+def bulk_selection(model, user_id):
+    """
+    Ids targeted by a bulk action, as a SELECT usable inside IN (...)
+
+    Accepts JSON {"ids": [...]} or {"filter": {...}}, or a form post with
+    repeated `ids` fields or `select_all=1` plus the list filter fields.
+    Returns None when nothing was selected; raises ValueError for ids or
+    filter values that aren't valid.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids') or []
+        filters = data.get('filter')
+        if not isinstance(ids, list) or (filters is not None and not isinstance(filters, dict)):
+            raise ValueError('ids must be a list and filter an object')
+    else:
+        ids = request.form.getlist('ids')
+        filters = request.form if request.form.get('select_all') else None
+
+    if filters is not None:
+        try:
+            conditions = SELECTION_FILTERS[model](user_id, filters)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid filter')
+        return db.select(model.id).where(*conditions)
+    if ids:
+        # int() would accept True and truncate 1.5
+        if any(isinstance(i, (bool, float)) for i in ids):
+            raise ValueError('ids must be integers')
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            raise ValueError('ids must be integers')
+        return db.select(model.id).where(model.user_id == user_id, model.id.in_(ids))
+    return None
+
+def _bulk_delete(model, condition):
+    return db.session.execute(
+        db.delete(model).where(condition).execution_options(synchronize_session=False)
+    ).rowcount
+
+def delete_deals_cascade(user_id, deal_ids):
+    """Delete deals plus their tasks, activities and stage history (caller commits)"""
+    touch_collections(user_id, 'deals', 'tasks', 'activities')
+    live_events.publish(user_id, 'deals.deleted', {'ids': deal_ids if isinstance(deal_ids, list) else None})
+    record_tombstones(Task, db.select(Task.id).where(Task.deal_id.in_(deal_ids)))
+    record_tombstones(Deal, deal_ids)
+    _bulk_delete(Activity, Activity.deal_id.in_(deal_ids))
+    activity_archive.delete_where(lambda c: c.deal_id.in_(deal_ids))
+    _bulk_delete(Task, Task.deal_id.in_(deal_ids))
+    _bulk_delete(DealStageHistory, DealStageHistory.deal_id.in_(deal_ids))
+    return _bulk_delete(Deal, Deal.id.in_(deal_ids))
+
+def delete_contacts_cascade(user_id, contact_ids):
+    """
+    Delete contacts and their whole object graph in a fixed number of statements (caller commits)
+
+    Covers activities and tasks of the contact *and* of the contact's deals,
+    which the old per-model deletes left behind as orphans.
+    """
+    touch_collections(user_id, 'contacts', 'deals', 'tasks', 'activities')
+    live_events.publish(user_id, 'contacts.deleted', {'ids': contact_ids if isinstance(contact_ids, list) else None})
+    deal_ids = db.select(Deal.id).where(Deal.contact_id.in_(contact_ids))
+    record_tombstones(Task, db.select(Task.id).where(db.or_(Task.contact_id.in_(contact_ids), Task.deal_id.in_(deal_ids))))
+    record_tombstones(Deal, deal_ids)
+    record_tombstones(Contact, contact_ids)
+    _bulk_delete(Activity, db.or_(Activity.contact_id.in_(contact_ids), Activity.deal_id.in_(deal_ids)))
+    activity_archive.delete_where(lambda c: db.or_(c.contact_id.in_(contact_ids), c.deal_id.in_(deal_ids)))
+    _bulk_delete(Task, db.or_(Task.contact_id.in_(contact_ids), Task.deal_id.in_(deal_ids)))
+    _bulk_delete(DealStageHistory, DealStageHistory.deal_id.in_(deal_ids))
+    _bulk_delete(Deal, Deal.contact_id.in_(contact_ids))
+    deduper.forget(contact_ids)
+    contact_search.forget(contact_ids)
+    return _bulk_delete(Contact, Contact.id.in_(contact_ids))
+
+def _normalized_tags():
+    """SQL for ',tag1,tag2,' so a single tag can be matched with ILIKE '%,tag,%'"""
+    return db.literal(',') + db.func.replace(db.func.coalesce(Contact.tags, ''), ', ', ',', type_=db.String) + ','
+
+def _tag_pattern(tag):
+    escaped = tag.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%,{escaped},%'
+
+def _parse_tags(value):
+    if isinstance(value, (list, tuple)):
+        value = ','.join(value)
+    return [t.strip() for t in (value or '').split(',') if t.strip()]
+
+def bulk_update_contact_tags(user_id, selection, add_tags=(), remove_tags=()):
+    """
+    Add/remove tags on every selected contact with one UPDATE per added tag,
+    one batched UPDATE for the removals and one batched activity insert.
+    Tags match case-insensitively, like the tag filter. Returns the number
+    of contacts touched.
+    """
+    touched = set()
+    for tag in add_tags:
+        missing = [Contact.id.in_(selection), ~_normalized_tags().ilike(_tag_pattern(tag), escape='\\')]
+        touched.update(db.session.scalars(db.select(Contact.id).where(*missing)))
+        db.session.execute(
+            db.update(Contact).where(*missing).values(tags=db.case(
+                (db.func.coalesce(Contact.tags, '') == '', tag),
+                else_=Contact.tags + ',' + tag
+            )).execution_options(synchronize_session=False)
+        )
+    if remove_tags:
+        # SQL REPLACE is case-sensitive, so the matched rows are rewritten here
+        removing = {tag.lower() for tag in remove_tags}
+        present = [Contact.id.in_(selection),
+                   db.or_(*[_normalized_tags().ilike(_tag_pattern(tag), escape='\\') for tag in remove_tags])]
+        rows = db.session.execute(db.select(Contact.id, Contact.tags).where(*present)).all()
+        if rows:
+            db.session.execute(db.update(Contact), [
+                {'id': row.id, 'tags': ','.join(t.strip() for t in row.tags.split(',')
+                                                if t.strip() and t.strip().lower() not in removing)}
+                for row in rows
+            ])
+        touched.update(row.id for row in rows)
+
+    if touched:
+        touch_collections(user_id, 'contacts')
+    changes = ' '.join([f'+{t}' for t in add_tags] + [f'-{t}' for t in remove_tags])
+    log_activities([
+        {'activity_type': 'note', 'description': f'Tags updated: {changes}', 'contact_id': contact_id, 'user_id': user_id}
+        for contact_id in touched
+    ])
+    return len(touched)
+
+def bulk_update_deal_stage(user_id, selection, new_stage):
+    """Move every selected deal to new_stage; activities and automations are emitted in batch"""
+    moving = [Deal.id.in_(selection), Deal.stage.is_distinct_from(new_stage)]
+    deals = db.session.execute(db.select(Deal.id, Deal.title, Deal.stage, Deal.contact_id).where(*moving)).all()
+    db.session.execute(
+        db.update(Deal).where(*moving).values(stage=new_stage).execution_options(synchronize_session=False)
+    )
+    if deals:
+        touch_collections(user_id, 'deals')
+        live_events.publish(user_id, 'deals.moved', {'ids': [d.id for d in deals], 'stage': new_stage})
+        now = datetime.utcnow()
+        db.session.execute(db.insert(DealStageHistory), [
+            {'user_id': user_id, 'deal_id': d.id, 'from_stage': d.stage, 'to_stage': new_stage, 'changed_at': now}
+            for d in deals
+        ])
+    log_activities([
+        {'activity_type': 'note', 'description': f'Deal "{d.title}" moved from {d.stage} to {new_stage}',
+         'contact_id': d.contact_id, 'deal_id': d.id, 'user_id': user_id}
+        for d in deals
+    ])
+    run_automations_batch('deal_stage_change', user_id, [(d.contact_id, d.id) for d in deals])
+    return len(deals)
+
+def bulk_update_tasks(user_id, selection, priority=None, completed=None):
+    """Set priority and/or completion on every selected task in one UPDATE"""
+    values = {}
+    conditions = [Task.id.in_(selection)]
+    if priority:
+        values['priority'] = priority
+    if completed is not None:
+        values['completed'] = completed
+    if not values:
+        return 0
+
+    changed = db.or_(*[getattr(Task, field).is_distinct_from(value) for field, value in values.items()])
+    tasks = db.session.execute(db.select(Task.id, Task.title, Task.contact_id, Task.deal_id).where(*conditions, changed)).all()
+    db.session.execute(
+        db.update(Task).where(*conditions, changed).values(**values).execution_options(synchronize_session=False)
+    )
+    if tasks:
+        touch_collections(user_id, 'tasks')
+        live_events.publish(user_id, 'tasks.updated', dict(values, ids=[t.id for t in tasks]))
+
+    if completed is not None:
+        action = 'Task completed' if completed else 'Task reopened'
+    else:
+        action = f'Task priority set to {priority}'
+    log_activities([
+        {'activity_type': 'note', 'description': f'{action}: {t.title}', 'contact_id': t.contact_id,
+         'deal_id': t.deal_id, 'user_id': user_id}
+        for t in tasks
+    ])
+    return len(tasks)
+
+MERGE_FILL_FIELDS = ('email', 'phone', 'company', 'position')
+
+def merge_contacts(user_id, keep_id, merge_ids):
+    """
+    Fold duplicate contacts into keep_id (caller commits)
+
+    Deals, tasks and activities (hot and archived) are repointed with one
+    UPDATE per table, blank fields on the kept contact are filled from the
+    duplicates, tags and notes are combined, and the duplicates deleted.
+    Returns the number of contacts merged away.
+    """
+    keep = Contact.query.filter_by(id=keep_id, user_id=user_id).first()
+    others = Contact.query.filter(Contact.user_id == user_id, Contact.id.in_(merge_ids), Contact.id != keep_id) \
+        .order_by(Contact.id).all() if keep else []
+    if not others:
+        return 0
+    ids = [c.id for c in others]
+
+    for field in MERGE_FILL_FIELDS:
+        if not getattr(keep, field):
+            setattr(keep, field, next((getattr(c, field) for c in others if getattr(c, field)), None))
+    tags = _parse_tags(keep.tags)
+    tags += [t for c in others for t in _parse_tags(c.tags) if t not in tags]
+    keep.tags = ','.join(tags) or None
+    notes = [n for n in [keep.notes] + [c.notes for c in others] if n]
+    keep.notes = '\n\n'.join(dict.fromkeys(notes)) or None
+
+    for model in (Deal, Task, Activity):
+        db.session.execute(
+            db.update(model).where(model.contact_id.in_(ids)).values(contact_id=keep.id)
+            .execution_options(synchronize_session=False)
+        )
+    activity_archive.update_where(lambda c: c.contact_id.in_(ids), contact_id=keep.id)
+
+    touch_collections(user_id, 'contacts', 'deals', 'tasks', 'activities')
+    live_events.publish(user_id, 'contacts.deleted', {'ids': ids})
+    record_tombstones(Contact, ids)
+    deduper.forget(ids)
+    contact_search.forget(ids)
+    _bulk_delete(Contact, Contact.id.in_(ids))
+    log_activities([{'activity_type': 'note', 'description': f'Merged duplicate contact: {c.name}',
+                     'contact_id': keep.id, 'user_id': user_id} for c in others])
+    return len(ids)
+
+def bulk_response(message, redirect_endpoint, count=0, error=False):
+    """JSON for API-style bulk calls, flash + redirect for form posts"""
+    if request.is_json:
+        return jsonify({'success': not error, 'message': message, 'count': count}), (400 if error else 200)
+    flash(message, 'error' if error else 'success')
+    return redirect(request.referrer or url_for(redirect_endpoint))
+
 # ========== CONTACTS ROUTES ==========
+CONTACT_FUZZY_LIMIT = 20
+
 @app.route('/contacts')
 @login_required
 def contacts():
@@ -1108,21 +2237,7 @@ def contacts():
     tag_filter = request.args.get('tag', '').strip()
     sort_by = request.args.get('sort', 'date_desc')
 
-    query = Contact.query.filter_by(user_id=current_user.id)
-
-    if search:
-        search_pattern = f'%{search}%'
-        query = query.filter(
-            db.or_(
-                Contact.name.ilike(search_pattern),
-                Contact.email.ilike(search_pattern),
-                Contact.company.ilike(search_pattern),
-                Contact.phone.ilike(search_pattern)
-            )
-        )
-
-    if tag_filter:
-        query = query.filter(Contact.tags.ilike(f'%{tag_filter}%'))
+    query = Contact.query.filter(*contact_filters(current_user.id, {'search': search, 'tag': tag_filter}))
 
     if sort_by == 'name_asc':
         query = query.order_by(Contact.name.asc())
@@ -1133,20 +2248,35 @@ def contacts():
     else:
         query = query.order_by(Contact.created_at.desc())
 
-    contacts = query.all()
-
-    all_tags = set()
-    for contact in Contact.query.filter_by(user_id=current_user.id).all():
-        if contact.tags:
-            all_tags.update([t.strip() for t in contact.tags.split(',')])
+    listing = {}
+
+    def load_contacts():
+        """Matching contacts and whether they are fuzzy matches - called from the template only when its cached fragments are stale"""
+        if not listing:
+            contacts = query.all()
+            # Nothing contains the search text: fall back to typo-tolerant name/company matches
+            fuzzy = bool(search) and not contacts
+            if fuzzy:
+                # Same tag test as contact_filters (case-insensitive ILIKE '%tag%')
+                contacts = [c for c, _ in contact_search.search(current_user.id, search, limit=CONTACT_FUZZY_LIMIT)
+                            if not tag_filter or tag_filter.lower() in (c.tags or '').lower()]
+            listing.update(contacts=contacts, fuzzy=fuzzy)
+        return listing
+
+    def load_tags():
+        """All tags in use - called from the template only when the cached tag list is stale"""
+        all_tags = set()
+        for tags in db.session.scalars(db.select(Contact.tags).where(Contact.user_id == current_user.id, Contact.tags.isnot(None))):
+            all_tags.update([t.strip() for t in tags.split(',') if t.strip()])
+        return sorted(all_tags)
 
     return render_template('contacts.html',
-                         contacts=contacts,
+                         load_contacts=load_contacts,
                          user=current_user,
                          search=search,
                          tag_filter=tag_filter,
                          sort_by=sort_by,
-                         all_tags=sorted(all_tags))
+                         load_tags=load_tags)
 
 @app.route('/contacts/add', methods=['GET', 'POST'])
 @login_required
@@ -1167,7 +2297,9 @@ def add_contact():
             db.session.commit()
 
             log_activity('note', f'Contact created: {contact.name}', contact_id=contact.id)
-            run_automations('new_contact', current_user.id, contact_id=contact.id)
+            jobs.enqueue('automations.run', {'trigger': 'new_contact', 'user_id': current_user.id,
+                                             'contact_id': contact.id})
+            db.session.commit()
 
             flash('Contact added successfully!', 'success')
             return redirect(url_for('contacts'))
@@ -1212,11 +2344,7 @@ def edit_contact(contact_id):
 def delete_contact(contact_id):
     contact = Contact.query.filter_by(id=contact_id, user_id=current_user.id).first_or_404()
     try:
-        # Delete related records first
-        Activity.query.filter_by(contact_id=contact_id).delete()
-        Task.query.filter_by(contact_id=contact_id).delete()
-        Deal.query.filter_by(contact_id=contact_id).delete()
-        db.session.delete(contact)
+        delete_contacts_cascade(current_user.id, [contact.id])
         db.session.commit()
         flash('Contact deleted successfully!', 'success')
     except Exception as e:
@@ -1224,27 +2352,294 @@ def delete_contact(contact_id):
         flash(f'Error deleting contact: {str(e)}', 'error')
     return redirect(url_for('contacts'))
 
+@app.route('/contacts/bulk-delete', methods=['POST'])
+@login_required
+def bulk_delete_contacts():
+    """Delete many contacts (ids or a list filter) in one transaction"""
+    try:
+        selection = bulk_selection(Contact, current_user.id)
+    except ValueError:
+        return bulk_response('Invalid ids or filter', 'contacts', error=True)
+    if selection is None:
+        return bulk_response('No contacts selected', 'contacts', error=True)
+    try:
+        count = delete_contacts_cascade(current_user.id, selection)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in bulk_delete_contacts: {str(e)}")
+        return bulk_response(f'Error deleting contacts: {str(e)}', 'contacts', error=True)
+    return bulk_response(f'{count} contacts deleted', 'contacts', count=count)
+
+# Contact timeline: activities, tasks and deal events merged newest-first.
+# Equal timestamps are ordered by kind, then id, so the cursor is a total order.
+TIMELINE_PAGE_SIZE = 25
+TIMELINE_SIDEBAR_LIMIT = 10
+TIMELINE_KINDS = ['activity', 'task', 'deal']
+
+def _timeline_keyset(model, kind, cursor):
+    """Filter selecting rows of one source that sort after the cursor"""
+    ts, cursor_kind, cursor_id = cursor
+    rank, cursor_rank = TIMELINE_KINDS.index(kind), TIMELINE_KINDS.index(cursor_kind)
+    if rank < cursor_rank:
+        return model.created_at <= ts
+    if rank > cursor_rank:
+        return model.created_at < ts
+    return db.or_(model.created_at < ts, db.and_(model.created_at == ts, model.id < cursor_id))
+
+def _timeline_item(kind, row):
+    """Flatten a timeline row into the dict used by the template and the JSON API"""
+    item = {
+        'kind': kind,
+        'id': row.id,
+        'created_at': row.created_at.isoformat(),
+        'created_label': row.created_at.strftime('%B %d, %Y at %H:%M'),
+        'deal_title': None,
+        'detail': None
+    }
+    if kind == 'activity':
+        item['badge'] = row.activity_type
+        item['text'] = row.description
+        item['deal_title'] = row.deal_title
+    elif kind == 'task':
+        item['badge'] = 'task'
+        item['text'] = f'Task: {row.title}'
+        item['deal_title'] = row.deal.title if row.deal else None
+        item['detail'] = 'Completed' if row.completed else (
+            f"Due {row.due_date.strftime('%B %d, %Y')}" if row.due_date else 'Open')
+    else:
+        item['badge'] = 'deal'
+        item['text'] = f'Deal opened: {row.title}'
+        item['detail'] = f"{row.stage.replace('-', ' ').title()} - ${row.value or 0:,.2f}"
+    return item
+
+def encode_timeline_cursor(item):
+    return f"{item['created_at']}~{item['kind']}~{item['id']}"
+
+def decode_timeline_cursor(cursor):
+    ts, kind, item_id = cursor.split('~')
+    if kind not in TIMELINE_KINDS:
+        raise ValueError(f'Unknown timeline kind: {kind}')
+    return datetime.fromisoformat(ts), kind, int(item_id)
+
+def _timeline_activities(table, contact_id, before, limit):
+    """Newest limit+1 activities of a contact from the hot table or one archive table"""
+    query = db.select(
+        table.c.id, table.c.created_at, table.c.activity_type, table.c.description, Deal.title.label('deal_title')
+    ).outerjoin(Deal, Deal.id == table.c.deal_id).where(table.c.contact_id == contact_id, table.c.created_at.isnot(None))
+    if before:
+        query = query.where(_timeline_keyset(table.c, 'activity', before))
+    return db.session.execute(query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit + 1)).all()
+
+def contact_timeline(contact_id, before=None, limit=TIMELINE_PAGE_SIZE, include_archived=False):
+    """Return (items, next_cursor) for one page of a contact's timeline"""
+    sources = [
+        ('task', Task, Task.query.options(joinedload(Task.deal))),
+        ('deal', Deal, Deal.query)
+    ]
+
+    rows = []
+    def add(kind, found):
+        rows.extend(((row.created_at, TIMELINE_KINDS.index(kind), row.id), kind, row) for row in found)
+
+    add('activity', _timeline_activities(Activity.__table__, contact_id, before, limit))
+    for kind, model, query in sources:
+        query = query.filter(model.contact_id == contact_id, model.created_at.isnot(None))
+        if before:
+            query = query.filter(_timeline_keyset(model, kind, before))
+        # Each source only needs its own newest limit+1 rows for the merged page
+        add(kind, query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1))
+
+    if include_archived:
+        # Archive months come newest first; stop once the page is already full of newer rows
+        for month, table in activity_archive.tables():
+            month_start = datetime(month.year, month.month, 1)
+            if before and month_start > before[0]:
+                continue
+            rows.sort(key=lambda r: r[0], reverse=True)
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            if len(rows) > limit and rows[limit][0][0] >= month_end:
+                break
+            add('activity', _timeline_activities(table, contact_id, before, limit))
+
+    rows.sort(key=lambda r: r[0], reverse=True)
+    items = [_timeline_item(kind, row) for _, kind, row in rows[:limit]]
+    next_cursor = encode_timeline_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+@app.route('/contacts/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_contacts():
+    """Add/remove tags on many contacts in one transaction"""
+    data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    add_tags = _parse_tags(data.get('add_tags'))
+    remove_tags = _parse_tags(data.get('remove_tags'))
+    try:
+        selection = bulk_selection(Contact, current_user.id)
+    except ValueError:
+        return bulk_response('Invalid ids or filter', 'contacts', error=True)
+    if selection is None:
+        return bulk_response('No contacts selected', 'contacts', error=True)
+    if not add_tags and not remove_tags:
+        return bulk_response('Nothing to update', 'contacts', error=True)
+    try:
+        count = bulk_update_contact_tags(current_user.id, selection, add_tags, remove_tags)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in bulk_update_contacts: {str(e)}")
+        return bulk_response(f'Error updating contacts: {str(e)}', 'contacts', error=True)
+    return bulk_response(f'{count} contacts updated', 'contacts', count=count)
+
 @app.route('/contacts/<int:contact_id>')
 @login_required
 def view_contact(contact_id):
     contact = Contact.query.filter_by(id=contact_id, user_id=current_user.id).first_or_404()
-    activities = Activity.query.filter_by(contact_id=contact_id).order_by(Activity.created_at.desc()).all()
-    deals = Deal.query.filter_by(contact_id=contact_id).all()
-    tasks = Task.query.filter_by(contact_id=contact_id).order_by(Task.due_date).all()
+    include_archived = request.args.get('include_archived') == '1'
+    timeline, next_cursor = contact_timeline(contact_id, include_archived=include_archived)
+    # Offer the archived months only when there are any
+    has_archive = not include_archived and bool(activity_archive.months())
+    deals = Deal.query.filter_by(contact_id=contact_id).order_by(Deal.created_at.desc()).limit(TIMELINE_SIDEBAR_LIMIT).all()
+    tasks = Task.query.filter_by(contact_id=contact_id).order_by(Task.due_date).limit(TIMELINE_SIDEBAR_LIMIT).all()
+
+    duplicates = contact_duplicates(contact.id)
+
+    return render_template('contact_detail.html', contact=contact, timeline=timeline, next_cursor=next_cursor,
+                           include_archived=include_archived, has_archive=has_archive,
+                           deals=deals, tasks=tasks, duplicates=duplicates, user=current_user)
+
+def contact_duplicates(contact_id, limit=5):
+    """[(candidate pair, other contact)] for one contact, best match first"""
+    pair = ContactDuplicate
+    other_id = db.case((pair.contact_id == contact_id, pair.duplicate_id), else_=pair.contact_id)
+    return db.session.execute(
+        db.select(pair, Contact).join(Contact, Contact.id == other_id)
+        .where(db.or_(pair.contact_id == contact_id, pair.duplicate_id == contact_id), pair.dismissed == False)  # noqa: E712
+        .order_by(pair.score.desc()).limit(limit)
+    ).all()
+
+@app.route('/contacts/<int:contact_id>/merge', methods=['POST'])
+@login_required
+def merge_contact(contact_id):
+    """Merge the posted duplicate contacts (merge_ids) into this one"""
+    contact = Contact.query.filter_by(id=contact_id, user_id=current_user.id).first_or_404()
+    try:
+        merged = merge_contacts(current_user.id, contact.id, [int(i) for i in request.form.getlist('merge_ids')])
+        db.session.commit()
+        flash(f'Merged {merged} duplicate contact(s) into {contact.name}', 'success')
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in merge_contact: {str(e)}")
+        flash(f'Error merging contacts: {str(e)}', 'error')
+    return redirect(url_for('view_contact', contact_id=contact.id))
+
+@app.route('/contacts/<int:contact_id>/duplicates/<int:other_id>/dismiss', methods=['POST'])
+@login_required
+def dismiss_duplicate(contact_id, other_id):
+    """Mark a candidate pair as not a duplicate so scans stop suggesting it"""
+    contact = Contact.query.filter_by(id=contact_id, user_id=current_user.id).first_or_404()
+    ContactDuplicate.query.filter_by(user_id=current_user.id, contact_id=min(contact.id, other_id),
+                                     duplicate_id=max(contact.id, other_id)).update({'dismissed': True})
+    db.session.commit()
+    return redirect(url_for('view_contact', contact_id=contact.id))
+
+@app.route('/contacts/<int:contact_id>/timeline')
+@login_required
+def contact_timeline_api(contact_id):
+    """Older timeline pages for the contact detail page (keyset paginated)"""
+    contact = Contact.query.filter_by(id=contact_id, user_id=current_user.id).first_or_404()
+    before = request.args.get('before')
+    limit = max(1, min(request.args.get('limit', TIMELINE_PAGE_SIZE, type=int), 100))
+    try:
+        cursor = decode_timeline_cursor(before) if before else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+
+    include_archived = request.args.get('include_archived') == '1'
+    items, next_cursor = contact_timeline(contact.id, before=cursor, limit=limit, include_archived=include_archived)
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+# Per-user autocomplete indexes, brought up to date when the owner's contacts data version changes
+_typeahead_cache = OrderedDict()
+TYPEAHEAD_CACHE_SIZE = 64
+# More changed/deleted contacts than this since the index was built: rebuild instead of patching
+TYPEAHEAD_MAX_DELTA = 500
+
+def _typeahead_delta(user_id, since, tombstone_id):
+    """(changed rows, deleted ids, last tombstone id) since an index was built, or None if too many"""
+    changed = db.session.execute(
+        db.select(Contact.id, Contact.name, Contact.company)
+        .where(Contact.user_id == user_id, Contact.updated_at >= since).limit(TYPEAHEAD_MAX_DELTA + 1)
+    ).all()
+    deleted = db.session.execute(
+        db.select(Tombstone.id, Tombstone.record_id)
+        .where(Tombstone.user_id == user_id, Tombstone.id > tombstone_id, Tombstone.collection == 'contacts')
+        .order_by(Tombstone.id).limit(TYPEAHEAD_MAX_DELTA + 1)
+    ).all()
+    if len(changed) + len(deleted) > TYPEAHEAD_MAX_DELTA:
+        return None
+    return changed, [row.record_id for row in deleted], deleted[-1].id if deleted else tombstone_id
+
+def contact_prefix_index(user_id):
+    """
+    PrefixIndex of a user's contacts, built on first use and kept in an LRU
 
-    return render_template('contact_detail.html', contact=contact, activities=activities, deals=deals, tasks=tasks, user=current_user)
+    When the contacts version moves on, rows updated since the last sync
+    (minus SYNC_SETTLE_SECONDS, for transactions still committing) and new
+    tombstones are patched in; re-applying a row twice is harmless.
+    """
+    current = collection_versions(user_id, ['contacts'])['contacts']
+    version = current.version if current else 0
+
+    cached = _typeahead_cache.get(user_id)
+    record_cache('contact_typeahead', cached is not None and cached['version'] == version)
+    if cached is not None:
+        _typeahead_cache.move_to_end(user_id)
+        if cached['version'] == version:
+            return cached['index']
+
+    synced_at = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    delta = _typeahead_delta(user_id, cached['since'], cached['tombstone']) if cached is not None else None
+    if delta is not None:
+        changed, deleted, tombstone_id = delta
+        index = cached['index'].copy()
+        index.update(changed)
+        index.remove(deleted)
+    else:
+        tombstone_id = db.session.execute(
+            db.select(db.func.coalesce(db.func.max(Tombstone.id), 0)).where(Tombstone.user_id == user_id)
+        ).scalar()
+        index = PrefixIndex(db.session.execute(
+            db.select(Contact.id, Contact.name, Contact.company).where(Contact.user_id == user_id)
+        ).all())
+    _typeahead_cache[user_id] = {'version': version, 'index': index, 'since': synced_at, 'tombstone': tombstone_id}
+    _typeahead_cache.move_to_end(user_id)
+    while len(_typeahead_cache) > TYPEAHEAD_CACHE_SIZE:
+        _typeahead_cache.popitem(last=False)
+    return index
+
+@app.route('/contacts/autocomplete')
+@login_required
+def contact_autocomplete():
+    """Contacts whose name or company words start with the typed text (deal form picker)"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    matches = contact_prefix_index(current_user.id).search(query, limit=limit) if query else []
+    return jsonify({
+        'success': True,
+        'contacts': [{'id': contact_id, 'name': name, 'company': company} for contact_id, name, company in matches]
+    })
 
 @app.route('/contacts/export')
+@read_only
 @login_required
+@conditional_get('contacts')
 def export_contacts():
-    contacts = Contact.query.filter_by(user_id=current_user.id).order_by(Contact.name).all()
+    query = Contact.query.filter_by(user_id=current_user.id).order_by(Contact.name)
+    header = ['Name', 'Email', 'Phone', 'Company', 'Position', 'Tags', 'Created At']
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Name', 'Email', 'Phone', 'Company', 'Position', 'Tags', 'Created At'])
-
-    for contact in contacts:
-        writer.writerow([
+    def row(contact):
+        return [
             contact.name,
             contact.email or '',
             contact.phone or '',
@@ -1252,55 +2647,71 @@ def export_contacts():
             contact.position or '',
             contact.tags or '',
             contact.created_at.strftime('%Y-%m-%d %H:%M') if contact.created_at else ''
-        ])
+        ]
 
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=contacts_export.csv'}
-    )
+    return csv_response(header, query, row, 'contacts_export.csv')
 
 @app.route('/deals/export')
+@read_only
 @login_required
+@conditional_get('deals', 'contacts')
 def export_deals():
-    deals = Deal.query.filter_by(user_id=current_user.id).order_by(Deal.created_at.desc()).all()
+    query = Deal.query.options(joinedload(Deal.contact)).filter_by(user_id=current_user.id).order_by(Deal.created_at.desc())
+    header = ['Title', 'Value', 'Stage', 'Probability', 'Contact', 'Expected Close', 'Created At']
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Title', 'Value', 'Stage', 'Probability', 'Contact', 'Expected Close', 'Created At'])
-
-    for deal in deals:
-        contact_name = deal.contact.name if deal.contact else ''
-        writer.writerow([
+    def row(deal):
+        return [
             deal.title,
             deal.value,
             deal.stage,
             deal.probability,
-            contact_name,
+            deal.contact.name if deal.contact else '',
             deal.expected_close_date.strftime('%Y-%m-%d') if deal.expected_close_date else '',
             deal.created_at.strftime('%Y-%m-%d %H:%M') if deal.created_at else ''
-        ])
+        ]
+
+    return csv_response(header, query, row, 'deals_export.csv')
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+def csv_response(header, query, row, filename):
+    """Stream a CSV export in batches so memory stays bounded for large accounts"""
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(header)
+        for record in query.yield_per(EXPORT_BATCH_SIZE):
+            writer.writerow(row(record))
+            if output.tell() >= EXPORT_FLUSH_BYTES:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
 
-    output.seek(0)
     return Response(
-        output.getvalue(),
+        stream_with_context(generate()),
         mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=deals_export.csv'}
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 # ========== PIPELINE ROUTES ==========
 @app.route('/pipeline')
 @login_required
 def pipeline():
-    # Get deals grouped by stage
     stages = ['lead', 'qualified', 'proposal', 'negotiation', 'closed-won', 'closed-lost']
-    deals_by_stage = {}
 
-    for stage in stages:
-        deals_by_stage[stage] = Deal.query.filter_by(user_id=current_user.id, stage=stage).order_by(Deal.created_at.desc()).all()
+    def load_board():
+        """Deals grouped by stage - called from the template only when the cached board is stale"""
+        deals_by_stage = {stage: [] for stage in stages}
+        # One query for the whole board, with contacts loaded up front for the cards
+        deals = Deal.query.options(joinedload(Deal.contact)).filter_by(user_id=current_user.id).order_by(Deal.created_at.desc()).all()
+        for deal in deals:
+            if deal.stage in deals_by_stage:
+                deals_by_stage[deal.stage].append(deal)
+        return deals_by_stage
 
-    return render_template('pipeline.html', deals_by_stage=deals_by_stage, stages=stages, user=current_user)
+    return render_template('pipeline.html', load_board=load_board, stages=stages, user=current_user)
 
 @app.route('/deals/add', methods=['GET', 'POST'])
 @login_required
@@ -1334,8 +2745,7 @@ def add_deal():
             flash(f'Error adding deal: {str(e)}', 'error')
             print(f"Error in add_deal: {str(e)}")
 
-    contacts = Contact.query.filter_by(user_id=current_user.id).all()
-    return render_template('deal_form.html', deal=None, contacts=contacts, user=current_user)
+    return render_template('deal_form.html', deal=None, user=current_user)
 
 @app.route('/deals/edit/<int:deal_id>', methods=['GET', 'POST'])
 @login_required
@@ -1361,8 +2771,7 @@ def edit_deal(deal_id):
         flash('Deal updated successfully!', 'success')
         return redirect(url_for('pipeline'))
 
-    contacts = Contact.query.filter_by(user_id=current_user.id).all()
-    return render_template('deal_form.html', deal=deal, contacts=contacts, user=current_user)
+    return render_template('deal_form.html', deal=deal, user=current_user)
 
 @app.route('/deals/update-stage/<int:deal_id>', methods=['POST'])
 @login_required
@@ -1375,42 +2784,323 @@ def update_deal_stage(deal_id):
         deal.stage = new_stage
         db.session.commit()
         log_activity('note', f'Deal "{deal.title}" moved from {old_stage} to {new_stage}', contact_id=deal.contact_id, deal_id=deal.id)
-        run_automations('deal_stage_change', current_user.id, contact_id=deal.contact_id, deal_id=deal.id)
+        jobs.enqueue('automations.run', {'trigger': 'deal_stage_change', 'user_id': current_user.id,
+                                         'contact_id': deal.contact_id, 'deal_id': deal.id})
+        db.session.commit()
         return jsonify({'success': True})
 
     return jsonify({'success': False}), 400
 
+@app.route('/deals/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_deals():
+    """Move many deals to a stage in one transaction"""
+    data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    new_stage = data.get('stage')
+    if new_stage not in ['lead', 'qualified', 'proposal', 'negotiation', 'closed-won', 'closed-lost']:
+        return bulk_response('Invalid stage', 'pipeline', error=True)
+    try:
+        selection = bulk_selection(Deal, current_user.id)
+    except ValueError:
+        return bulk_response('Invalid ids or filter', 'pipeline', error=True)
+    if selection is None:
+        return bulk_response('No deals selected', 'pipeline', error=True)
+    try:
+        count = bulk_update_deal_stage(current_user.id, selection, new_stage)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in bulk_update_deals: {str(e)}")
+        return bulk_response(f'Error updating deals: {str(e)}', 'pipeline', error=True)
+    return bulk_response(f'{count} deals moved to {new_stage}', 'pipeline', count=count)
+
 @app.route('/deals/delete/<int:deal_id>', methods=['POST'])
 @login_required
 def delete_deal(deal_id):
     deal = Deal.query.filter_by(id=deal_id, user_id=current_user.id).first_or_404()
-    deal_title = deal.title
-    Activity.query.filter_by(deal_id=deal_id).delete()
-    Task.query.filter_by(deal_id=deal_id).delete()
-    db.session.delete(deal)
+    delete_deals_cascade(current_user.id, [deal.id])
     db.session.commit()
 
     flash('Deal deleted successfully!', 'success')
     return redirect(url_for('pipeline'))
 
+@app.route('/deals/bulk-delete', methods=['POST'])
+@login_required
+def bulk_delete_deals():
+    """Delete many deals (ids or a filter) in one transaction"""
+    try:
+        selection = bulk_selection(Deal, current_user.id)
+    except ValueError:
+        return bulk_response('Invalid ids or filter', 'pipeline', error=True)
+    if selection is None:
+        return bulk_response('No deals selected', 'pipeline', error=True)
+    try:
+        count = delete_deals_cascade(current_user.id, selection)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in bulk_delete_deals: {str(e)}")
+        return bulk_response(f'Error deleting deals: {str(e)}', 'pipeline', error=True)
+    return bulk_response(f'{count} deals deleted', 'pipeline', count=count)
+
 # ========== ANALYTICS ROUTES ==========
+OPEN_DEAL_STAGES = ['lead', 'qualified', 'proposal', 'negotiation']
+FORECAST_PERIODS = {'month': 6, 'week': 12}  # default horizon per bucket size
+
+DEAL_STAGES = OPEN_DEAL_STAGES + ['closed-won', 'closed-lost']
+CLOSED_DEAL_STAGES = ['closed-won', 'closed-lost']
+
+def stage_win_rates(user_id=None):
+    """
+    Historical probability that an open deal ends up won, per open stage
+
+    For each stage: of the closed deals that passed through it, the share
+    that was won. Each stage is smoothed toward the account-wide win rate
+    (itself Laplace-smoothed) so stages with little history, or a brand new
+    account, do not forecast 0% or 100%.
+    """
+    query = db.session.query(Deal.stage, db.func.count(Deal.id)).filter(Deal.stage.in_(CLOSED_DEAL_STAGES))
+    if user_id is not None:
+        query = query.filter(Deal.user_id == user_id)
+    counts = dict(query.group_by(Deal.stage).all())
+    overall = (counts.get('closed-won', 0) + 1) / (counts.get('closed-won', 0) + counts.get('closed-lost', 0) + 2)
+
+    entered = db.select(DealStageHistory.deal_id, DealStageHistory.to_stage) \
+        .where(DealStageHistory.to_stage.in_(OPEN_DEAL_STAGES)).distinct()
+    if user_id is not None:
+        entered = entered.where(DealStageHistory.user_id == user_id)
+    entered = entered.subquery()
+    outcomes = db.session.execute(
+        db.select(entered.c.to_stage, Deal.stage, db.func.count())
+        .join(Deal, Deal.id == entered.c.deal_id)
+        .where(Deal.stage.in_(CLOSED_DEAL_STAGES))
+        .group_by(entered.c.to_stage, Deal.stage)
+    ).all()
+    won = {stage: 0 for stage in OPEN_DEAL_STAGES}
+    closed = dict(won)
+    for stage, outcome, count in outcomes:
+        closed[stage] += count
+        if outcome == 'closed-won':
+            won[stage] += count
+    return {stage: (won[stage] + 2 * overall) / (closed[stage] + 2) for stage in OPEN_DEAL_STAGES}
+
+def _stage_rank(column, stages=DEAL_STAGES):
+    """SQL CASE mapping a stage name to its index in stages (-1 if unknown)"""
+    return db.case(*[(column == stage, i) for i, stage in enumerate(stages)], else_=-1)
+
+def _days_between(start, end):
+    """SQL for the fractional number of days from start to end"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.cast(db.func.extract('epoch', end - start) / 86400.0, db.Float)
+    return db.cast(db.func.julianday(end) - db.func.julianday(start), db.Float)
+
+def _history_scope(query, user_id):
+    return query.where(DealStageHistory.user_id == user_id) if user_id is not None else query
+
+def _rank_key(stage):
+    return DEAL_STAGES.index(stage) if stage in DEAL_STAGES else len(DEAL_STAGES)
+
+def stage_funnel(user_id=None):
+    """
+    Stage-to-stage conversion from the stage history
+
+    `reached` counts deals that got at least as far as each pipeline stage
+    (skipping a stage still counts as passing it), `entered` counts deals
+    that actually entered it, and `transitions` gives the raw move counts
+    and the share of moves out of each stage that went to each next stage.
+    """
+    H = DealStageHistory
+    funnel_stages = OPEN_DEAL_STAGES + ['closed-won']
+    entered = dict(db.session.execute(
+        _history_scope(db.select(H.to_stage, db.func.count(db.distinct(H.deal_id))), user_id).group_by(H.to_stage)
+    ).all())
+
+    furthest = _history_scope(
+        db.select(db.func.max(_stage_rank(H.to_stage, funnel_stages)).label('rank')), user_id
+    ).group_by(H.deal_id).subquery()
+    furthest_counts = dict(db.session.execute(
+        db.select(furthest.c.rank, db.func.count()).group_by(furthest.c.rank)
+    ).all())
+
+    stages = []
+    reached = sum(count for rank, count in furthest_counts.items() if rank >= 0)
+    for rank, stage in enumerate(funnel_stages):
+        stages.append({'stage': stage, 'entered': entered.get(stage, 0), 'reached': reached})
+        reached -= furthest_counts.get(rank, 0)
+    for current, following in zip(stages, stages[1:]):
+        current['conversion_to_next'] = round(following['reached'] / current['reached'], 4) if current['reached'] else None
+    stages.append({'stage': 'closed-lost', 'entered': entered.get('closed-lost', 0)})
+
+    moves = db.session.execute(
+        _history_scope(db.select(H.from_stage, H.to_stage, db.func.count()), user_id)
+        .where(H.from_stage.isnot(None)).group_by(H.from_stage, H.to_stage)
+    ).all()
+    leaving = {}
+    for from_stage, _, count in moves:
+        leaving[from_stage] = leaving.get(from_stage, 0) + count
+    transitions = [{'from': from_stage, 'to': to_stage, 'count': count, 'rate': round(count / leaving[from_stage], 4)}
+                   for from_stage, to_stage, count in sorted(moves, key=lambda m: (_rank_key(m[0]), _rank_key(m[1])))]
+    return {'stages': stages, 'transitions': transitions}
+
+def stage_durations(user_id=None):
+    """
+    Days deals spend in each stage: median, mean and 90th percentile
+
+    A stay ends when the deal's next history row is written, found with a
+    LEAD() window in SQL; only the (stage, days) pairs are fetched and the
+    statistics are computed with NumPy. Stays that are still ongoing are
+    reported separately as `open`.
+    """
+    H = DealStageHistory
+    left_at = db.func.lead(H.changed_at).over(partition_by=H.deal_id, order_by=(H.changed_at, H.id))
+    stays = _history_scope(
+        db.select(H.to_stage.label('stage'), H.changed_at.label('entered_at'), left_at.label('left_at')), user_id
+    ).subquery()
+    stmt = db.select(
+        _stage_rank(stays.c.stage),
+        db.func.coalesce(_days_between(stays.c.entered_at, stays.c.left_at), -1.0)
+    )
+    result = db.session.connection().execute(stmt)
+    try:
+        rows = np.fromiter(result.cursor, dtype=[('stage', np.int64), ('days', np.float64)])
+    finally:
+        result.close()
+
+    durations = []
+    for rank, stage in enumerate(OPEN_DEAL_STAGES):
+        in_stage = rows['days'][rows['stage'] == rank]
+        done = in_stage[in_stage >= 0]
+        entry = {'stage': stage, 'completed': int(len(done)), 'open': int((in_stage < 0).sum()),
+                 'median_days': None, 'mean_days': None, 'p90_days': None}
+        if len(done):
+            median, p90 = np.percentile(done, [50, 90])
+            entry.update(median_days=round(float(median), 2), mean_days=round(float(done.mean()), 2),
+                         p90_days=round(float(p90), 2))
+        durations.append(entry)
+    return durations
+
+def deal_velocity(user_id=None, days=90):
+    """
+    Sales velocity over the last `days` days
+
+    velocity = open deals x win rate x average won value / average sales
+    cycle, i.e. the revenue per day the current pipeline is expected to
+    produce at the recent close rate.
+    """
+    H = DealStageHistory
+    since = datetime.utcnow() - timedelta(days=days)
+    closed = db.session.execute(
+        _history_scope(db.select(
+            H.to_stage, db.func.count(db.distinct(H.deal_id)), db.func.sum(Deal.value),
+            db.func.avg(_days_between(Deal.created_at, H.changed_at))
+        ), user_id).join(Deal, Deal.id == H.deal_id)
+        .where(H.to_stage.in_(CLOSED_DEAL_STAGES), H.changed_at >= since)
+        .group_by(H.to_stage)
+    ).all()
+    closed = {stage: (count, value or 0.0, cycle) for stage, count, value, cycle in closed}
+    won, won_value, cycle = closed.get('closed-won', (0, 0.0, None))
+    lost = closed.get('closed-lost', (0,))[0]
+
+    open_query = db.select(db.func.count(Deal.id)).where(Deal.stage.in_(OPEN_DEAL_STAGES))
+    if user_id is not None:
+        open_query = open_query.where(Deal.user_id == user_id)
+    open_deals = db.session.execute(open_query).scalar()
+
+    win_rate = won / (won + lost) if won + lost else None
+    average_value = won_value / won if won else None
+    velocity = None
+    if win_rate is not None and average_value is not None and cycle:
+        velocity = open_deals * win_rate * average_value / max(cycle, 1.0)
+    return {
+        'days': days,
+        'open_deals': open_deals,
+        'won': won,
+        'lost': lost,
+        'win_rate': round(win_rate, 4) if win_rate is not None else None,
+        'average_won_value': round(average_value, 2) if average_value is not None else None,
+        'average_cycle_days': round(cycle, 2) if cycle is not None else None,
+        'won_revenue': round(won_value, 2),
+        'velocity_per_day': round(velocity, 2) if velocity is not None else None,
+    }
+
+# Column arrays of open deals, reused until the owner's deals data version changes
+_open_deal_cache = OrderedDict()
+OPEN_DEAL_CACHE_SIZE = 32
+
+def open_deal_arrays(user_id=None):
+    """load_open_deals() cached per user (None = all users) and deals data version"""
+    versions = db.select(db.func.count(DataVersion.version), db.func.sum(DataVersion.version)).where(DataVersion.collection == 'deals')
+    if user_id is not None:
+        versions = versions.where(DataVersion.user_id == user_id)
+    version = tuple(db.session.execute(versions).one())
+
+    cached = _open_deal_cache.get(user_id)
+    record_cache('open_deals', cached is not None and cached[0] == version)
+    if cached is not None and cached[0] == version:
+        _open_deal_cache.move_to_end(user_id)
+        return cached[1]
+
+    deals = load_open_deals(db, Deal, OPEN_DEAL_STAGES, user_id)
+    _open_deal_cache[user_id] = (version, deals)
+    _open_deal_cache.move_to_end(user_id)
+    while len(_open_deal_cache) > OPEN_DEAL_CACHE_SIZE:
+        _open_deal_cache.popitem(last=False)
+    return deals
+
+def revenue_forecast(user_id=None, period='month', horizon=None, method='probability', simulations=1000):
+    """Weighted revenue forecast for one user (or everyone when user_id is None)"""
+    deals = open_deal_arrays(user_id)
+    win_rates = stage_win_rates(user_id) if method == 'historical' else None
+    result = forecast(deals, datetime.utcnow().date(), period=period, horizon=horizon or FORECAST_PERIODS[period],
+                      win_rates=win_rates, simulations=simulations, seed=0)
+    result['weighting'] = method
+    if win_rates is not None:
+        result['win_rates'] = {stage: round(rate, 4) for stage, rate in win_rates.items()}
+    return result
+
 @app.route('/analytics')
+@read_only
 @login_required
 def analytics():
-    # Get various statistics
-    total_contacts = Contact.query.filter_by(user_id=current_user.id).count()
-    total_deals = Deal.query.filter_by(user_id=current_user.id).count()
-    won_deals = Deal.query.filter_by(user_id=current_user.id, stage='closed-won').count()
-    lost_deals = Deal.query.filter_by(user_id=current_user.id, stage='closed-lost').count()
+    stats = {}
 
-    total_revenue = db.session.query(db.func.sum(Deal.value)).filter_by(user_id=current_user.id, stage='closed-won').scalar() or 0
-    pipeline_value = db.session.query(db.func.sum(Deal.value)).filter_by(user_id=current_user.id).filter(Deal.stage.in_(['lead', 'qualified', 'proposal', 'negotiation'])).scalar() or 0
+    def load_stats():
+        """Counts, monthly trends and forecast - called from the template only when its cached fragments are stale"""
+        if not stats:
+            stats.update(analytics_stats(current_user.id))
+        return stats
+
+    # Left as a query: the template only runs it when the cached activity list is stale
+    recent_activities = Activity.query.filter_by(user_id=current_user.id).order_by(Activity.created_at.desc()).limit(10)
 
-    # Deals by stage
+    return render_template('analytics.html',
+                         user=current_user,
+                         load_stats=load_stats,
+                         today=datetime.utcnow().date().isoformat(),
+                         recent_activities=recent_activities)
+
+def analytics_stats(user_id):
+    """Everything the analytics page shows except recent activity"""
+    total_contacts = Contact.query.filter_by(user_id=user_id).count()
+
+    # Deals by stage - counts and values in a single grouped query
     stages = ['lead', 'qualified', 'proposal', 'negotiation', 'closed-won', 'closed-lost']
-    deals_by_stage = {}
-    for stage in stages:
-        deals_by_stage[stage] = Deal.query.filter_by(user_id=current_user.id, stage=stage).count()
+    deals_by_stage = {stage: 0 for stage in stages}
+    value_by_stage = {stage: 0 for stage in stages}
+    stage_rows = db.session.query(Deal.stage, db.func.count(Deal.id), db.func.sum(Deal.value)).filter(
+        Deal.user_id == user_id
+    ).group_by(Deal.stage).all()
+    total_deals = 0
+    for stage, count, value in stage_rows:
+        total_deals += count
+        if stage in deals_by_stage:
+            deals_by_stage[stage] = count
+            value_by_stage[stage] = value or 0
+
+    won_deals = deals_by_stage['closed-won']
+    lost_deals = deals_by_stage['closed-lost']
+    total_revenue = value_by_stage['closed-won']
+    pipeline_value = sum(value_by_stage[stage] for stage in ['lead', 'qualified', 'proposal', 'negotiation'])
 
     # Win rate
     win_rate = (won_deals / total_deals * 100) if total_deals > 0 else 0
@@ -1418,9 +3108,7 @@ def analytics():
     # Monthly trends - contacts and deals created per month (last 6 months)
     import calendar
     monthly_labels = []
-    monthly_contacts = []
-    monthly_deals = []
-    monthly_revenue = []
+    month_bounds = []
     today = datetime.utcnow()
 
     for i in range(5, -1, -1):
@@ -1436,47 +3124,126 @@ def analytics():
             month_end = datetime(year, month + 1, 1)
 
         monthly_labels.append(calendar.month_abbr[month])
-        monthly_contacts.append(Contact.query.filter(
-            Contact.user_id == current_user.id,
-            Contact.created_at >= month_start,
-            Contact.created_at < month_end
-        ).count())
-        monthly_deals.append(Deal.query.filter(
-            Deal.user_id == current_user.id,
-            Deal.created_at >= month_start,
-            Deal.created_at < month_end
-        ).count())
-        monthly_revenue.append(float(db.session.query(db.func.sum(Deal.value)).filter(
-            Deal.user_id == current_user.id,
-            Deal.stage == 'closed-won',
-            Deal.created_at >= month_start,
-            Deal.created_at < month_end
-        ).scalar() or 0))
-
-    # Recent activities
-    recent_activities = Activity.query.filter_by(user_id=current_user.id).order_by(Activity.created_at.desc()).limit(10).all()
+        month_bounds.append((month_start, month_end))
+
+    # Bucket rows by month with a CASE expression so each model needs one query
+    def month_bucket(column):
+        return db.case(
+            *[((column >= start) & (column < end), index) for index, (start, end) in enumerate(month_bounds)],
+            else_=None
+        ).label('month')
+
+    monthly_contacts = [0] * len(month_bounds)
+    contact_month = month_bucket(Contact.created_at)
+    for month, count in db.session.query(contact_month, db.func.count(Contact.id)).filter(
+        Contact.user_id == user_id,
+        Contact.created_at >= month_bounds[0][0]
+    ).group_by(contact_month).all():
+        if month is not None:
+            monthly_contacts[month] = count
+
+    monthly_deals = [0] * len(month_bounds)
+    monthly_revenue = [0.0] * len(month_bounds)
+    deal_month = month_bucket(Deal.created_at)
+    won_value = db.func.sum(db.case((Deal.stage == 'closed-won', Deal.value), else_=0))
+    for month, count, revenue in db.session.query(deal_month, db.func.count(Deal.id), won_value).filter(
+        Deal.user_id == user_id,
+        Deal.created_at >= month_bounds[0][0]
+    ).group_by(deal_month).all():
+        if month is not None:
+            monthly_deals[month] = count
+            monthly_revenue[month] = float(revenue or 0)
 
     # Tasks stats
-    pending_tasks = Task.query.filter_by(user_id=current_user.id, completed=False).count()
-    completed_tasks = Task.query.filter_by(user_id=current_user.id, completed=True).count()
+    task_counts = dict(db.session.query(Task.completed, db.func.count(Task.id)).filter(
+        Task.user_id == user_id
+    ).group_by(Task.completed).all())
+    pending_tasks = task_counts.get(False, 0)
+    completed_tasks = task_counts.get(True, 0)
+
+    return {
+        'total_contacts': total_contacts,
+        'total_deals': total_deals,
+        'won_deals': won_deals,
+        'lost_deals': lost_deals,
+        'total_revenue': total_revenue,
+        'pipeline_value': pipeline_value,
+        'deals_by_stage': deals_by_stage,
+        'win_rate': win_rate,
+        'monthly_labels': monthly_labels,
+        'monthly_contacts': monthly_contacts,
+        'monthly_deals': monthly_deals,
+        'monthly_revenue': monthly_revenue,
+        'pending_tasks': pending_tasks,
+        'completed_tasks': completed_tasks,
+        'forecast': revenue_forecast(user_id)
+    }
 
-    return render_template('analytics.html',
-                         user=current_user,
-                         total_contacts=total_contacts,
-                         total_deals=total_deals,
-                         won_deals=won_deals,
-                         lost_deals=lost_deals,
-                         total_revenue=total_revenue,
-                         pipeline_value=pipeline_value,
-                         deals_by_stage=deals_by_stage,
-                         win_rate=win_rate,
-                         monthly_labels=monthly_labels,
-                         monthly_contacts=monthly_contacts,
-                         monthly_deals=monthly_deals,
-                         monthly_revenue=monthly_revenue,
-                         recent_activities=recent_activities,
-                         pending_tasks=pending_tasks,
-                         completed_tasks=completed_tasks)
+@app.route('/api/forecast', methods=['GET'])
+@read_only
+@require_api_key
+def api_forecast():
+    """Probability-weighted revenue forecast with confidence bands - for OpenClaw integration"""
+    period = request.args.get('period', 'month')
+    method = request.args.get('method', 'probability')
+    if period not in FORECAST_PERIODS or method not in ('probability', 'historical'):
+        return jsonify({'error': 'period must be month|week and method probability|historical'}), 400
+    try:
+        horizon = min(max(int(request.args.get('horizon', FORECAST_PERIODS[period])), 1), 104)
+        simulations = min(max(int(request.args.get('simulations', 1000)), 100), 10000)
+    except ValueError:
+        return jsonify({'error': 'horizon and simulations must be integers'}), 400
+
+    user_id, error = api_report_user()
+    if error:
+        return error
+
+    return jsonify({'success': True, 'forecast': revenue_forecast(user_id, period, horizon, method, simulations)})
+
+def api_report_user():
+    """(user_id, error response) for report APIs: ?username= (default admin), or user_id None with ?all_users=1"""
+    if request.args.get('all_users', '').lower() in ('1', 'true', 'yes'):
+        if shards.enabled:
+            return None, (jsonify({'error': 'all_users is not available when SHARDING is on'}), 400)
+        return None, None
+    user = User.query.filter_by(username=request.args.get('username', 'admin')).first()
+    if not user:
+        return None, (jsonify({'error': 'User not found'}), 404)
+    return user.id, None
+
+@app.route('/api/analytics/funnel', methods=['GET'])
+@read_only
+@require_api_key
+def api_stage_funnel():
+    """Stage-to-stage conversion rates from deal stage history"""
+    user_id, error = api_report_user()
+    if error:
+        return error
+    return jsonify({'success': True, 'funnel': stage_funnel(user_id)})
+
+@app.route('/api/analytics/stage-durations', methods=['GET'])
+@read_only
+@require_api_key
+def api_stage_durations():
+    """Median / mean / p90 days spent in each pipeline stage"""
+    user_id, error = api_report_user()
+    if error:
+        return error
+    return jsonify({'success': True, 'stages': stage_durations(user_id)})
+
+@app.route('/api/analytics/velocity', methods=['GET'])
+@read_only
+@require_api_key
+def api_deal_velocity():
+    """Sales velocity over the last ?days= (default 90) days"""
+    try:
+        days = min(max(int(request.args.get('days', 90)), 1), 3650)
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    user_id, error = api_report_user()
+    if error:
+        return error
+    return jsonify({'success': True, 'velocity': deal_velocity(user_id, days)})
 
 # ========== TASKS ROUTES ==========
 @app.route('/tasks')
@@ -1523,6 +3290,36 @@ def toggle_task(task_id):
 
     return jsonify({'success': True, 'completed': task.completed})
 
+@app.route('/tasks/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_tasks_route():
+    """Set priority or completion on many tasks in one transaction"""
+    data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    priority = data.get('priority') or None
+    completed = data.get('completed')
+    if completed not in (None, ''):
+        completed = str(completed).lower() in ('1', 'true', 'yes')
+    else:
+        completed = None
+    if priority and priority not in ['low', 'medium', 'high']:
+        return bulk_response('Invalid priority', 'tasks', error=True)
+    if priority is None and completed is None:
+        return bulk_response('Nothing to update', 'tasks', error=True)
+    try:
+        selection = bulk_selection(Task, current_user.id)
+    except ValueError:
+        return bulk_response('Invalid ids or filter', 'tasks', error=True)
+    if selection is None:
+        return bulk_response('No tasks selected', 'tasks', error=True)
+    try:
+        count = bulk_update_tasks(current_user.id, selection, priority=priority, completed=completed)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in bulk_update_tasks: {str(e)}")
+        return bulk_response(f'Error updating tasks: {str(e)}', 'tasks', error=True)
+    return bulk_response(f'{count} tasks updated', 'tasks', count=count)
+
 @app.route('/tasks/edit/<int:task_id>', methods=['POST'])
 @login_required
 def edit_task(task_id):
@@ -1556,6 +3353,18 @@ def delete_task(task_id):
     flash('Task deleted successfully!', 'success')
     return redirect(url_for('tasks'))
 
+# ========== LIVE UPDATES ==========
+@app.route('/live/events')
+@login_required
+def live_event_stream():
+    """Server-sent events with deal / task changes for the open pipeline and task pages"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return live_events.stream(current_user.id, last_event_id)
+
 # ========== NOTIFICATIONS ROUTES ==========
 @app.route('/notifications/settings', methods=['GET', 'POST'])
 @login_required
@@ -1741,6 +3550,7 @@ def init_database_route():
     try:
         # Create all tables
         db.create_all()
+        upgrade_schema()
 
         results = {
             'database_created': True,
@@ -1875,9 +3685,16 @@ def init_database_route():
             'trace': error_trace
         }), 500
 
-# Initialize database
-with app.app_context():
-    db.create_all()
+# Processes that only borrow the app's models and services (telegram_bot.py with
+# BOT_BACKEND=local) import it with COCOCRM_EMBEDDED=1: the schema is left to
+# the web app, and no webhook is registered - it would break the bot's polling
+EMBEDDED = os.environ.get('COCOCRM_EMBEDDED') == '1'
+
+if not EMBEDDED:
+    # Initialize database
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
 
 # Set up Telegram webhook on startup (in background to not block startup)
 def _setup_webhook():
@@ -1887,9 +3704,13 @@ def _setup_webhook():
     with app.app_context():
         set_telegram_webhook()
 
-_webhook_thread = threading.Thread(target=_setup_webhook)
-_webhook_thread.daemon = True
-_webhook_thread.start()
+if not EMBEDDED:
+    _webhook_thread = threading.Thread(target=_setup_webhook)
+    _webhook_thread.daemon = True
+    _webhook_thread.start()
 
 if __name__ == '__main__':
+    # The dev server runs jobs itself (only in the reloader's child, which serves requests)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start(int(os.environ.get('JOB_WORKERS', '1')))
     app.run(host='0.0.0.0', port=5000, debug=True)
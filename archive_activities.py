@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Move activities older than ACTIVITY_RETENTION_DAYS into monthly archive
+tables, drop archived months past ACTIVITY_ARCHIVE_MONTHS and compact the
+database
+Run from cron, e.g. nightly: python archive_activities.py
+"""
+import sys
+from datetime import datetime, timedelta
+
+from app import app, db, activity_archive, shards, touch_collections
+
+
+def touch_users(user_ids):
+    # Archived rows leave the default timeline, so cached pages must refresh
+    for user_id in user_ids:
+        touch_collections(user_id, 'activities')
+
+
+def archive_activities(retention_days=None):
+    with app.app_context():
+        db.create_all()
+        if retention_days is None:
+            retention_days = app.config['ACTIVITY_RETENTION_DAYS']
+        print(f"📦 Archiving activities older than {retention_days} days...")
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        # Once, or once per tenant database when sharding
+        for tenant_id in shards.each():
+            if tenant_id is not None:
+                print(f"👤 Tenant {tenant_id}")
+            moved = activity_archive.archive(cutoff, on_archived=touch_users)
+            print(f"✅ Archived {moved} activities")
+
+            for name in activity_archive.purge():
+                print(f"🗑️  Dropped {name}")
+
+            activity_archive.compact(db.session.get_bind())
+
+
+if __name__ == '__main__':
+    archive_activities(int(sys.argv[1]) if len(sys.argv) > 1 else None)
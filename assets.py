@@ -0,0 +1,168 @@
+"""
+Static asset pipeline for CocoCRM
+
+Page styles and scripts live in static/src. `python build_assets.py`
+minifies them, writes content-hashed copies (plus .gz/.br variants) to
+static/dist and records the mapping in static/dist/manifest.json.
+Templates link assets through `asset_url('css/pipeline.css')`. Built files
+are served from /assets/ with immutable far-future caching, since any
+change produces a new filename. Without a build (local development)
+asset_url falls back to the unminified source files.
+
+Third-party libraries are committed under static/src/vendor at a pinned
+version. The build never touches the network and fails if one is missing;
+`python build_assets.py vendor` downloads them when a pin is bumped. Until
+a library is committed, asset_url points at its pinned CDN URL so pages
+keep working.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import urllib.request
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Third-party files committed into static/src/vendor (pinned versions) instead
+# of being loaded from a CDN on every page view
+VENDOR_ASSETS = {
+    'vendor/chart.umd.min.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js',
+}
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+def init_assets(app):
+    """Register asset_url() for templates and the /assets/ route for built files"""
+    dist_dir = os.path.join(app.static_folder, 'dist')
+    manifest_path = os.path.join(dist_dir, 'manifest.json')
+    state = {'manifest': None, 'mtime': None}
+
+    missing = missing_vendor_assets(app.static_folder)
+    if missing:
+        print(f"⚠️ Missing vendored assets: {', '.join(missing)} - run python build_assets.py vendor and commit them")
+
+    def manifest():
+        try:
+            mtime = os.path.getmtime(manifest_path)
+        except OSError:
+            return {}
+        if mtime != state['mtime']:
+            with open(manifest_path) as f:
+                state['manifest'] = json.load(f)
+            state['mtime'] = mtime
+        return state['manifest']
+
+    @app.template_global()
+    def asset_url(name):
+        """URL of a built (fingerprinted) asset, or of its source when no build exists"""
+        built = manifest().get(name)
+        if built:
+            return url_for('assets', filename=built)
+        if name in missing:
+            return VENDOR_ASSETS[name]
+        return url_for('static', filename=f'src/{name}')
+
+    @app.route('/assets/<path:filename>')
+    def assets(filename):
+        """Fingerprinted assets: precompressed when possible, cached for a year"""
+        if filename.endswith(('.gz', '.br')) or filename == 'manifest.json':
+            abort(404)
+        offered = [enc for enc, ext in (('br', '.br'), ('gzip', '.gz'))
+                   if os.path.exists(os.path.join(dist_dir, filename + ext))]
+        encoding = request.accept_encodings.best_match(offered) if offered else None
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+
+        response = send_from_directory(
+            dist_dir, filename + suffix, max_age=ONE_YEAR,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if offered:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip() + '\n'
+
+
+def minify_js(js):
+    """Conservative minification: drops comment lines, indentation and blank lines"""
+    lines = []
+    for line in js.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def missing_vendor_assets(static_folder):
+    return [name for name in VENDOR_ASSETS if not os.path.exists(os.path.join(static_folder, 'src', name))]
+
+
+def fetch_vendor_assets(static_folder):
+    """Download the pinned third-party assets into static/src/vendor (to be committed)"""
+    for name, url in VENDOR_ASSETS.items():
+        path = os.path.join(static_folder, 'src', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"⬇️  Fetching {url}")
+        with urllib.request.urlopen(url, timeout=30) as response, open(path + '.tmp', 'wb') as f:
+            shutil.copyfileobj(response, f)
+        os.replace(path + '.tmp', path)
+
+
+def build_assets(static_folder):
+    """Minify and fingerprint everything in static/src into static/dist; returns the manifest"""
+    missing = missing_vendor_assets(static_folder)
+    if missing:
+        raise RuntimeError(f"Vendored assets missing from static/src: {', '.join(missing)} "
+                           f"(python build_assets.py vendor, then commit them)")
+    src_dir = os.path.join(static_folder, 'src')
+    dist_dir = os.path.join(static_folder, 'dist')
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for root, _, files in os.walk(src_dir):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, src_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            if name.endswith('.css'):
+                data = minify_css(data.decode('utf-8')).encode('utf-8')
+            elif name.endswith('.js') and not name.endswith('.min.js'):
+                data = minify_js(data.decode('utf-8')).encode('utf-8')
+
+            stem, ext = os.path.splitext(name)
+            built = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            out_path = os.path.join(dist_dir, built)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as f:
+                f.write(data)
+            with open(out_path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(out_path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+            manifest[name] = built
+            print(f"✅ {name} -> {built} ({len(data)} bytes)")
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
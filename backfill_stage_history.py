@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Backfill the deal stage history table from existing activity log text
+("Deal "X" moved from A to B") for deals created before history existed
+Moves are read from the activity table and every monthly archive table,
+so history older than ACTIVITY_RETENTION_DAYS is not lost
+Safe to re-run: deals whose history starts at creation are skipped, and
+for deals moved since the upgrade only the older moves are added
+"""
+import re
+import sys
+
+from app import app, db, activity_archive, shards, Activity, Deal, DealStageHistory
+
+BATCH_SIZE = 1000
+MOVE_PATTERN = re.compile(r' moved from (\S+) to (\S+)$')
+
+
+def history_rows(deal, moves, later_stage=None):
+    """Creation row plus one row per parsed move, oldest first"""
+    first_stage = moves[0][0] if moves else (later_stage or deal.stage)
+    created_at = deal.created_at or (moves[0][2] if moves else None)
+    rows = [{'user_id': deal.user_id, 'deal_id': deal.id, 'from_stage': None,
+             'to_stage': first_stage or 'lead', 'changed_at': created_at}]
+    for from_stage, to_stage, changed_at in moves:
+        rows.append({'user_id': deal.user_id, 'deal_id': deal.id, 'from_stage': from_stage,
+                     'to_stage': to_stage, 'changed_at': changed_at})
+    return [row for row in rows if row['changed_at'] is not None]
+
+
+def backfill_stage_history(batch_size=BATCH_SIZE):
+    with app.app_context():
+        db.create_all()
+        missing = ~db.exists().where(DealStageHistory.deal_id == Deal.id, DealStageHistory.from_stage.is_(None))
+        deals_done = rows_written = 0
+
+        # Once, or once per tenant database when sharding
+        for _ in shards.each():
+            last_id = 0
+            # Stage moves older than the retention window live in the archive tables
+            sources = [Activity.__table__] + [table for _, table in activity_archive.tables()]
+
+            while True:
+                deals = db.session.execute(
+                    db.select(Deal.id, Deal.user_id, Deal.stage, Deal.created_at)
+                    .where(Deal.id > last_id, missing).order_by(Deal.id).limit(batch_size)
+                ).all()
+                if not deals:
+                    break
+                last_id = deals[-1].id
+                deal_ids = [d.id for d in deals]
+                # Deals moved since the upgrade: earliest recorded move (time, stage it left)
+                recorded = {}
+                for deal_id, changed_at, from_stage in db.session.execute(
+                    db.select(DealStageHistory.deal_id, DealStageHistory.changed_at, DealStageHistory.from_stage)
+                    .where(DealStageHistory.deal_id.in_(deal_ids))
+                    .order_by(DealStageHistory.deal_id, DealStageHistory.changed_at, DealStageHistory.id)
+                ):
+                    recorded.setdefault(deal_id, (changed_at, from_stage))
+
+                moves = {}
+                activities = []
+                for source in sources:
+                    activities += db.session.execute(
+                        db.select(source.c.deal_id, source.c.description, source.c.created_at, source.c.id)
+                        .where(source.c.deal_id.in_(deal_ids), source.c.description.like('Deal "%" moved from % to %'))
+                    ).all()
+                activities.sort(key=lambda row: (row.deal_id, row.created_at, row.id))
+                for deal_id, description, created_at, _ in activities:
+                    match = MOVE_PATTERN.search(description or '')
+                    # Moves made after the upgrade are already in the table
+                    if match and (deal_id not in recorded or created_at < recorded[deal_id][0]):
+                        moves.setdefault(deal_id, []).append((match.group(1), match.group(2), created_at))
+
+                rows = [row for deal in deals for row in history_rows(deal, moves.get(deal.id, []), recorded.get(deal.id, (None, None))[1])]
+                if rows:
+                    db.session.execute(db.insert(DealStageHistory), rows)
+                db.session.commit()
+                deals_done += len(deals)
+                rows_written += len(rows)
+                print(f"  ... {deals_done} deals, {rows_written} history rows")
+
+        print(f"\n✅ Stage history backfilled for {deals_done} deals ({rows_written} rows)")
+
+
+if __name__ == '__main__':
+    backfill_stage_history(int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE)
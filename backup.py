@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Online backups of the CRM database - safe to run while the app is serving
+Snapshots go to BACKUP_DIR (gzipped, with a .sha256 checksum), keeping the
+newest BACKUP_KEEP. Run from cron, e.g. nightly: python backup.py
+Usage: python backup.py [take | list | verify NAME | restore NAME]
+"""
+import sys
+
+from app import snapshots
+
+
+def main(args):
+    command = args[0] if args else 'take'
+    if command == 'take':
+        snapshots.take()
+    elif command == 'list':
+        backups = snapshots.list()
+        for snapshot in backups:
+            print(f"  {snapshot['name']}  {snapshot['size'] / 1e6:8.1f} MB  {snapshot['created_at']:%Y-%m-%d %H:%M:%S} UTC")
+        print(f"\n{len(backups)} snapshots in {snapshots.directory}")
+    elif command == 'verify' and len(args) == 2:
+        snapshots.verify(args[1])
+        print(f"✅ {args[1]} checksum OK")
+    elif command == 'restore' and len(args) == 2:
+        snapshots.restore(args[1])
+        print("⚠️ Restart the app and job worker so their caches are rebuilt")
+    else:
+        print(__doc__.strip().splitlines()[-1])
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
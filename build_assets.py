@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Build static assets: minify and fingerprint everything in static/src
+into static/dist (fails if a vendored library is missing)
+Run on every deploy (part of the build command); `vendor` downloads the
+pinned third-party files into static/src/vendor for committing
+Usage: python build_assets.py [vendor]
+"""
+import os
+import sys
+
+from assets import build_assets, fetch_vendor_assets
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['vendor']:
+        fetch_vendor_assets(STATIC_FOLDER)
+        print("\n✅ Vendored assets updated - commit static/src/vendor")
+        sys.exit(0)
+    try:
+        manifest = build_assets(STATIC_FOLDER)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"\n✅ Built {len(manifest)} assets into static/dist")
@@ -0,0 +1,124 @@
+"""
+Bulk data export for CocoCRM (warehouse loads)
+
+Streams query results as JSON Lines or Parquet. Rows arrive in batches
+(from a `yield_per` cursor) and each batch is encoded and sent before the
+next is fetched, so memory stays bounded however large the account is:
+
+- JSON Lines: one object per row, flushed every EXPORT_FLUSH_BYTES.
+- Parquet: one row group per batch; the file footer goes out at the end.
+  Needs pyarrow (optional - without it only JSON Lines is available).
+"""
+import json
+from datetime import date, datetime
+
+from sqlalchemy import types
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, JSON Lines needs nothing extra
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+def available_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pa is not None]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def jsonl_chunks(columns, batches):
+    """Encoded JSON Lines for batches of rows (tuples in `columns` order)"""
+    names = [column.name for column in columns]
+    buffer = []
+    size = 0
+    for batch in batches:
+        for row in batch:
+            line = json.dumps(dict(zip(names, row)), default=_json_default, ensure_ascii=False) + '\n'
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_FLUSH_BYTES:
+                yield ''.join(buffer).encode()
+                buffer, size = [], 0
+    yield ''.join(buffer).encode()
+
+
+def _arrow_type(column):
+    column_type = column.type
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, types.Integer):
+        return pa.int64()
+    if isinstance(column_type, types.Float):
+        return pa.float64()
+    if isinstance(column_type, types.DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, types.Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(columns):
+    """Parquet schema for table columns, so types are right even for empty or all-NULL batches"""
+    return pa.schema([pa.field(column.name, _arrow_type(column), nullable=column.nullable) for column in columns])
+
+
+class _StreamSink:
+    """Write-only file for ParquetWriter whose contents can be drained while writing"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Total bytes written - the writer records row group offsets from this
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(columns, batches, compression='zstd'):
+    """Parquet file bytes for batches of rows (tuples in `columns` order), one row group per batch"""
+    if pa is None:
+        raise RuntimeError('Parquet export needs pyarrow (pip install pyarrow)')
+    schema = arrow_schema(columns)
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in batches:
+            rows = list(batch)
+            if not rows:
+                continue
+            arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
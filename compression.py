@@ -0,0 +1,110 @@
+"""
+Response compression for CocoCRM
+
+Negotiates brotli (when the optional `brotli` package is installed) or gzip
+from Accept-Encoding and compresses HTML, JSON, CSV, CSS and JS responses
+above a size threshold. Streamed (generator) responses are compressed
+chunk by chunk, so exports stay streaming. Levels are set per content type
+through COMPRESS_GZIP_LEVELS / COMPRESS_BROTLI_LEVELS.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+DEFAULT_GZIP_LEVELS = {
+    'text/html': 6,
+    'application/json': 6,
+    'text/csv': 6,
+    'text/css': 9,
+    'application/javascript': 9,
+    'text/javascript': 9,
+}
+
+DEFAULT_BROTLI_LEVELS = {
+    'text/html': 5,
+    'application/json': 5,
+    'text/csv': 4,
+    'text/css': 11,
+    'application/javascript': 11,
+    'text/javascript': 11,
+}
+
+
+def init_compression(app):
+    """Register the after_request hook that compresses eligible responses"""
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_GZIP_LEVELS', dict(DEFAULT_GZIP_LEVELS))
+    app.config.setdefault('COMPRESS_BROTLI_LEVELS', dict(DEFAULT_BROTLI_LEVELS))
+
+    @app.after_request
+    def _compress_response(response):
+        if not app.config['COMPRESS_ENABLED']:
+            return response
+        return compress_response(app, response)
+
+
+def _choose_encoding(mimetype, config):
+    offered = []
+    if brotli is not None and mimetype in config['COMPRESS_BROTLI_LEVELS']:
+        offered.append('br')
+    if mimetype in config['COMPRESS_GZIP_LEVELS']:
+        offered.append('gzip')
+    return request.accept_encodings.best_match(offered) if offered else None
+
+
+def _compressor(encoding, level):
+    """Return (compress, flush) callables for an incremental compressor"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    return compressor.compress, compressor.flush
+
+
+def compress_response(app, response):
+    """Compress a response in place when the client and content type allow it"""
+    mimetype = response.mimetype
+    if (response.status_code < 200 or response.status_code >= 300 or response.status_code == 204
+            or request.method == 'HEAD' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or mimetype not in app.config['COMPRESS_GZIP_LEVELS']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(mimetype, app.config)
+    if not encoding:
+        return response
+
+    levels = app.config['COMPRESS_BROTLI_LEVELS' if encoding == 'br' else 'COMPRESS_GZIP_LEVELS']
+    compress, flush = _compressor(encoding, levels[mimetype])
+
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+
+        def generate():
+            for chunk in chunks:
+                data = compress(chunk)
+                if data:
+                    yield data
+            yield flush()
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data) + flush())
+
+    response.headers['Content-Encoding'] = encoding
+    # The encoded body differs byte-wise, so a strong validator would be wrong
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,294 @@
+"""
+Duplicate contact detection for CocoCRM
+
+Instead of comparing every pair of contacts, each contact gets a few
+blocking keys - normalized email, E.164 phone, and a phonetic key of the
+name plus company - stored in an indexed table. Only contacts sharing a key
+are compared and scored, so a full scan is near-linear and checking one new
+contact is a couple of index lookups. Keys shared by more than
+MAX_BLOCK_SIZE contacts (e.g. a team inbox) are too common to be evidence
+and are skipped.
+
+Candidate pairs above MATCH_THRESHOLD are stored for review; merging is
+done by the app (see merge_contacts in app.py).
+"""
+import difflib
+import os
+import re
+import unicodedata
+from datetime import datetime
+
+DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_PHONE_COUNTRY_CODE', '1')
+MAX_BLOCK_SIZE = 50
+MATCH_THRESHOLD = 0.55
+KEY_BATCH_SIZE = 5000
+
+# Words that say nothing about which company it is
+COMPANY_STOPWORDS = {'the', 'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company', 'gmbh', 'sa', 'ag', 'plc', 'group'}
+SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
+
+
+def normalize_email(email):
+    """Lower-cased, trimmed email, or None"""
+    email = (email or '').strip().lower()
+    return email if '@' in email else None
+
+
+def normalize_phone(phone, country_code=DEFAULT_COUNTRY_CODE):
+    """
+    Best-effort E.164 (+15550102000), or None
+
+    Numbers without a country prefix are assumed to be national numbers of
+    DEFAULT_PHONE_COUNTRY_CODE (10 digits for NANP).
+    """
+    phone = (phone or '').strip()
+    digits = re.sub(r'\D', '', phone)
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif country_code == '1' and len(digits) == 11 and digits.startswith('1'):
+        pass
+    elif len(digits) >= 7:
+        digits = country_code + digits.lstrip('0')
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r'[a-z0-9]+', text)
+
+
+def soundex(word):
+    """American Soundex code of one word (Robert -> R163)"""
+    letters = [c for c in word.lower() if c.isalpha()]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit != '0' and digit != previous:
+            code += digit
+        if c not in 'hw':
+            previous = digit
+    return code[:4].ljust(4, '0')
+
+
+def _phonetic(word):
+    # Soundex only makes sense for letters; keep codes like "co123" verbatim
+    return soundex(word) if word.isalpha() else word
+
+
+def name_key(name, company=None):
+    """Phonetic key: sorted Soundex of the name words plus the first meaningful company word"""
+    words = sorted(_phonetic(w) for w in _words(name))
+    if not words:
+        return None
+    company_words = [w for w in _words(company) if w not in COMPANY_STOPWORDS]
+    return '-'.join(words) + '|' + (_phonetic(company_words[0]) if company_words else '')
+
+
+def blocking_keys(name, email, phone, company):
+    keys = []
+    email = normalize_email(email)
+    if email:
+        keys.append('e:' + email)
+    phone = normalize_phone(phone)
+    if phone:
+        keys.append('p:' + phone)
+    key = name_key(name, company)
+    if key:
+        keys.append('n:' + key)
+    return keys
+
+
+def prepare(name, email, phone, company):
+    """Normalized (name, name sounds, email, phone, company) of a record, computed once for score()"""
+    words = sorted(_words(name))
+    company = ' '.join(w for w in _words(company) if w not in COMPANY_STOPWORDS)
+    return ' '.join(words), sorted(map(_phonetic, words)), normalize_email(email), normalize_phone(phone), company
+
+
+def score(a, b, threshold=0.0):
+    """
+    Likelihood (0-1) that two prepare()d records are the same person
+
+    Name similarity carries most weight; a matching email or phone adds a
+    lot, a conflicting one takes some away. Pairs that provably cannot reach
+    threshold score 0 without running the (slow) string comparison.
+    """
+    name_a, sounds_a, email_a, phone_a, company_a = a
+    name_b, sounds_b, email_b, phone_b, company_b = b
+    total = 0.0
+    if email_a and email_b:
+        total += 0.35 if email_a == email_b else -0.2
+    if phone_a and phone_b:
+        total += 0.3 if phone_a == phone_b else -0.1
+    company_weight = 0.1 if company_a and company_b else 0.0
+
+    if not name_a or not name_b:
+        name_similarity = 0.0
+    elif name_a == name_b:
+        name_similarity = 1.0
+    else:
+        matcher = difflib.SequenceMatcher(None, name_a, name_b)
+        needed = (threshold - total - company_weight) / 0.5
+        if sounds_a and sounds_a == sounds_b:
+            # Sounds the same: typos like "Jonh Smtih" score low on characters alone
+            name_similarity = max(matcher.ratio(), 0.9)
+        elif matcher.real_quick_ratio() < needed or matcher.quick_ratio() < needed:
+            return 0.0
+        else:
+            name_similarity = matcher.ratio()
+    total += 0.5 * name_similarity
+
+    if company_weight:
+        total += company_weight * (1.0 if company_a == company_b else
+                                   difflib.SequenceMatcher(None, company_a, company_b).ratio())
+    return round(max(0.0, min(total, 1.0)), 4)
+
+
+class ContactDeduper:
+    """Maintains blocking keys and duplicate candidates for a contact model"""
+
+    def __init__(self, db, contact_model, key_model, pair_model):
+        self.db = db
+        self.contact = contact_model
+        self.key = key_model
+        self.pair = pair_model
+
+    def _fields(self):
+        contact = self.contact
+        return contact.id, contact.name, contact.email, contact.phone, contact.company
+
+    def check(self, connection, contact):
+        """
+        Re-key one contact after a write and record its candidate duplicates
+
+        Runs inside the writing transaction (called from after_flush).
+        Returns the number of candidate pairs recorded.
+        """
+        db, key_table, pair_table = self.db, self.key.__table__, self.pair.__table__
+        keys = blocking_keys(contact.name, contact.email, contact.phone, contact.company)
+        connection.execute(key_table.delete().where(key_table.c.contact_id == contact.id))
+        connection.execute(pair_table.delete().where(
+            db.or_(pair_table.c.contact_id == contact.id, pair_table.c.duplicate_id == contact.id),
+            pair_table.c.dismissed == False  # noqa: E712
+        ))
+        if not keys:
+            return 0
+        connection.execute(key_table.insert(), [
+            {'user_id': contact.user_id, 'contact_id': contact.id, 'key': key} for key in keys
+        ])
+
+        candidate_ids = connection.execute(
+            db.select(key_table.c.contact_id).where(
+                key_table.c.user_id == contact.user_id, key_table.c.key.in_(keys), key_table.c.contact_id != contact.id
+            ).distinct().limit(MAX_BLOCK_SIZE * len(keys))
+        ).scalars().all()
+        if not candidate_ids:
+            return 0
+        record = prepare(contact.name, contact.email, contact.phone, contact.company)
+        candidates = connection.execute(db.select(*self._fields()).where(self.contact.id.in_(candidate_ids))).all()
+        dismissed = self._dismissed(connection, contact.user_id, contact.id)
+        pairs = []
+        for other in candidates:
+            pair = (min(contact.id, other[0]), max(contact.id, other[0]))
+            value = score(record, prepare(*other[1:]), MATCH_THRESHOLD)
+            if value >= MATCH_THRESHOLD and pair not in dismissed:
+                pairs.append(pair + (value,))
+        self._insert_pairs(connection, contact.user_id, pairs)
+        return len(pairs)
+
+    def scan(self, user_id, threshold=MATCH_THRESHOLD, max_block_size=MAX_BLOCK_SIZE):
+        """
+        Rebuild blocking keys and candidate pairs for every contact of one user
+
+        Keys are recomputed in batches, blocks are found with GROUP BY in SQL
+        and only contacts that share a block are loaded and scored. Commits
+        as it goes; returns the number of candidate pairs.
+        """
+        db, contact = self.db, self.contact
+        key_table, pair_table = self.key.__table__, self.pair.__table__
+        db.session.execute(key_table.delete().where(key_table.c.user_id == user_id))
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(*self._fields()).where(contact.user_id == user_id, contact.id > last_id)
+                .order_by(contact.id).limit(KEY_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            keys = [{'user_id': user_id, 'contact_id': row[0], 'key': key}
+                    for row in rows for key in blocking_keys(row[1], row[2], row[3], row[4])]
+            if keys:
+                db.session.execute(key_table.insert(), keys)
+        db.session.commit()
+
+        shared = db.select(key_table.c.key).where(key_table.c.user_id == user_id) \
+            .group_by(key_table.c.key).having(db.func.count().between(2, max_block_size))
+        members = db.session.execute(
+            db.select(key_table.c.key, key_table.c.contact_id)
+            .where(key_table.c.user_id == user_id, key_table.c.key.in_(shared))
+            .order_by(key_table.c.key)
+        )
+        pairs = set()
+        block, block_key = [], None
+        for key, contact_id in members:
+            if key != block_key:
+                pairs.update(_block_pairs(block))
+                block, block_key = [], key
+            block.append(contact_id)
+        pairs.update(_block_pairs(block))
+
+        dismissed = self._dismissed(db.session, user_id)
+        db.session.execute(pair_table.delete().where(pair_table.c.user_id == user_id, pair_table.c.dismissed == False))  # noqa: E712
+        found = 0
+        pairs = sorted(pairs - dismissed)
+        for start in range(0, len(pairs), KEY_BATCH_SIZE):
+            chunk = pairs[start:start + KEY_BATCH_SIZE]
+            ids = {contact_id for pair in chunk for contact_id in pair}
+            records = {row[0]: prepare(*row[1:]) for row in db.session.execute(
+                db.select(*self._fields()).where(contact.id.in_(ids))
+            )}
+            scored = [(a, b, score(records[a], records[b], threshold)) for a, b in chunk if a in records and b in records]
+            scored = [pair for pair in scored if pair[2] >= threshold]
+            self._insert_pairs(db.session, user_id, scored)
+            db.session.commit()
+            found += len(scored)
+        return found
+
+    def forget(self, contact_ids):
+        """Drop keys and candidate pairs of contacts about to be deleted (caller commits)"""
+        db, key_table, pair_table = self.db, self.key.__table__, self.pair.__table__
+        db.session.execute(key_table.delete().where(key_table.c.contact_id.in_(contact_ids)))
+        db.session.execute(pair_table.delete().where(
+            db.or_(pair_table.c.contact_id.in_(contact_ids), pair_table.c.duplicate_id.in_(contact_ids))
+        ))
+
+    def _dismissed(self, connection, user_id, contact_id=None):
+        pair_table = self.pair.__table__
+        query = self.db.select(pair_table.c.contact_id, pair_table.c.duplicate_id).where(
+            pair_table.c.user_id == user_id, pair_table.c.dismissed == True  # noqa: E712
+        )
+        if contact_id is not None:
+            query = query.where(self.db.or_(pair_table.c.contact_id == contact_id, pair_table.c.duplicate_id == contact_id))
+        return {tuple(row) for row in connection.execute(query)}
+
+    def _insert_pairs(self, connection, user_id, pairs):
+        if pairs:
+            now = datetime.utcnow()
+            connection.execute(self.pair.__table__.insert(), [
+                {'user_id': user_id, 'contact_id': a, 'duplicate_id': b, 'score': value,
+                 'dismissed': False, 'created_at': now}
+                for a, b, value in pairs
+            ])
+
+
+def _block_pairs(ids):
+    ids = sorted(set(ids))
+    return [(a, b) for i, a in enumerate(ids) for b in ids[i + 1:]]
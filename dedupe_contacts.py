@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Full duplicate-contact scan: rebuilds blocking keys and candidate pairs
+New and edited contacts are checked automatically; run this once after
+upgrading, and whenever the matching rules change
+Usage: python dedupe_contacts.py [username]
+"""
+import sys
+import time
+
+from app import app, db, deduper, shards, User
+
+
+def dedupe_contacts(username=None):
+    with app.app_context():
+        db.create_all()
+        query = db.select(User.id, User.username).order_by(User.id)
+        users = db.session.execute(query.where(User.username == username) if username else query).all()
+        total = 0
+        started = time.monotonic()
+        for user in users:
+            user_started = time.monotonic()
+            with shards.tenant(user.id):
+                found = deduper.scan(user.id)
+            total += found
+            print(f"  👤 {user.username}: {found} candidate pairs ({time.monotonic() - user_started:.1f}s)")
+        print(f"\n✅ Found {total} candidate duplicate pairs in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    dedupe_contacts(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,147 @@
+"""
+Pipeline revenue forecasting for CocoCRM
+
+Open deals are loaded into NumPy column arrays with a single query and all
+maths runs vectorized over those arrays, so a million deals forecast in a
+fraction of a second. Each deal is weighted by either its own probability
+or a historical win rate for its stage, then bucketed by expected close
+week or month. Confidence bands come from a Monte Carlo simulation of deal
+outcomes, or from the normal approximation of the same sum of Bernoulli
+variables when the pipeline is too large to simulate cheaply.
+"""
+import numpy as np
+
+DEFAULT_SIMULATIONS = 1000
+# Above this many deal x simulation cells the normal approximation is used
+MAX_SIMULATION_CELLS = 5_000_000
+Z_90 = 1.2815515655446004  # 10th / 90th percentile of the standard normal
+
+
+DEAL_COLUMNS = np.dtype([
+    ('value', np.float64),
+    ('probability', np.float64),
+    ('close_date', 'U10'),
+    ('stage', np.int64),
+])
+
+
+def load_open_deals(db, model, open_stages, user_id=None):
+    """
+    Return column arrays (value, probability, close_date, stage) for open deals
+
+    NULLs are replaced and stages encoded as integers in SQL, so the raw
+    DB-API rows can be packed straight into a structured array without
+    building ORM objects or SQLAlchemy rows.
+    """
+    stage_code = db.case(*[(model.stage == stage, i) for i, stage in enumerate(open_stages)], else_=-1)
+    stmt = db.select(
+        db.func.coalesce(model.value, 0.0),
+        db.func.coalesce(model.probability, 0),
+        db.func.coalesce(db.cast(model.expected_close_date, db.String), ''),
+        stage_code
+    ).where(model.stage.in_(open_stages))
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+
+    result = db.session.connection().execute(stmt)
+    try:
+        rows = np.fromiter(result.cursor, dtype=DEAL_COLUMNS)
+    finally:
+        result.close()
+
+    return {
+        'value': rows['value'],
+        'probability': np.clip(rows['probability'], 0, 100) / 100.0,
+        # numpy parses ISO dates in C; '' (no close date) becomes NaT
+        'close_date': rows['close_date'].astype('datetime64[D]'),
+        'stage': rows['stage'],
+        'stages': list(open_stages)
+    }
+
+
+def period_starts(today, period, horizon):
+    """First day of each forecast bucket, starting with the current week/month"""
+    today = np.datetime64(today, 'D')
+    if period == 'week':
+        # datetime64 day 0 (1970-01-01) was a Thursday; shift to Monday-based weeks
+        monday = today - ((today.astype(np.int64) + 3) % 7)
+        return monday + 7 * np.arange(horizon)
+    month = today.astype('datetime64[M]')
+    return (month + np.arange(horizon)).astype('datetime64[D]')
+
+
+def bucket_index(close_date, starts, today):
+    """Bucket of each deal; overdue deals fall in the first bucket, undated/out of range get -1"""
+    dates = np.where(close_date < np.datetime64(today, 'D'), np.datetime64(today, 'D'), close_date)
+    index = np.searchsorted(starts, dates, side='right') - 1
+    if len(starts) > 1:
+        end = starts[-1] + (starts[-1] - starts[-2])
+    else:
+        end = starts[-1] + 31
+    out_of_range = np.isnat(close_date) | (dates >= end) | (index < 0)
+    return np.where(out_of_range, -1, index)
+
+
+def forecast(deals, today, period='month', horizon=6, win_rates=None,
+             simulations=DEFAULT_SIMULATIONS, seed=None):
+    """
+    Weighted revenue per bucket with 10/50/90 percentile bands
+
+    win_rates maps stage name -> probability of winning; when given it
+    replaces each deal's own probability field.
+    """
+    value = deals['value']
+    if win_rates is not None:
+        rates = np.array([win_rates.get(stage, 0.0) for stage in deals['stages']], dtype=np.float64)
+        p = rates[deals['stage']] if len(value) else np.zeros(0)
+    else:
+        p = deals['probability']
+
+    starts = period_starts(today, period, horizon)
+    index = bucket_index(deals['close_date'], starts, today)
+    scheduled = index >= 0
+    idx, v, p_in = index[scheduled], value[scheduled], p[scheduled]
+
+    expected = np.bincount(idx, weights=v * p_in, minlength=horizon)
+    pipeline = np.bincount(idx, weights=v, minlength=horizon)
+    counts = np.bincount(idx, minlength=horizon)
+
+    if len(idx) and len(idx) * simulations <= MAX_SIMULATION_CELLS:
+        method = 'monte_carlo'
+        low, median, high = _simulate(idx, v, p_in, horizon, simulations, seed)
+    else:
+        method = 'normal'
+        # Sum of independent Bernoulli(p) * value: mean sum(p v), variance sum(p (1-p) v^2)
+        std = np.sqrt(np.bincount(idx, weights=p_in * (1 - p_in) * v * v, minlength=horizon))
+        low, median, high = np.maximum(expected - Z_90 * std, 0), expected, expected + Z_90 * std
+
+    unscheduled = ~scheduled
+    return {
+        'period': period,
+        'method': method,
+        'buckets': [{
+            'start': str(starts[i]),
+            'deals': int(counts[i]),
+            'pipeline': round(float(pipeline[i]), 2),
+            'expected': round(float(expected[i]), 2),
+            'p10': round(float(low[i]), 2),
+            'p50': round(float(median[i]), 2),
+            'p90': round(float(high[i]), 2),
+        } for i in range(horizon)],
+        'unscheduled': {
+            'deals': int(unscheduled.sum()),
+            'pipeline': round(float(value[unscheduled].sum()), 2),
+            'expected': round(float((value * p)[unscheduled].sum()), 2),
+        },
+        'total_expected': round(float((value * p).sum()), 2),
+    }
+
+
+def _simulate(idx, value, p, horizon, simulations, seed):
+    """Percentiles of simulated revenue per bucket: wins (sims x deals) @ one-hot buckets"""
+    rng = np.random.default_rng(seed)
+    wins = rng.random((simulations, len(p))) < p
+    buckets = np.zeros((len(p), horizon))
+    buckets[np.arange(len(p)), idx] = value
+    revenue = wins @ buckets
+    return np.percentile(revenue, [10, 50, 90], axis=0)
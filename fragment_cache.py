@@ -0,0 +1,162 @@
+"""
+Template fragment cache for CocoCRM
+
+Adds a `{% cache %}` block to Jinja templates:
+
+    {% cache 'pipeline-board', data_version('deals', 'contacts') %}
+        ... expensive loop ...
+    {% endcache %}
+
+All arguments form the key, and the key prefix (current user and build by
+default) is added automatically, so fragments are never shared between
+users. Put a data version in the key: when the data changes the key changes
+and the stale entry simply ages out. Backends are a bounded in-process LRU
+(default) or a directory on disk shared by all workers.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from metrics import record_cache
+
+
+class MemoryBackend:
+    """LRU bounded by entry count and total characters"""
+
+    def __init__(self, max_entries=2000, max_size=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class DiskBackend:
+    """One file per fragment; files untouched for max_age seconds are pruned"""
+
+    def __init__(self, directory, max_age=86400):
+        self.directory = directory
+        self.max_age = max_age
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.html')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+        self.writes += 1
+        if self.writes % 500 == 0:
+            self.prune()
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension implementing {% cache key, ... %}...{% endcache %}"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_prefix=lambda: ())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, parts, caller):
+        backend = self.environment.fragment_cache
+        if backend is None:
+            return caller()
+
+        raw = repr((tuple(self.environment.fragment_cache_prefix()), tuple(parts)))
+        key = hashlib.sha1(raw.encode()).hexdigest()
+        cached = backend.get(key)
+        record_cache('fragment', cached is not None)
+        if cached is not None:
+            return Markup(cached)
+
+        rendered = caller()
+        backend.set(key, str(rendered))
+        return rendered
+
+
+def init_fragment_cache(app, key_prefix):
+    """Enable {% cache %} in app templates; key_prefix() returns values added to every key"""
+    app.config.setdefault('FRAGMENT_CACHE_BACKEND', os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory'))
+    app.config.setdefault('FRAGMENT_CACHE_MAX_ENTRIES', 2000)
+    app.config.setdefault('FRAGMENT_CACHE_MAX_SIZE', 32 * 1024 * 1024)
+    app.config.setdefault('FRAGMENT_CACHE_DIR', os.environ.get('FRAGMENT_CACHE_DIR', '/tmp/cococrm-fragments'))
+    app.config.setdefault('FRAGMENT_CACHE_DISK_MAX_AGE', 86400)
+
+    backend_name = app.config['FRAGMENT_CACHE_BACKEND']
+    if backend_name == 'memory':
+        backend = MemoryBackend(app.config['FRAGMENT_CACHE_MAX_ENTRIES'], app.config['FRAGMENT_CACHE_MAX_SIZE'])
+    elif backend_name == 'disk':
+        backend = DiskBackend(app.config['FRAGMENT_CACHE_DIR'], app.config['FRAGMENT_CACHE_DISK_MAX_AGE'])
+    else:
+        backend = None  # 'none' turns every {% cache %} block into a plain block
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = backend
+    app.jinja_env.fragment_cache_prefix = key_prefix
+    return backend
@@ -0,0 +1,129 @@
+"""
+Typo-tolerant contact search for CocoCRM
+
+Each contact's name and company are split into trigrams (pg_trgm style:
+every word padded as "  word " and cut into 3-character pieces) and stored
+in an inverted index table keyed by (user_id, trigram). A query looks up
+its own trigrams, lets the database count shared trigrams per contact
+using only the index, and re-ranks the best few hundred candidates in
+Python. "Jonh Smtih" still shares enough trigrams with "John Smith" to be
+found, and the word-level re-ranking puts it first.
+"""
+import difflib
+import re
+import unicodedata
+
+CANDIDATE_LIMIT = 200
+MIN_SCORE = 0.3
+INDEX_BATCH_SIZE = 5000
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r'[a-z0-9]+', text)
+
+
+def trigrams(text):
+    grams = set()
+    for word in _words(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(query, text):
+    """
+    0-1 match quality of query against text
+
+    Mean of trigram overlap (Jaccard) and how well each query word matches
+    its closest word in text, so both typos and partial words rank well.
+    """
+    query_words, text_words = _words(query), _words(text)
+    if not query_words or not text_words:
+        return 0.0
+    query_grams, text_grams = trigrams(query), trigrams(text)
+    shared = len(query_grams & text_grams)
+    overlap = shared / (len(query_grams) + len(text_grams) - shared)
+
+    word_scores = []
+    for word in query_words:
+        best = 0.0
+        for candidate in text_words:
+            if candidate.startswith(word):
+                best = 1.0
+                break
+            best = max(best, difflib.SequenceMatcher(None, word, candidate).ratio())
+        word_scores.append(best)
+    return round((overlap + sum(word_scores) / len(word_scores)) / 2, 4)
+
+
+class TrigramIndex:
+    """Inverted trigram index over the name and company of a contact model"""
+
+    def __init__(self, db, contact_model, trigram_model):
+        self.db = db
+        self.contact = contact_model
+        self.trigram = trigram_model
+
+    def _text(self, name, company):
+        return f'{name or ""} {company or ""}'
+
+    def index(self, connection, contact):
+        """Replace one contact's trigrams (called from after_flush, inside the write)"""
+        table = self.trigram.__table__
+        connection.execute(table.delete().where(table.c.contact_id == contact.id))
+        grams = trigrams(self._text(contact.name, contact.company))
+        if grams:
+            connection.execute(table.insert(), [
+                {'user_id': contact.user_id, 'trigram': gram, 'contact_id': contact.id} for gram in grams
+            ])
+
+    def rebuild(self, user_id=None):
+        """Re-index every contact (of one user, or all) in committed batches; returns contacts indexed"""
+        db, contact, table = self.db, self.contact, self.trigram.__table__
+        scope = [contact.user_id == user_id] if user_id is not None else []
+        db.session.execute(table.delete().where(table.c.user_id == user_id) if user_id is not None else table.delete())
+        last_id = done = 0
+        while True:
+            rows = db.session.execute(
+                db.select(contact.id, contact.user_id, contact.name, contact.company)
+                .where(contact.id > last_id, *scope).order_by(contact.id).limit(INDEX_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            grams = [{'user_id': row.user_id, 'trigram': gram, 'contact_id': row.id}
+                     for row in rows for gram in trigrams(self._text(row.name, row.company))]
+            if grams:
+                db.session.execute(table.insert(), grams)
+            db.session.commit()
+            done += len(rows)
+        db.session.commit()
+        return done
+
+    def forget(self, contact_ids):
+        """Drop trigrams of contacts about to be deleted (caller commits)"""
+        table = self.trigram.__table__
+        self.db.session.execute(table.delete().where(table.c.contact_id.in_(contact_ids)))
+
+    def search(self, user_id, query, limit=10, min_score=MIN_SCORE):
+        """[(contact, score)] best first for a free-text name/company query"""
+        db, contact, table = self.db, self.contact, self.trigram.__table__
+        grams = trigrams(query)
+        if not grams:
+            return []
+        # "  j" only says the word starts with j - it matches a large share of
+        # every account and " jo" carries the same information more precisely
+        grams = {gram for gram in grams if not gram.startswith('  ')} or grams
+        shared = db.func.count().label('shared')
+        candidates = db.select(table.c.contact_id, shared) \
+            .where(table.c.user_id == user_id, table.c.trigram.in_(grams)) \
+            .group_by(table.c.contact_id).order_by(shared.desc()).limit(CANDIDATE_LIMIT).subquery()
+        rows = db.session.execute(
+            db.select(contact).join(candidates, candidates.c.contact_id == contact.id)
+        ).scalars().all()
+
+        ranked = [(row, similarity(query, self._text(row.name, row.company))) for row in rows]
+        ranked = [item for item in ranked if item[1] >= min_score]
+        ranked.sort(key=lambda item: (-item[1], item[0].name or ''))
+        return ranked[:limit]
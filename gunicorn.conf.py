@@ -0,0 +1,53 @@
+"""
+Gunicorn configuration for CocoCRM (loaded automatically from the working directory)
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+# Prometheus multiprocess mode: each worker writes its metrics to files in this
+# directory and /metrics aggregates them. Must be set before workers import the app.
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/cococrm-metrics')
+
+# Live updates keep one server-sent event connection open per browser tab.
+# gevent workers serve each of them as a greenlet instead of tying up a
+# whole sync worker; set GUNICORN_WORKER_CLASS=sync to opt out.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '2000'))
+
+
+# Background jobs run in a worker.py process started next to the web workers
+# (it inherits the metrics directory); JOB_WORKERS=0 when it runs elsewhere.
+job_workers = int(os.environ.get('JOB_WORKERS', '2'))
+job_worker = None
+
+
+def on_starting(server):
+    """Start every deploy with an empty metrics directory"""
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    """Launch the job worker once the server is up"""
+    global job_worker
+    if job_workers > 0:
+        job_worker = subprocess.Popen([sys.executable, 'worker.py', str(job_workers)])
+        server.log.info("Started job worker (pid %s, %s consumers)", job_worker.pid, job_workers)
+
+
+def on_exit(server):
+    """Let the job worker finish its running jobs"""
+    if job_worker is not None and job_worker.poll() is None:
+        job_worker.terminate()
+        try:
+            job_worker.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            job_worker.kill()
+
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
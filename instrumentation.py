@@ -0,0 +1,117 @@
+"""
+Per-request SQL instrumentation for CocoCRM
+
+Hooks into SQLAlchemy engine events to record, for every request:
+query count, total DB time and repeated statements (N+1 patterns).
+Results are sent back in a Server-Timing header and checked against
+a query budget. When SQL_INSTRUMENTATION is off no listeners are
+registered, so the disabled cost is zero.
+
+Streamed responses (CSV and bulk exports, live events) run most of their
+queries after the request hooks have finished, so they get no
+Server-Timing header and only their pre-stream queries count against the
+budget.
+"""
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in testing mode when a route breaks its query budget"""
+
+
+def query_budget(max_queries):
+    """Decorator to override the default query budget of a route"""
+    def decorator(f):
+        f._query_budget = max_queries
+        return f
+    return decorator
+
+
+def init_sql_instrumentation(app, db):
+    """Register engine listeners and request hooks (only when enabled)"""
+    app.config.setdefault('SQL_INSTRUMENTATION', False)
+    app.config.setdefault('SQL_QUERY_BUDGET', 50)
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 5)
+
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    # Every engine, so reads routed to the read engine (or a tenant shard) are counted too
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    shards = app.extensions.get('tenant_shards')
+    if shards is not None:
+        shards.listen('before_cursor_execute', _before_cursor_execute)
+        shards.listen('after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_sql_stats():
+        g.sql_stats = {'count': 0, 'duration': 0.0, 'statements': Counter()}
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _report_sql_stats(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+
+        total_ms = (time.perf_counter() - g.pop('request_started')) * 1000
+        db_ms = stats['duration'] * 1000
+        # The body of a streamed response hasn't been generated yet - its numbers would be wrong
+        if not response.is_streamed:
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={db_ms:.1f};desc="{stats["count"]} queries", app;dur={total_ms:.1f}'
+            )
+
+        problems = _check_stats(app, stats)
+        if problems:
+            message = f"{request.method} {request.path}: " + '; '.join(problems)
+            if app.testing:
+                raise QueryBudgetExceeded(message)
+            print(f"⚠️ SQL budget warning - {message}")
+
+        return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and 'sql_stats' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not (has_app_context() and 'sql_stats' in g):
+        return
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    stats = g.sql_stats
+    stats['count'] += 1
+    stats['duration'] += time.perf_counter() - starts.pop()
+    stats['statements'][' '.join(statement.split())] += 1
+
+
+def _check_stats(app, stats):
+    """Return a list of budget / N+1 violations for the current request"""
+    problems = []
+
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, '_query_budget', app.config['SQL_QUERY_BUDGET'])
+    if stats['count'] > budget:
+        problems.append(f"{stats['count']} queries (budget {budget})")
+
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    for statement, count in stats['statements'].most_common():
+        if count < threshold:
+            break
+        problems.append(f"possible N+1, statement ran {count}x: {statement[:120]}")
+
+    return problems
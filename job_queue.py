@@ -0,0 +1,321 @@
+"""
+Durable background jobs for CocoCRM
+
+Jobs are rows in the app database, so they are enqueued in the same
+transaction as the request's own writes and survive restarts. (With
+SHARDING on, a job enqueued while a tenant's database is in use goes into
+that tenant's outbox table instead - still the same transaction - and is
+moved to the main database right after the commit, or by the worker if
+that fails, so tenant writes never wait on the main database's lock.) Workers
+(`python worker.py`) claim one job at a time with a single atomic UPDATE
+that also sets a visibility timeout: a job whose worker died becomes
+claimable again once its lock expires. Failures are retried with
+exponential backoff until max_attempts, then kept as `failed` for
+inspection. Higher priority runs first; run_at schedules a job for later.
+
+    @jobs.task('telegram.send_message')
+    def send_message_job(chat_id, text): ...
+
+    jobs.enqueue('telegram.send_message', {'chat_id': 1, 'text': 'Hi'})
+    db.session.commit()
+
+Workers also run periodic housekeeping (pruning finished jobs and other
+short-lived tables), registered with `@jobs.every(seconds)`.
+"""
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from metrics import JOB_OUTBOX_FAILURES
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+OUTBOX_KEY = 'outbox_tenants'
+OUTBOX_BATCH_SIZE = 500
+
+
+class JobQueue:
+    """Enqueue, claim and run jobs stored in `model` (and, for tenant transactions, staged in `outbox`)"""
+
+    def __init__(self, app, db, model, outbox=None):
+        app.config.setdefault('JOB_VISIBILITY_TIMEOUT', int(os.environ.get('JOB_VISIBILITY_TIMEOUT', '300')))
+        app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOB_RETRY_BASE_SECONDS', 10)
+        app.config.setdefault('JOB_RETRY_MAX_SECONDS', 3600)
+        app.config.setdefault('JOB_POLL_INTERVAL', float(os.environ.get('JOB_POLL_INTERVAL', '0.5')))
+        app.config.setdefault('JOB_RETENTION_DAYS', 7)
+        self.app = app
+        self.db = db
+        self.model = model
+        self.outbox = outbox
+        self.handlers = {}
+        self.schedule = []
+        self.stopping = threading.Event()
+        self.every(600)(self._prune_finished)
+        if outbox is not None:
+            # Outboxes a request could not drain itself are picked up by the worker
+            self.every(30)(self._drain_outboxes)
+            event.listen(db.session, 'after_commit', self._drain_committed)
+            event.listen(db.session, 'after_rollback', lambda session: session.info.pop(OUTBOX_KEY, None))
+
+    def task(self, name):
+        """Decorator registering the function that runs jobs called `name` (payload as keyword arguments)"""
+        def decorator(f):
+            self.handlers[name] = f
+            return f
+        return decorator
+
+    def every(self, seconds):
+        """Decorator registering housekeeping that running workers call every `seconds` (in an app context)"""
+        def decorator(f):
+            self.schedule.append((seconds, f))
+            return f
+        return decorator
+
+    def enqueue(self, name, payload=None, priority=0, run_at=None, max_attempts=None):
+        """
+        Add a job to the current transaction (caller commits); returns the
+        job, or None when it is staged in the active tenant's outbox
+        """
+        if name not in self.handlers:
+            raise ValueError(f'Unknown job: {name}')
+        values = dict(
+            task=name,
+            payload=json.dumps(payload or {}),
+            priority=priority,
+            max_attempts=max_attempts or self.app.config['JOB_MAX_ATTEMPTS'],
+            run_at=run_at or datetime.utcnow(),
+            created_at=datetime.utcnow()
+        )
+        tenant_id = self._shards().current() if self.outbox is not None else None
+        if tenant_id is not None:
+            # Committed (or rolled back) together with the tenant's own writes
+            self.db.session.add(self.outbox(**values))
+            self.db.session.info.setdefault(OUTBOX_KEY, set()).add(tenant_id)
+            return None
+        job = self.model(status=QUEUED, attempts=0, **values)
+        self.db.session.add(job)
+        return job
+
+    # ---------- Tenant outboxes (SHARDING) ----------
+
+    def _shards(self):
+        return self.app.extensions['tenant_shards']
+
+    def drain_outbox(self, tenant_id):
+        """
+        Move the jobs in a tenant's outbox into the job table; returns jobs moved
+
+        Rows are deleted from the outbox in the shard's transaction, which
+        commits only after the main database has the jobs: a failure leaves
+        them in the outbox for the next attempt, and a drainer racing this
+        one waits for the shard's write lock and finds them gone.
+        """
+        outbox = self.outbox.__table__
+        engine = self._shards().engine(tenant_id)
+        moved = 0
+        while True:
+            with engine.connect() as connection:
+                if connection.execute(self.db.select(outbox.c.id).limit(1)).first() is None:
+                    return moved
+            with engine.begin() as tenant:
+                batch = self.db.select(outbox.c.id).order_by(outbox.c.id).limit(OUTBOX_BATCH_SIZE)
+                rows = tenant.execute(outbox.delete().where(outbox.c.id.in_(batch)).returning(
+                    *[column for column in outbox.c if column.name != 'id']
+                )).all()
+                if rows:
+                    with self.db.engine.begin() as main:
+                        main.execute(self.db.insert(self.model.__table__),
+                                     [dict(row._mapping, status=QUEUED, attempts=0) for row in rows])
+            moved += len(rows)
+
+    def _drain_committed(self, session):
+        for tenant_id in sorted(session.info.pop(OUTBOX_KEY, ())):
+            try:
+                self.drain_outbox(tenant_id)
+            except Exception as e:
+                # The jobs are safe in the outbox; the worker moves them on its next pass
+                JOB_OUTBOX_FAILURES.labels(stage='commit').inc()
+                self.app.logger.error('Job outbox of tenant %s not drained after commit: %s', tenant_id, e)
+
+    def _drain_outboxes(self):
+        shards = self._shards()
+        if not shards.enabled:
+            return
+        for tenant_id in shards.tenants():
+            try:
+                moved = self.drain_outbox(tenant_id)
+            except Exception as e:
+                JOB_OUTBOX_FAILURES.labels(stage='worker').inc()
+                self.app.logger.error('Job outbox of tenant %s not drained: %s', tenant_id, e)
+                continue
+            if moved:
+                print(f"📤 Moved {moved} outbox jobs of tenant {tenant_id}")
+
+    def claim(self, worker_id):
+        """
+        Atomically take the next runnable job, or None
+
+        Runnable: queued and due, or running with an expired lock. The
+        UPDATE repeats the condition, so of two workers racing for the same
+        row only one gets it back.
+        """
+        db, table = self.db, self.model.__table__
+        now = datetime.utcnow()
+        runnable = db.or_(
+            db.and_(table.c.status == QUEUED, table.c.run_at <= now),
+            db.and_(table.c.status == RUNNING, table.c.locked_until < now)
+        )
+        candidate = db.select(table.c.id).where(runnable) \
+            .order_by(table.c.priority.desc(), table.c.run_at, table.c.id).limit(1)
+        if db.engine.dialect.name == 'postgresql':
+            candidate = candidate.with_for_update(skip_locked=True)
+        row = db.session.execute(
+            table.update().where(table.c.id == candidate.scalar_subquery(), runnable).values(
+                status=RUNNING,
+                attempts=table.c.attempts + 1,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=self.app.config['JOB_VISIBILITY_TIMEOUT'])
+            ).returning(table.c.id, table.c.task, table.c.payload, table.c.attempts, table.c.max_attempts)
+        ).first()
+        db.session.commit()
+        return row
+
+    def run_one(self, worker_id):
+        """Claim and run one job; returns False when nothing was runnable"""
+        job = self.claim(worker_id)
+        if job is None:
+            return False
+        if job.attempts > job.max_attempts:
+            # Its worker kept dying (or timing out) on it
+            self._finish(job, worker_id, FAILED, error='Visibility timeout expired on the last attempt')
+            return True
+
+        handler = self.handlers.get(job.task)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for {job.task}')
+            handler(**json.loads(job.payload or '{}'))
+        except Exception as e:
+            self.db.session.rollback()
+            error = f'{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}'
+            if job.attempts >= job.max_attempts or handler is None:
+                print(f"❌ Job {job.id} ({job.task}) failed for good: {e}")
+                self._finish(job, worker_id, FAILED, error=error)
+            else:
+                delay = min(self.app.config['JOB_RETRY_BASE_SECONDS'] * 2 ** (job.attempts - 1),
+                            self.app.config['JOB_RETRY_MAX_SECONDS'])
+                delay *= random.uniform(1.0, 1.25)  # spread retries of jobs that failed together
+                print(f"⚠️ Job {job.id} ({job.task}) failed, retry {job.attempts}/{job.max_attempts - 1} in {delay:.0f}s: {e}")
+                self._finish(job, worker_id, QUEUED, error=error, run_at=datetime.utcnow() + timedelta(seconds=delay))
+            return True
+
+        self._finish(job, worker_id, DONE)
+        return True
+
+    def _finish(self, job, worker_id, status, error=None, run_at=None):
+        table = self.model.__table__
+        values = {'status': status, 'locked_by': None, 'locked_until': None}
+        if error is not None:
+            values['last_error'] = error[:4000]
+        if run_at is not None:
+            values['run_at'] = run_at
+        if status in (DONE, FAILED):
+            values['finished_at'] = datetime.utcnow()
+        # A job whose lock expired may have been claimed by another worker meanwhile
+        self.db.session.execute(table.update().where(table.c.id == job.id, table.c.locked_by == worker_id).values(**values))
+        self.db.session.commit()
+
+    def prune(self):
+        """Delete finished jobs older than JOB_RETENTION_DAYS; returns rows deleted"""
+        table = self.model.__table__
+        cutoff = datetime.utcnow() - timedelta(days=self.app.config['JOB_RETENTION_DAYS'])
+        result = self.db.session.execute(table.delete().where(
+            table.c.status.in_([DONE, FAILED]), table.c.finished_at < cutoff
+        ))
+        self.db.session.commit()
+        return result.rowcount
+
+    def stats(self):
+        """
+        Jobs not yet done, for monitoring: [(task, status, count, oldest)] where
+        oldest is the earliest run_at among due queued jobs (None otherwise)
+        """
+        db, table = self.db, self.model.__table__
+        now = datetime.utcnow()
+        due = db.and_(table.c.status == QUEUED, table.c.run_at <= now)
+        rows = db.session.execute(
+            db.select(table.c.task, table.c.status, db.func.count(), db.func.min(db.case((due, table.c.run_at))))
+            .where(table.c.status.in_([QUEUED, RUNNING, FAILED]))
+            .group_by(table.c.task, table.c.status)
+        ).all()
+        return rows
+
+    def _prune_finished(self):
+        pruned = self.prune()
+        if pruned:
+            print(f"🧹 Pruned {pruned} finished jobs")
+
+    def housekeep(self):
+        """Housekeeping loop: run each scheduled function when due, until stop()"""
+        due = [time.monotonic() + seconds for seconds, _ in self.schedule]
+        while not self.stopping.wait(1):
+            now = time.monotonic()
+            for i, (seconds, f) in enumerate(self.schedule):
+                if now < due[i]:
+                    continue
+                due[i] = now + seconds
+                with self.app.app_context():
+                    try:
+                        f()
+                    except Exception as e:
+                        print(f"⚠️ Housekeeping {f.__name__} failed: {e}")
+                        self.db.session.rollback()
+
+    def consume(self, worker_id):
+        """Consumer loop: run jobs until stop() (sleeping between polls when idle)"""
+        interval = self.app.config['JOB_POLL_INTERVAL']
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    busy = self.run_one(worker_id)
+                except Exception as e:
+                    # e.g. the database is locked or gone for a moment
+                    print(f"⚠️ Worker {worker_id} error: {e}")
+                    self.db.session.rollback()
+                    busy = False
+            if not busy:
+                self.stopping.wait(interval)
+
+    def start(self, consumers=1):
+        """Run consumers and housekeeping in daemon threads of this process; returns the threads"""
+        self.stopping.clear()
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [threading.Thread(target=self.consume, args=(f'{prefix}:{i}',), daemon=True, name=f'job-consumer-{i}')
+                   for i in range(consumers)]
+        threads.append(threading.Thread(target=self.housekeep, daemon=True, name='job-housekeeping'))
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, consumers=1):
+        """Blocking worker (worker.py): N consumers plus housekeeping until SIGINT/SIGTERM"""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self.stop())
+        threads = self.start(consumers)
+        print(f"✅ Job worker running {consumers} consumer(s) for: {', '.join(sorted(self.handlers))}")
+        self.stopping.wait()
+        print("⏳ Finishing running jobs...")
+        for thread in threads:
+            thread.join()
+        print("👋 Job worker stopped")
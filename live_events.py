@@ -0,0 +1,216 @@
+"""
+Live updates for CocoCRM (server-sent events)
+
+Writes publish small JSON events into a table in the same transaction as
+the change itself. The table doubles as a cross-worker pub/sub: one
+dispatcher thread per gunicorn worker polls it for new rows and fans them
+out to that worker's open EventSource connections. Connections hold no
+database connection while idle, and under the gevent worker (see
+gunicorn.conf.py) each one is a greenlet rather than an OS thread.
+
+Rows older than LIVE_EVENT_RETENTION_MINUTES are deleted by prune(), which
+the job worker runs periodically - processes without subscribers never
+start a dispatcher, so it can't be left to them.
+
+With SHARDING on the table lives in each tenant's database, so an event is
+written in the same transaction as the change. The dispatcher then polls
+only the databases of the users subscribed in its process, each with its
+own cursor.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import Response, stream_with_context
+
+from metrics import LIVE_CONNECTIONS
+
+
+class EventHub:
+    """Per-process fan-out of live events to subscribed connections"""
+
+    def __init__(self, app, db, model):
+        app.config.setdefault('LIVE_POLL_INTERVAL', float(os.environ.get('LIVE_POLL_INTERVAL', '1')))
+        app.config.setdefault('LIVE_HEARTBEAT_SECONDS', 15)
+        app.config.setdefault('LIVE_STREAM_SECONDS', 300)
+        app.config.setdefault('LIVE_EVENT_RETENTION_MINUTES', 10)
+        app.config.setdefault('LIVE_QUEUE_SIZE', 100)
+        self.app = app
+        self.db = db
+        self.model = model
+        self.subscribers = {}  # user_id -> set of queues
+        self.lock = threading.Lock()
+        self.pid = None
+        self.last_id = 0
+        self.cursors = {}  # user_id -> last event id, when sharded
+
+    def publish(self, user_id, kind, data, connection=None):
+        """Queue an event for user_id; delivered once the surrounding transaction commits"""
+        self.publish_many([(user_id, kind, data)], connection)
+
+    def publish_many(self, events, connection=None):
+        if not events:
+            return
+        rows = [{'user_id': user_id, 'kind': kind, 'payload': json.dumps(data), 'created_at': datetime.utcnow()}
+                for user_id, kind, data in events]
+        (connection or self.db.session).execute(self.db.insert(self.model.__table__), rows)
+
+    def _shards(self):
+        shards = self.app.extensions.get('tenant_shards')
+        return shards if shards is not None and shards.enabled else None
+
+    def _latest_id(self):
+        return self.db.session.query(self.db.func.max(self.model.id)).scalar() or 0
+
+    def subscribe(self, user_id):
+        self._ensure_dispatcher()
+        shards = self._shards()
+        if shards is not None and user_id not in self.cursors:
+            with shards.tenant(user_id):
+                latest = self._latest_id()
+            with self.lock:
+                self.cursors.setdefault(user_id, latest)
+        subscriber = queue.Queue(maxsize=self.app.config['LIVE_QUEUE_SIZE'])
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        LIVE_CONNECTIONS.inc()
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(user_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(user_id, None)
+                self.cursors.pop(user_id, None)
+        LIVE_CONNECTIONS.dec()
+
+    def backlog(self, user_id, last_event_id, limit=200):
+        """Events a reconnecting client missed (EventSource sends Last-Event-ID)"""
+        model = self.model
+        return model.query.filter(model.user_id == user_id, model.id > last_event_id) \
+            .order_by(model.id).limit(limit).all()
+
+    def stream(self, user_id, last_event_id=None):
+        """Return the text/event-stream response for one browser connection"""
+        config = self.app.config
+        subscriber = self.subscribe(user_id)
+        missed = [_format(event.id, event.kind, event.payload)
+                  for event in self.backlog(user_id, last_event_id)] if last_event_id else []
+        # The stream can stay open for minutes; don't keep a pooled connection for it
+        self.db.session.close()
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+                for message in missed:
+                    yield message
+                deadline = time.monotonic() + config['LIVE_STREAM_SECONDS']
+                while time.monotonic() < deadline:
+                    try:
+                        message = subscriber.get(timeout=config['LIVE_HEARTBEAT_SECONDS'])
+                    except queue.Empty:
+                        yield ': keep-alive\n\n'
+                        continue
+                    if message is None:
+                        # Fell too far behind - let the page reload instead of replaying
+                        yield _format(0, 'refresh', '{}')
+                        break
+                    yield message
+            finally:
+                self.unsubscribe(user_id, subscriber)
+
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _ensure_dispatcher(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.subscribers = {}
+            self.cursors = {}
+            if self._shards() is None:
+                with self.app.app_context():
+                    self.last_id = self._latest_id()
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name='live-events', daemon=True).start()
+            print(f"✅ Live event dispatcher started (pid {self.pid})")
+
+    def _run(self):
+        interval = self.app.config['LIVE_POLL_INTERVAL']
+        while True:
+            time.sleep(interval)
+            try:
+                # Also while nobody is subscribed, so last_id keeps up and a
+                # new subscriber isn't sent events from before it connected
+                with self.app.app_context():
+                    self._dispatch()
+            except Exception as e:
+                print(f"❌ Live event dispatcher error: {e}")
+
+    def _dispatch(self):
+        shards = self._shards()
+        if shards is None:
+            self.last_id = self._deliver(self.last_id)
+            return
+        with self.lock:
+            cursors = dict(self.cursors)
+        for user_id, last_id in cursors.items():
+            with shards.tenant(user_id):
+                last_id = self._deliver(last_id)
+            with self.lock:
+                if user_id in self.cursors:
+                    self.cursors[user_id] = last_id
+
+    def _deliver(self, last_id):
+        """Fan out events after last_id (of the active tenant, when sharded); returns the new cursor"""
+        model = self.model
+        events = model.query.filter(model.id > last_id).order_by(model.id).limit(500).all()
+        self.db.session.close()
+
+        for event in events:
+            last_id = event.id
+            with self.lock:
+                subscribers = list(self.subscribers.get(event.user_id, ()))
+            message = _format(event.id, event.kind, event.payload)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    _drain(subscriber)
+                    subscriber.put_nowait(None)
+        return last_id
+
+    def prune(self):
+        """Delete events older than LIVE_EVENT_RETENTION_MINUTES (in every tenant's database when sharded)"""
+        model = self.model
+        cutoff = datetime.utcnow() - timedelta(minutes=self.app.config['LIVE_EVENT_RETENTION_MINUTES'])
+        shards = self._shards()
+        for _ in (shards.each() if shards is not None else [None]):
+            # Only take the write lock when there is something to delete
+            if self.db.session.query(model.id).filter(model.created_at < cutoff).first() is None:
+                continue
+            self.db.session.execute(
+                self.db.delete(model).where(model.created_at < cutoff).execution_options(synchronize_session=False)
+            )
+            self.db.session.commit()
+
+
+def _format(event_id, kind, payload):
+    return f'id: {event_id}\nevent: {kind}\ndata: {payload}\n\n'
+
+
+def _drain(subscriber):
+    try:
+        while True:
+            subscriber.get_nowait()
+    except queue.Empty:
+        pass
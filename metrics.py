@@ -0,0 +1,151 @@
+"""
+Prometheus metrics for CocoCRM
+
+Exposes /metrics in the Prometheus text format. Under gunicorn each worker
+writes its samples to PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) and
+the endpoint aggregates all workers with the multiprocess collector.
+"""
+import os
+import time
+from datetime import datetime
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    'cococrm_request_duration_seconds', 'HTTP request latency by route',
+    ['endpoint', 'method'], buckets=LATENCY_BUCKETS
+)
+REQUEST_COUNT = Counter(
+    'cococrm_requests_total', 'HTTP responses by route and status code',
+    ['endpoint', 'method', 'status']
+)
+DB_CHECKOUT_SECONDS = Histogram(
+    'cococrm_db_connection_checkout_seconds', 'Time a DB connection stays checked out of the pool',
+    buckets=LATENCY_BUCKETS
+)
+TELEGRAM_SEND_LATENCY = Histogram(
+    'cococrm_telegram_send_seconds', 'Latency of Telegram sendMessage calls',
+    buckets=LATENCY_BUCKETS
+)
+TELEGRAM_SEND_FAILURES = Counter(
+    'cococrm_telegram_send_failures_total', 'Failed Telegram sendMessage calls',
+    ['reason']
+)
+AUTOMATION_RUNS = Counter(
+    'cococrm_automation_executions_total', 'Automation rule executions',
+    ['action', 'result']
+)
+LIVE_CONNECTIONS = Gauge(
+    'cococrm_live_connections', 'Open server-sent event connections',
+    multiprocess_mode='livesum'
+)
+JOB_OUTBOX_FAILURES = Counter(
+    'cococrm_job_outbox_failures_total', 'Failed moves of tenant outbox jobs into the job table, by where they ran',
+    ['stage']
+)
+CACHE_REQUESTS = Counter(
+    'cococrm_cache_requests_total', 'Cache lookups by cache and result (hit/miss)',
+    ['cache', 'result']
+)
+
+
+# Collectors that read shared state (the database) at scrape time, so no single
+# process owns their samples
+SCRAPE_COLLECTORS = []
+
+
+class JobQueueCollector:
+    """Queued, running and failed background jobs by task, read from the job table on each scrape"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def _families(self):
+        return (
+            GaugeMetricFamily('cococrm_jobs', 'Background jobs not yet done, by task and status',
+                              labels=['task', 'status']),
+            GaugeMetricFamily('cococrm_job_backlog_seconds', 'Age of the oldest due queued job, by task',
+                              labels=['task']),
+        )
+
+    def describe(self):
+        return self._families()
+
+    def collect(self):
+        jobs, backlog = self._families()
+        now = datetime.utcnow()
+        for task, status, count, oldest in self.jobs.stats():
+            jobs.add_metric([task, status], count)
+            if oldest is not None:
+                backlog.add_metric([task], (now - oldest).total_seconds())
+        yield jobs
+        yield backlog
+
+
+def register_job_metrics(jobs):
+    """Export the job queue backlog (includes Telegram webhook updates, which are jobs)"""
+    collector = JobQueueCollector(jobs)
+    SCRAPE_COLLECTORS.append(collector)
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        REGISTRY.register(collector)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup so hit rates can be graphed per cache"""
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def init_metrics(app, db):
+    """Register request timing hooks, pool listeners and the /metrics route"""
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+            REQUEST_COUNT.labels(endpoint, request.method, str(response.status_code)).inc()
+        return response
+
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop('checked_out_at', None)
+        if started is not None:
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+    for engine in engines:
+        event.listen(engine, 'checkout', _on_checkout)
+        event.listen(engine, 'checkin', _on_checkin)
+    shards = app.extensions.get('tenant_shards')
+    if shards is not None:
+        shards.listen('checkout', _on_checkout)
+        shards.listen('checkin', _on_checkin)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus scrape endpoint"""
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            for collector in SCRAPE_COLLECTORS:
+                registry.register(collector)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,110 @@
+"""
+Read/write connection routing for CocoCRM
+
+Views marked @read_only run their queries on a separate "read" engine so
+long reports and exports never hold up interactive writes:
+
+- SQLite: the database is switched to WAL, and the read engine opens its
+  own connections to the same file with `PRAGMA query_only` and an
+  explicit BEGIN, so a whole request (including a streamed export) reads
+  one consistent snapshot while writers keep committing.
+- PostgreSQL: set READ_DATABASE_URL to a replica; read sessions run
+  REPEATABLE READ, read-only.
+
+Read-your-writes: a signed-in browser that just made a successful write
+(POST and friends) is pinned to the primary for READ_YOUR_WRITES_SECONDS, so
+the page it is redirected to never shows data older than its own change on
+a lagging replica. Cookie-less callers (the API key REST API, the Telegram
+webhook) are not tracked and get no session cookie for it. READ_ROUTING=0
+turns routing off.
+"""
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+READ_BIND = 'read'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+SESSION_KEY = '_db_write_at'
+
+
+def configure_read_bind(app):
+    """Add the read engine to SQLALCHEMY_BINDS - call before SQLAlchemy(app)"""
+    app.config.setdefault('READ_ROUTING', os.environ.get('READ_ROUTING', '1').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('READ_YOUR_WRITES_SECONDS', float(os.environ.get('READ_YOUR_WRITES_SECONDS', '10')))
+    if not app.config['READ_ROUTING']:
+        return
+
+    primary = app.config['SQLALCHEMY_DATABASE_URI']
+    url = os.environ.get('READ_DATABASE_URL') or (primary if primary.startswith('sqlite') else None)
+    if not url:
+        # No replica configured for a server database: everything stays on the primary
+        return
+    options = {'url': url}
+    if url.startswith('postgresql'):
+        options['execution_options'] = {'isolation_level': 'REPEATABLE READ', 'postgresql_readonly': True}
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[READ_BIND] = options
+
+
+class RoutingSession(Session):
+    """db.session that sends everything to the read engine inside @read_only views"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('db_read_only'):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(f):
+    """Decorator routing a view's queries to the read engine (unless the client just wrote)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        written_at = session.get(SESSION_KEY)
+        pinned = written_at is not None and time.time() - written_at < current_app.config['READ_YOUR_WRITES_SECONDS']
+        g.db_read_only = not pinned
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _browser_session(app):
+    """True for a signed-in browser that already sends a session cookie"""
+    return app.config['SESSION_COOKIE_NAME'] in request.cookies and current_user.is_authenticated
+
+
+def init_read_routing(app, db):
+    """Set up the read engine's connections and read-your-writes tracking"""
+    with app.app_context():
+        engines = dict(db.engines)
+    read_engine = engines.get(READ_BIND)
+    if read_engine is None:
+        return
+
+    if read_engine.dialect.name == 'sqlite':
+        @event.listens_for(engines[None], 'connect')
+        def _enable_wal(dbapi_connection, connection_record):
+            # WAL lets readers keep an old snapshot while a writer commits
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+        @event.listens_for(read_engine, 'connect')
+        def _read_only_connection(dbapi_connection, connection_record):
+            # Let SQLAlchemy's BEGIN below own the transaction instead of pysqlite
+            dbapi_connection.isolation_level = None
+            dbapi_connection.execute('PRAGMA query_only = ON')
+
+        @event.listens_for(read_engine, 'begin')
+        def _begin_snapshot(connection):
+            connection.exec_driver_sql('BEGIN')
+
+    @app.after_request
+    def _remember_write(response):
+        if request.method in WRITE_METHODS and response.status_code < 400 and _browser_session(app):
+            session[SESSION_KEY] = time.time()
+        return response
+
+    print(f"✅ Read routing: @read_only views use {read_engine.url.render_as_string(hide_password=True)}")
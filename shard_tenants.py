@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Provision every user's tenant database (create it, or migrate it to the
+current schema) and copy their CRM data over from the main database
+Run once with the app stopped to switch an existing install: users whose
+shard already holds data are only migrated. Copied rows also stay in the
+main database, which is what the app uses again if SHARDING is turned off
+(changes made meanwhile stay in the shards)
+--migrate only creates and migrates tenant databases, copying nothing;
+start.sh runs it before gunicorn on every deploy (a no-op with sharding off)
+Usage: SHARDING=1 python shard_tenants.py [--migrate | username]
+"""
+import sys
+import time
+
+from app import app, db, activity_archive, shards, LiveEvent, User
+
+BATCH_SIZE = 5000
+
+
+def copy_tenant(user_id, tables):
+    """Copy one user's rows of tables into their shard; returns rows copied, or None if it has data"""
+    copied = 0
+    with db.engine.connect() as source, shards.engine(user_id).begin() as target:
+        for table in tables:
+            table.create(target, checkfirst=True)
+        if any(target.execute(db.select(table.c.user_id).where(table.c.user_id == user_id).limit(1)).first()
+               for table in tables):
+            return None
+        for table in tables:
+            result = source.execution_options(yield_per=BATCH_SIZE).execute(
+                table.select().where(table.c.user_id == user_id).order_by(*table.primary_key.columns))
+            for rows in result.partitions():
+                target.execute(table.insert(), [dict(row._mapping) for row in rows])
+                copied += len(rows)
+    return copied
+
+
+def migrate_tenants():
+    """Bring every user's tenant database up to the current schema"""
+    if not shards.enabled:
+        print("⏭️  Sharding is off, no tenant databases to migrate")
+        return 0
+    with app.app_context():
+        user_ids = db.session.execute(db.select(User.id).order_by(User.id)).scalars().all()
+        db.session.remove()
+        migrated = sum(1 for user_id in user_ids if shards.provision(user_id))
+    print(f"✅ Tenant databases up to date ({migrated} of {len(user_ids)} migrated)")
+    return 0
+
+
+def shard_tenants(username=None):
+    if not shards.enabled:
+        print("❌ Set SHARDING=1 to provision tenant databases")
+        return 1
+    with app.app_context():
+        # Live events are short-lived, there is nothing worth copying
+        tables = [table for table in shards.tenant_tables() if 'user_id' in table.c and table is not LiveEvent.__table__]
+        tables += [table for _, table in activity_archive.tables()]
+        db.session.remove()
+
+        query = db.select(User.id, User.username).order_by(User.id)
+        users = db.session.execute(query.where(User.username == username) if username else query).all()
+        started = time.monotonic()
+        for user in users:
+            user_started = time.monotonic()
+            migrated = shards.provision(user.id)
+            copied = copy_tenant(user.id, tables)
+            if copied is None:
+                print(f"  {'🔧' if migrated else '⏭️ '} {user.username}: has data{', migrated' if migrated else ''}")
+            else:
+                print(f"  👤 {user.username}: {copied} rows ({time.monotonic() - user_started:.1f}s)")
+        print(f"\n✅ Provisioned {len(users)} users in {shards.directory} in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--migrate']:
+        sys.exit(migrate_tenants())
+    sys.exit(shard_tenants(sys.argv[1] if len(sys.argv) > 1 else None))
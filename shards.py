@@ -0,0 +1,286 @@
+"""
+Database-per-tenant sharding for CocoCRM (SHARDING=1)
+
+Every user's CRM data - contacts, deals, tasks, activities, their live
+events and everything derived from them - lives in its own SQLite file,
+SHARD_DIR/tenant-<id>.db, so tenants no longer queue behind one
+database-wide writer lock. Logins and the job queue stay in the main
+database, which all processes share; jobs enqueued during a tenant's
+transaction are staged in the tenant's outbox table and moved there once
+it commits (see job_queue.py).
+
+db.session picks the database per statement: queries on tenant tables go
+to the shard of the active tenant - set from current_user for pages, from
+the API principal for the REST API, and with `shards.tenant(user_id)` in
+jobs and scripts. Touching tenant tables with no tenant active raises,
+rather than silently reading or writing the main database.
+
+A tenant's database is created or migrated by provision() - when the user
+is created, when they log in, and for everyone by `shard_tenants.py
+--migrate`, which start.sh runs before gunicorn. The schema fingerprint is
+kept in `PRAGMA user_version`. Opening a shard that is missing raises; one
+left out of date (a process started without the deploy step) is migrated
+once, under the engine lock and on a private engine, so the DDL never
+counts against a request's query budget. Engines are kept in an LRU of
+SHARD_CACHE_SIZE; the least recently used one is disposed (its pooled
+connections closed) when another is needed.
+"""
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import object_session
+from sqlalchemy.sql.util import find_tables
+
+from read_routing import RoutingSession
+
+TENANT_KEY = 'shard_tenant'
+NEW_TENANTS_KEY = 'new_tenants'
+SHARD_PATTERN = re.compile(r'^tenant-(\d+)\.db$')
+MIGRATE_ATTEMPTS = 3
+
+
+class TenantShards:
+    """Per-tenant SQLite engines for every table except global_tables"""
+
+    def __init__(self, app, db, global_tables, migrate):
+        """
+        global_tables: names of the tables kept in the main database
+        migrate(engine, tables): brings a shard's tables up to date (after create_all)
+        """
+        app.config.setdefault('SHARDING', os.environ.get('SHARDING', '').lower() in ('1', 'true', 'yes'))
+        app.config.setdefault('SHARD_DIR', os.environ.get('SHARD_DIR') or os.path.join(app.instance_path, 'shards'))
+        app.config.setdefault('SHARD_CACHE_SIZE', int(os.environ.get('SHARD_CACHE_SIZE', '128')))
+        self.app = app
+        self.db = db
+        self.global_names = set(global_tables)
+        self.migrate = migrate
+        self._engines = OrderedDict()
+        self._listeners = []
+        self._lock = threading.Lock()
+        app.extensions['tenant_shards'] = self
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            print(f"✅ Sharding: one database per user in {self.directory}")
+
+    @property
+    def enabled(self):
+        return self.app.config['SHARDING']
+
+    @property
+    def directory(self):
+        return self.app.config['SHARD_DIR']
+
+    def path(self, tenant_id):
+        return os.path.join(self.directory, f'tenant-{int(tenant_id)}.db')
+
+    def tenant_tables(self):
+        return [table for table in self.db.metadata.sorted_tables if table.name not in self.global_names]
+
+    def tenants(self):
+        """Ids of the tenants that have a shard, ascending"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(SHARD_PATTERN.match, os.listdir(self.directory)) if match)
+
+    # ---------- Engines ----------
+
+    def engine(self, tenant_id):
+        """The tenant's engine, opened (and migrated if out of date) on first use"""
+        tenant_id = int(tenant_id)
+        with self._lock:
+            engine = self._engines.get(tenant_id)
+            if engine is not None:
+                self._engines.move_to_end(tenant_id)
+                return engine
+            engine = self._open(tenant_id)
+            self._engines[tenant_id] = engine
+            while len(self._engines) > self.app.config['SHARD_CACHE_SIZE']:
+                _, idle = self._engines.popitem(last=False)
+                # Connections a request still holds are closed when it returns them
+                idle.dispose()
+        return engine
+
+    def listen(self, identifier, fn):
+        """event.listen() on every shard engine, including those opened later (metrics, instrumentation)"""
+        with self._lock:
+            self._listeners.append((identifier, fn))
+            for engine in self._engines.values():
+                event.listen(engine, identifier, fn)
+
+    def open_count(self):
+        return len(self._engines)
+
+    def close_all(self):
+        with self._lock:
+            while self._engines:
+                self._engines.popitem()[1].dispose()
+
+    def _open(self, tenant_id):
+        path = self.path(tenant_id)
+        if not os.path.exists(path):
+            raise RuntimeError(f'Tenant {tenant_id} has no database - provision it (python shard_tenants.py)')
+        engine = create_engine(f'sqlite:///{path}')
+
+        @event.listens_for(engine, 'connect')
+        def _enable_wal(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+        # Checked before the metrics / instrumentation listeners are attached
+        with engine.connect() as connection:
+            version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+        if version != self.schema_version():
+            engine.dispose()
+            self.provision(tenant_id)
+            print(f"🔧 Migrated the out-of-date database of tenant {tenant_id}")
+        for identifier, fn in self._listeners:
+            event.listen(engine, identifier, fn)
+        return engine
+
+    def provision(self, tenant_id):
+        """Create or migrate a tenant's database; returns True if it changed (no-op when sharding is off)"""
+        if not self.enabled:
+            return False
+        # A private engine: nothing pooled, and no request instrumentation counts the DDL
+        engine = create_engine(f'sqlite:///{self.path(tenant_id)}')
+        try:
+            return self._upgrade(engine)
+        finally:
+            engine.dispose()
+
+    def provision_new(self, model):
+        """Provision the tenant of every `model` row (the user) once the transaction inserting it commits"""
+        @event.listens_for(model, 'after_insert')
+        def _remember_new_tenant(mapper, connection, target):
+            if self.enabled:
+                object_session(target).info.setdefault(NEW_TENANTS_KEY, set()).add(target.id)
+
+        @event.listens_for(self.db.session, 'after_commit')
+        def _provision_new_tenants(session):
+            for tenant_id in sorted(session.info.pop(NEW_TENANTS_KEY, ())):
+                self.provision(tenant_id)
+
+        @event.listens_for(self.db.session, 'after_rollback')
+        def _forget_new_tenants(session):
+            session.info.pop(NEW_TENANTS_KEY, None)
+
+    def schema_version(self):
+        """Fingerprint of the tenant tables' columns and indexes (fits PRAGMA user_version)"""
+        parts = []
+        for table in self.tenant_tables():
+            parts.append(table.name)
+            parts.extend(f'{column.name}:{column.type!r}' for column in table.columns)
+            parts.extend(sorted(index.name for index in table.indexes))
+        return zlib.crc32('|'.join(parts).encode()) & 0x7fffffff
+
+    def _upgrade(self, engine):
+        version = self.schema_version()
+        with engine.connect() as connection:
+            if connection.exec_driver_sql('PRAGMA user_version').scalar() == version:
+                return False
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+        tables = self.tenant_tables()
+        for attempt in range(MIGRATE_ATTEMPTS):
+            try:
+                self.db.metadata.create_all(engine, tables=tables)
+                self.migrate(engine, tables)
+                break
+            except OperationalError:
+                # Another process is migrating the same shard; the retry finds its work done
+                if attempt == MIGRATE_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.2)
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'PRAGMA user_version = {version}')
+        return True
+
+    # ---------- Tenant selection ----------
+
+    def current(self):
+        return g.get(TENANT_KEY) if has_app_context() else None
+
+    def activate(self, tenant_id):
+        """Route this app context's tenant queries to tenant_id's shard (None: no tenant)"""
+        if self.enabled:
+            setattr(g, TENANT_KEY, tenant_id)
+
+    @contextmanager
+    def tenant(self, tenant_id):
+        """
+        Make tenant_id the active tenant inside the block
+
+        ORM objects loaded under one tenant must not be used under another:
+        scripts looping over tenants should work from ids and call
+        db.session.remove() between them (see each()).
+        """
+        previous = self.current()
+        self.activate(tenant_id)
+        try:
+            yield tenant_id
+        finally:
+            self.activate(previous)
+
+    def each(self):
+        """
+        Run the loop body once per tenant with that tenant active and a fresh
+        session - or just once, with no tenant, when sharding is off
+        """
+        if not self.enabled:
+            yield None
+            return
+        for tenant_id in self.tenants():
+            with self.tenant(tenant_id):
+                try:
+                    yield tenant_id
+                finally:
+                    self.db.session.remove()
+
+    def query_all(self, statement):
+        """Cross-shard admin query: {tenant_id: rows} from running a Core statement on every shard"""
+        results = {}
+        for tenant_id in self.tenants():
+            with self.engine(tenant_id).connect() as connection:
+                results[tenant_id] = connection.execute(statement).all()
+        return results
+
+    # ---------- Routing ----------
+
+    def bind_for(self, mapper=None, clause=None):
+        """The shard engine a statement should run on, or None for the main database"""
+        if not self.enabled:
+            return None
+        if mapper is not None:
+            names = {table.name for table in inspect(mapper).tables}
+        elif clause is not None:
+            names = {table.name for table in find_tables(clause, include_crud=True, include_joins=True)}
+        else:
+            names = set()
+        if names and names <= self.global_names:
+            return None
+        tenant_id = self.current()
+        if tenant_id is None:
+            if not names:
+                # session.connection() or text() with no tenant: the main database
+                return None
+            raise RuntimeError(f'No tenant selected for a query on {", ".join(sorted(names))} (SHARDING is on)')
+        return self.engine(tenant_id)
+
+
+class ShardedSession(RoutingSession):
+    """db.session that sends tenant tables to the active tenant's shard (see TenantShards)"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shards = current_app.extensions.get('tenant_shards') if has_app_context() else None
+            if shards is not None:
+                engine = shards.bind_for(mapper, clause)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
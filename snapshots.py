@@ -0,0 +1,244 @@
+"""
+Online backups of the CocoCRM SQLite database
+
+A snapshot is taken with SQLite's online backup API while the app keeps
+running: pages are copied BACKUP_STEP_PAGES at a time with a short pause
+in between. In WAL mode (the default, see read_routing.py) the copy reads
+one pinned snapshot and writers are never blocked. With a rollback journal
+the source is only locked during each step (a millisecond or so); commits
+in between make SQLite restart the copy, and after BACKUP_MAX_RESTARTS of
+those it is done in one pass.
+
+Each copy is integrity-checked, gzipped to BACKUP_DIR as
+crm-<UTC timestamp>.db.gz next to a `sha256sum`-style .sha256 file, and
+only the newest BACKUP_KEEP snapshots are kept. With SHARDING on, every
+tenant database is snapshotted alongside (tenant-<id>-<UTC timestamp>.db.gz)
+and rotated separately. restore() verifies a snapshot and copies it back
+into its live database through the same API.
+"""
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+MAIN_DATABASE = 'crm'
+SNAPSHOT_SUFFIX = '.db.gz'
+SNAPSHOT_PATTERN = re.compile(r'^(crm|tenant-(\d+))-(\d{8}T\d{12}Z)\.db\.gz$')
+STAMP_FORMAT = '%Y%m%dT%H%M%S%fZ'
+COPY_CHUNK = 1024 * 1024
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check_integrity(path):
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        connection.close()
+    if result != 'ok':
+        raise RuntimeError(f'Integrity check failed for {path}: {result}')
+
+
+class SnapshotStore:
+    """Take, list, rotate and restore compressed snapshots of the app's SQLite database"""
+
+    def __init__(self, app, db):
+        app.config.setdefault('BACKUP_DIR', os.environ.get('BACKUP_DIR') or os.path.join(app.instance_path, 'backups'))
+        app.config.setdefault('BACKUP_KEEP', int(os.environ.get('BACKUP_KEEP', '14')))
+        app.config.setdefault('BACKUP_STEP_PAGES', 256)
+        app.config.setdefault('BACKUP_STEP_SLEEP', 0.005)
+        app.config.setdefault('BACKUP_MAX_RESTARTS', 5)
+        self.app = app
+        self.db = db
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return self.app.config['BACKUP_DIR']
+
+    def database_path(self):
+        with self.app.app_context():
+            url = self.db.engine.url
+        if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+            raise RuntimeError('Snapshots are for SQLite databases - use pg_dump for PostgreSQL')
+        return url.database
+
+    def _copy(self, source_path, target_path):
+        """Online copy of source into a new file; returns (seconds, restarts)"""
+        config = self.app.config
+        source = sqlite3.connect(source_path, timeout=30)
+        target = sqlite3.connect(target_path)
+        started = time.monotonic()
+        restarts = 0
+        try:
+            if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+                # Pin one read snapshot for the whole copy: commits by other
+                # connections then neither wait for it nor restart it
+                source.execute('BEGIN')
+                source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            progress_state = {'remaining': None}
+
+            def progress(status, remaining, total):
+                nonlocal restarts
+                last = progress_state['remaining']
+                progress_state['remaining'] = remaining
+                if last is not None and remaining > last:
+                    # Another connection wrote to the source: SQLite started over
+                    restarts += 1
+                    if restarts > config['BACKUP_MAX_RESTARTS']:
+                        raise _Restarted()
+                # The source is unlocked between steps, so writers get in here
+                time.sleep(config['BACKUP_STEP_SLEEP'])
+
+            try:
+                source.backup(target, pages=config['BACKUP_STEP_PAGES'], progress=progress)
+            except _Restarted:
+                print(f"⚠️ Backup restarted {restarts} times under writes, copying in one pass")
+                source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return time.monotonic() - started, restarts
+
+    def _shards(self):
+        shards = self.app.extensions.get('tenant_shards')
+        return shards if shards is not None and shards.enabled else None
+
+    def sources(self):
+        """[(database label, file path)] - the main database, then any tenant shards"""
+        found = [(MAIN_DATABASE, self.database_path())]
+        shards = self._shards()
+        if shards is not None:
+            found.extend((f'tenant-{tenant_id}', shards.path(tenant_id)) for tenant_id in shards.tenants())
+        return found
+
+    def _source_path(self, database):
+        if database == MAIN_DATABASE:
+            return self.database_path()
+        shards = self._shards()
+        if shards is None:
+            raise RuntimeError(f'{database} is a tenant snapshot but SHARDING is off')
+        return shards.path(int(database.split('-', 1)[1]))
+
+    def take(self):
+        """Snapshot every live database; returns the new snapshots' info dicts"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime(STAMP_FORMAT)
+        taken = [self._take(database, path, f'{database}-{stamp}{SNAPSHOT_SUFFIX}') for database, path in self.sources()]
+        removed = self.rotate()
+        if removed:
+            print(f"🧹 Removed {len(removed)} old snapshots")
+        return taken
+
+    def _take(self, database, source_path, name):
+        path = os.path.join(self.directory, name)
+
+        with self._lock, tempfile.TemporaryDirectory(dir=self.directory) as scratch:
+            copy_path = os.path.join(scratch, 'copy.db')
+            seconds, restarts = self._copy(source_path, copy_path)
+            _check_integrity(copy_path)
+            size = os.path.getsize(copy_path)
+
+            partial = os.path.join(scratch, name)
+            with open(copy_path, 'rb') as src, gzip.open(partial, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            checksum = _sha256(partial)
+            # Publish the checksum first: a snapshot without one is never listed
+            with open(path[:-len(SNAPSHOT_SUFFIX)] + '.sha256', 'w') as f:
+                f.write(f'{checksum}  {name}\n')
+            os.replace(partial, path)
+
+        print(f"💾 Snapshot {name}: {size / 1e6:.1f} MB copied in {seconds:.2f}s"
+              f"{f' ({restarts} restarts)' if restarts else ''}, {os.path.getsize(path) / 1e6:.1f} MB compressed")
+        return self.info(name)
+
+    def _checksum_path(self, name):
+        return os.path.join(self.directory, name[:-len(SNAPSHOT_SUFFIX)] + '.sha256')
+
+    def info(self, name):
+        match = SNAPSHOT_PATTERN.match(name)
+        if not match:
+            raise ValueError(f'Not a snapshot name: {name}')
+        path = os.path.join(self.directory, name)
+        with open(self._checksum_path(name)) as f:
+            checksum = f.read().split()[0]
+        return {
+            'name': name,
+            'database': match.group(1),
+            'size': os.path.getsize(path),
+            'sha256': checksum,
+            'created_at': datetime.strptime(match.group(3), STAMP_FORMAT),
+        }
+
+    def list(self):
+        """Snapshots newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory)
+                 if SNAPSHOT_PATTERN.match(name) and os.path.exists(self._checksum_path(name))]
+        snapshots = [self.info(name) for name in names]
+        return sorted(snapshots, key=lambda snapshot: (snapshot['created_at'], snapshot['name']), reverse=True)
+
+    def rotate(self, keep=None):
+        """Delete all but the newest `keep` (BACKUP_KEEP) snapshots of each database; returns the names removed"""
+        keep = self.app.config['BACKUP_KEEP'] if keep is None else keep
+        kept = {}
+        removed = []
+        for snapshot in self.list():
+            kept[snapshot['database']] = kept.get(snapshot['database'], 0) + 1
+            if kept[snapshot['database']] > keep:
+                removed.append(snapshot['name'])
+        for name in removed:
+            os.remove(os.path.join(self.directory, name))
+            os.remove(self._checksum_path(name))
+        return removed
+
+    def verify(self, name):
+        """Raise if a snapshot's checksum does not match"""
+        snapshot = self.info(name)
+        actual = _sha256(os.path.join(self.directory, name))
+        if actual != snapshot['sha256']:
+            raise RuntimeError(f'Checksum mismatch for {name}: expected {snapshot["sha256"]}, got {actual}')
+        return snapshot
+
+    def restore(self, name):
+        """
+        Replace the contents of the snapshot's live database (main or tenant)
+
+        The snapshot is checksum- and integrity-verified first, then written
+        into the live file with the backup API, which holds the write lock
+        for the copy. Restart the app (and worker) afterwards so in-memory
+        caches are rebuilt.
+        """
+        snapshot = self.verify(name)
+        target_path = self._source_path(snapshot['database'])
+        with self._lock, tempfile.TemporaryDirectory(dir=self.directory) as scratch:
+            copy_path = os.path.join(scratch, 'restore.db')
+            with gzip.open(os.path.join(self.directory, name), 'rb') as src, open(copy_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            _check_integrity(copy_path)
+            source = sqlite3.connect(copy_path)
+            target = sqlite3.connect(target_path, timeout=30)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        print(f"♻️ Restored {name} into {target_path}")
@@ -4,5 +4,8 @@
 echo "Starting CocoCRM..."
 echo "Telegram bot commands are handled via webhook at /telegram/webhook"
 
+# Bring every tenant database up to the current schema (no-op unless SHARDING=1)
+python shard_tenants.py --migrate || exit 1
+
 # Start the Flask web server (bot webhook is integrated)
 gunicorn app:app --bind 0.0.0.0:$PORT --timeout 120
@@ -0,0 +1,220 @@
+// Chart data is rendered by the template into #analytics-data
+const chartData = JSON.parse(document.getElementById('analytics-data').textContent);
+const stageCounts = ['lead', 'qualified', 'proposal', 'negotiation', 'closed-won', 'closed-lost']
+    .map(stage => chartData.deals_by_stage[stage]);
+
+// Win Rate Doughnut Chart
+const winRateCtx = document.getElementById('winRateChart').getContext('2d');
+new Chart(winRateCtx, {
+    type: 'doughnut',
+    data: {
+        labels: ['Won', 'Lost'],
+        datasets: [{
+            data: [chartData.won_deals, chartData.lost_deals],
+            backgroundColor: ['#4caf50', '#f44336'],
+            borderWidth: 0
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        plugins: {
+            legend: {
+                position: 'bottom',
+            },
+            tooltip: {
+                callbacks: {
+                    label: function(context) {
+                        const total = chartData.won_deals + chartData.lost_deals;
+                        const percentage = total > 0 ? ((context.parsed / total) * 100).toFixed(1) : 0;
+                        return context.label + ': ' + context.parsed + ' (' + percentage + '%)';
+                    }
+                }
+            }
+        }
+    }
+});
+
+// Deals by Stage Bar Chart
+const stageCtx = document.getElementById('stageChart').getContext('2d');
+new Chart(stageCtx, {
+    type: 'bar',
+    data: {
+        labels: ['Lead', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost'],
+        datasets: [{
+            label: 'Deals',
+            data: stageCounts,
+            backgroundColor: ['#2196f3', '#9c27b0', '#ff9800', '#e91e63', '#4caf50', '#f44336'],
+            borderWidth: 0
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        plugins: {
+            legend: {
+                display: false
+            }
+        },
+        scales: {
+            y: {
+                beginAtZero: true,
+                ticks: {
+                    stepSize: 1
+                }
+            }
+        }
+    }
+});
+
+// Monthly Growth Trend Line Chart
+const trendCtx = document.getElementById('trendChart').getContext('2d');
+new Chart(trendCtx, {
+    type: 'line',
+    data: {
+        labels: chartData.monthly_labels,
+        datasets: [{
+            label: 'Contacts',
+            data: chartData.monthly_contacts,
+            borderColor: '#667eea',
+            backgroundColor: 'rgba(102, 126, 234, 0.1)',
+            fill: true,
+            tension: 0.4
+        }, {
+            label: 'Deals',
+            data: chartData.monthly_deals,
+            borderColor: '#f093fb',
+            backgroundColor: 'rgba(240, 147, 251, 0.1)',
+            fill: true,
+            tension: 0.4
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        scales: { y: { beginAtZero: true, ticks: { stepSize: 1 } } }
+    }
+});
+
+// Monthly Revenue Bar Chart
+const revenueCtx = document.getElementById('revenueChart').getContext('2d');
+new Chart(revenueCtx, {
+    type: 'bar',
+    data: {
+        labels: chartData.monthly_labels,
+        datasets: [{
+            label: 'Revenue',
+            data: chartData.monthly_revenue,
+            backgroundColor: 'rgba(76, 175, 80, 0.7)',
+            borderColor: '#4caf50',
+            borderWidth: 2
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        scales: { y: { beginAtZero: true, ticks: { callback: v => '$' + v.toLocaleString() } } }
+    }
+});
+
+// Task Completion Doughnut
+const taskCtx = document.getElementById('taskChart').getContext('2d');
+new Chart(taskCtx, {
+    type: 'doughnut',
+    data: {
+        labels: ['Completed', 'Pending'],
+        datasets: [{
+            data: [chartData.completed_tasks, chartData.pending_tasks],
+            backgroundColor: ['#4caf50', '#ff9800'],
+            borderWidth: 0
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        plugins: { legend: { position: 'bottom' } }
+    }
+});
+
+// Weighted Revenue Forecast with 10-90% confidence band
+const forecastCtx = document.getElementById('forecastChart').getContext('2d');
+new Chart(forecastCtx, {
+    type: 'line',
+    data: {
+        labels: chartData.forecast.map(bucket => new Date(bucket.start + 'T00:00:00').toLocaleDateString('en-US', { month: 'short', year: 'numeric' })),
+        datasets: [{
+            label: '90th percentile',
+            data: chartData.forecast.map(bucket => bucket.p90),
+            borderColor: 'rgba(102, 126, 234, 0.3)',
+            backgroundColor: 'rgba(102, 126, 234, 0.15)',
+            pointRadius: 0,
+            fill: '+1'
+        }, {
+            label: '10th percentile',
+            data: chartData.forecast.map(bucket => bucket.p10),
+            borderColor: 'rgba(102, 126, 234, 0.3)',
+            pointRadius: 0,
+            fill: false
+        }, {
+            label: 'Expected',
+            data: chartData.forecast.map(bucket => bucket.expected),
+            borderColor: '#667eea',
+            backgroundColor: '#667eea',
+            tension: 0.3,
+            fill: false
+        }]
+    },
+    options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        scales: { y: { beginAtZero: true, ticks: { callback: v => '$' + v.toLocaleString() } } }
+    }
+});
+
+// Pipeline Overview Horizontal Bar Chart
+const pipelineCtx = document.getElementById('pipelineChart').getContext('2d');
+new Chart(pipelineCtx, {
+    type: 'bar',
+    data: {
+        labels: ['Lead', 'Qualified', 'Proposal', 'Negotiation', 'Closed Won', 'Closed Lost'],
+        datasets: [{
+            label: 'Number of Deals',
+            data: stageCounts,
+            backgroundColor: [
+                'rgba(33, 150, 243, 0.8)',
+                'rgba(156, 39, 176, 0.8)',
+                'rgba(255, 152, 0, 0.8)',
+                'rgba(233, 30, 99, 0.8)',
+                'rgba(76, 175, 80, 0.8)',
+                'rgba(244, 67, 54, 0.8)'
+            ],
+            borderColor: [
+                '#2196f3',
+                '#9c27b0',
+                '#ff9800',
+                '#e91e63',
+                '#4caf50',
+                '#f44336'
+            ],
+            borderWidth: 2
+        }]
+    },
+    options: {
+        indexAxis: 'y',
+        responsive: true,
+        maintainAspectRatio: false,
+        plugins: {
+            legend: {
+                display: false
+            }
+        },
+        scales: {
+            x: {
+                beginAtZero: true,
+                ticks: {
+                    stepSize: 1
+                }
+            }
+        }
+    }
+});
@@ -0,0 +1,8 @@
+function toggleAutomation(id) {
+    fetch('/automations/toggle/' + id, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' }
+    })
+    .then(response => response.json())
+    .then(data => console.log('Automation toggled:', data));
+}
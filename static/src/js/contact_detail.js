@@ -0,0 +1,42 @@
+const loadOlder = document.getElementById('load-older');
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : value;
+    return div.innerHTML;
+}
+
+function renderTimelineItem(item) {
+    let context = item.detail || '';
+    if (item.deal_title) {
+        context += (context ? ' · ' : '') + '💰 ' + item.deal_title;
+    }
+    return '<div class="activity-item">' +
+        '<span class="activity-type">' + escapeHtml(item.badge) + '</span>' +
+        '<div class="activity-description">' + escapeHtml(item.text) + '</div>' +
+        (context ? '<div class="activity-context">' + escapeHtml(context) + '</div>' : '') +
+        '<div class="activity-time">' + escapeHtml(item.created_label) + '</div>' +
+        '</div>';
+}
+
+if (loadOlder) {
+    loadOlder.addEventListener('click', function() {
+        loadOlder.disabled = true;
+        const base = loadOlder.dataset.url;
+        const url = base + (base.includes('?') ? '&' : '?') + 'before=' +
+            encodeURIComponent(loadOlder.dataset.cursor);
+        fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                const timeline = document.getElementById('timeline');
+                timeline.insertAdjacentHTML('beforeend', data.items.map(renderTimelineItem).join(''));
+                if (data.next_cursor) {
+                    loadOlder.dataset.cursor = data.next_cursor;
+                    loadOlder.disabled = false;
+                } else {
+                    loadOlder.remove();
+                }
+            })
+            .catch(() => { loadOlder.disabled = false; });
+    });
+}
@@ -0,0 +1,41 @@
+const bulkForm = document.getElementById('bulk-form');
+
+function selectedIds() {
+    return Array.from(document.querySelectorAll('.bulk-select:checked')).map(box => box.value);
+}
+
+if (bulkForm) {
+    // Absent when showing fuzzy matches, which a filter cannot reproduce
+    const selectAll = document.getElementById('select-all');
+    const allSelected = () => selectAll !== null && selectAll.checked;
+    const counter = document.getElementById('bulk-count');
+
+    document.addEventListener('change', function(event) {
+        if (event.target.classList.contains('bulk-select') || event.target === selectAll) {
+            counter.textContent = (allSelected() ? 'All matching' : selectedIds().length) + ' selected';
+        }
+    });
+
+    bulkForm.addEventListener('submit', function(event) {
+        bulkForm.querySelectorAll('input[name="ids"]').forEach(input => input.remove());
+        const ids = selectedIds();
+        if (!allSelected() && ids.length === 0) {
+            event.preventDefault();
+            alert('Select at least one contact');
+            return;
+        }
+        const target = allSelected() ? 'all matching contacts' : ids.length + ' contacts';
+        const isDelete = event.submitter && event.submitter.dataset.confirm === 'delete';
+        if (isDelete && !confirm('Delete ' + target + ' with their deals, tasks and activities?')) {
+            event.preventDefault();
+            return;
+        }
+        ids.forEach(id => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'ids';
+            input.value = id;
+            bulkForm.appendChild(input);
+        });
+    });
+}
@@ -0,0 +1,75 @@
+const contactSearch = document.getElementById('contact_search');
+const contactId = document.getElementById('contact_id');
+const suggestions = document.getElementById('contact_suggestions');
+
+function contactLabel(contact) {
+    return contact.name + (contact.company ? ' - ' + contact.company : '');
+}
+
+function hideSuggestions() {
+    suggestions.hidden = true;
+    suggestions.innerHTML = '';
+}
+
+function showSuggestions(contacts) {
+    suggestions.innerHTML = '';
+    contacts.forEach(contact => {
+        const item = document.createElement('li');
+        item.textContent = contactLabel(contact);
+        item.dataset.id = contact.id;
+        suggestions.appendChild(item);
+    });
+    if (contacts.length === 0) {
+        const empty = document.createElement('li');
+        empty.className = 'empty';
+        empty.textContent = 'No matching contacts';
+        suggestions.appendChild(empty);
+    }
+    suggestions.hidden = false;
+}
+
+if (contactSearch) {
+    let timer = null;
+    let latest = 0;
+
+    contactSearch.addEventListener('input', function() {
+        // Typing replaces the chosen contact; an empty box means no contact
+        contactId.value = '';
+        clearTimeout(timer);
+        const query = contactSearch.value.trim();
+        if (!query) {
+            hideSuggestions();
+            return;
+        }
+        timer = setTimeout(() => {
+            const request = ++latest;
+            fetch(contactSearch.dataset.url + '?q=' + encodeURIComponent(query))
+                .then(response => response.json())
+                .then(data => {
+                    // Drop answers to queries the user has already typed past
+                    if (request === latest) {
+                        showSuggestions(data.contacts);
+                    }
+                })
+                .catch(hideSuggestions);
+        }, 120);
+    });
+
+    suggestions.addEventListener('mousedown', function(event) {
+        const item = event.target.closest('li[data-id]');
+        if (!item) {
+            return;
+        }
+        event.preventDefault();
+        contactId.value = item.dataset.id;
+        contactSearch.value = item.textContent;
+        hideSuggestions();
+    });
+
+    contactSearch.addEventListener('blur', function() {
+        if (!contactId.value) {
+            contactSearch.value = '';
+        }
+        hideSuggestions();
+    });
+}
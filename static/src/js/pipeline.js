@@ -0,0 +1,99 @@
+const liveUrl = document.currentScript.dataset.liveUrl;
+
+const bulkForm = document.getElementById('bulk-form');
+const selectAll = document.getElementById('select-all');
+const counter = document.getElementById('bulk-count');
+
+function selectedIds() {
+    return Array.from(document.querySelectorAll('.bulk-select:checked')).map(box => box.value);
+}
+
+document.addEventListener('change', function(event) {
+    if (event.target.classList.contains('bulk-select') || event.target === selectAll) {
+        counter.textContent = (selectAll.checked ? 'All' : selectedIds().length) + ' selected';
+    }
+});
+
+bulkForm.addEventListener('submit', function(event) {
+    bulkForm.querySelectorAll('input[name="ids"]').forEach(input => input.remove());
+    const ids = selectedIds();
+    if (!selectAll.checked && ids.length === 0) {
+        event.preventDefault();
+        alert('Select at least one deal');
+        return;
+    }
+    const target = selectAll.checked ? 'ALL deals' : ids.length + ' deals';
+    const isDelete = event.submitter && event.submitter.dataset.confirm === 'delete';
+    if (isDelete && !confirm('Delete ' + target + ' with their tasks and activities?')) {
+        event.preventDefault();
+        return;
+    }
+    ids.forEach(id => {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = 'ids';
+        input.value = id;
+        bulkForm.appendChild(input);
+    });
+});
+
+// Live updates: moves and edits are applied in place, anything else offers a refresh
+const liveBanner = document.getElementById('live-banner');
+
+function showRefresh() {
+    liveBanner.hidden = false;
+}
+
+function dealCard(id) {
+    return document.querySelector('.deal-card[data-deal-id="' + id + '"]');
+}
+
+function updateCounts() {
+    document.querySelectorAll('.pipeline-column').forEach(column => {
+        const cards = column.querySelectorAll('.deal-card').length;
+        column.querySelector('.column-count').textContent = cards;
+        const empty = column.querySelector('.empty-column');
+        if (empty) empty.hidden = cards > 0;
+    });
+}
+
+function moveCard(id, stage) {
+    const card = dealCard(id);
+    const column = document.querySelector('.pipeline-column[data-stage="' + stage + '"]');
+    if (!card || !column) return false;
+    if (card.closest('.pipeline-column') !== column) {
+        column.querySelector('.deal-cards').prepend(card);
+    }
+    return true;
+}
+
+function removeCards(ids) {
+    if (!ids) return showRefresh();
+    ids.forEach(id => {
+        const card = dealCard(id);
+        if (card) card.remove();
+    });
+    updateCounts();
+}
+
+if (window.EventSource) {
+    const live = new EventSource(liveUrl);
+    const on = (kind, handler) => live.addEventListener(kind, event => handler(JSON.parse(event.data)));
+
+    on('deal.updated', data => {
+        const deal = data.deal;
+        const card = dealCard(deal.id);
+        if (!card || !moveCard(deal.id, deal.stage)) return showRefresh();
+        card.querySelector('.deal-title span').textContent = deal.title;
+        card.querySelector('.deal-value').textContent = '$' + Number(deal.value || 0).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+        card.querySelector('.deal-probability').textContent = deal.probability + '%';
+        updateCounts();
+    });
+    on('deals.moved', data => {
+        if (!data.ids.every(id => moveCard(id, data.stage))) showRefresh();
+        updateCounts();
+    });
+    on('deal.deleted', data => removeCards([data.id]));
+    on('deals.deleted', data => removeCards(data.ids));
+    ['deal.created', 'contacts.deleted', 'refresh'].forEach(kind => on(kind, showRefresh));
+}
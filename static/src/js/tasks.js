@@ -0,0 +1,121 @@
+const liveUrl = document.currentScript.dataset.liveUrl;
+
+function openTaskModal() {
+    document.getElementById('taskModal').classList.add('active');
+}
+
+function closeTaskModal() {
+    document.getElementById('taskModal').classList.remove('active');
+}
+
+function openEditModal(taskId, title, description, priority, dueDate) {
+    document.getElementById('edit_title').value = title;
+    document.getElementById('edit_description').value = description || '';
+    document.getElementById('edit_priority').value = priority;
+    document.getElementById('edit_due_date').value = dueDate || '';
+    document.getElementById('editTaskForm').action = '/tasks/edit/' + taskId;
+    document.getElementById('editTaskModal').classList.add('active');
+}
+
+function closeEditModal() {
+    document.getElementById('editTaskModal').classList.remove('active');
+}
+
+function deleteTask(taskId) {
+    if (confirm('Are you sure you want to delete this task?')) {
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/tasks/delete/' + taskId;
+        document.body.appendChild(form);
+        form.submit();
+    }
+}
+
+// Close modals on outside click
+document.getElementById('taskModal').addEventListener('click', function(e) {
+    if (e.target === this) closeTaskModal();
+});
+
+document.getElementById('editTaskModal').addEventListener('click', function(e) {
+    if (e.target === this) closeEditModal();
+});
+
+const bulkForm = document.getElementById('bulk-form');
+
+function selectedIds() {
+    return Array.from(document.querySelectorAll('.bulk-select:checked')).map(box => box.value);
+}
+
+if (bulkForm) {
+    const selectAll = document.getElementById('select-all');
+    const counter = document.getElementById('bulk-count');
+
+    document.addEventListener('change', function(event) {
+        if (event.target.classList.contains('bulk-select') || event.target === selectAll) {
+            counter.textContent = (selectAll.checked ? 'All pending' : selectedIds().length) + ' selected';
+        }
+    });
+
+    bulkForm.addEventListener('submit', function(event) {
+        bulkForm.querySelectorAll('input[name="ids"]').forEach(input => input.remove());
+        const ids = selectedIds();
+        if (!selectAll.checked && ids.length === 0) {
+            event.preventDefault();
+            alert('Select at least one task');
+            return;
+        }
+        ids.forEach(id => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'ids';
+            input.value = id;
+            bulkForm.appendChild(input);
+        });
+    });
+}
+
+function toggleTask(taskId) {
+    fetch('/tasks/toggle/' + taskId, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        }
+    });
+}
+
+// Live updates: completion and priority changes are applied in place, anything else offers a refresh
+const liveBanner = document.getElementById('live-banner');
+
+function showRefresh() {
+    liveBanner.hidden = false;
+}
+
+function applyTaskChange(id, changes) {
+    const item = document.querySelector('.task-item[data-task-id="' + id + '"]');
+    if (!item) return showRefresh();
+    if (changes.completed !== undefined && changes.completed !== null) {
+        item.classList.toggle('completed', changes.completed);
+        item.querySelector('.task-checkbox').checked = changes.completed;
+    }
+    if (changes.priority) {
+        item.classList.remove('priority-low', 'priority-medium', 'priority-high');
+        item.classList.add('priority-' + changes.priority);
+    }
+}
+
+if (window.EventSource) {
+    const live = new EventSource(liveUrl);
+    const on = (kind, handler) => live.addEventListener(kind, event => handler(JSON.parse(event.data)));
+
+    on('task.updated', data => applyTaskChange(data.task.id, data.task));
+    on('tasks.updated', data => data.ids.forEach(id => applyTaskChange(id, data)));
+    on('task.deleted', data => {
+        const item = document.querySelector('.task-item[data-task-id="' + data.id + '"]');
+        if (item) item.remove();
+    });
+    ['task.created', 'deals.deleted', 'contacts.deleted', 'refresh'].forEach(kind => on(kind, showRefresh));
+}
@@ -7,9 +7,9 @@ Handles /login command to generate temporary access tokens for AI agents
 import os
 import asyncio
 import logging
+import httpx
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-import requests
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -30,6 +30,68 @@ BASE_URL = os.environ.get('BASE_URL', 'https://cococrm.onrender.com')
 # Authorized users (can be Telegram IDs or usernames)
 AUTHORIZED_USERS = os.environ.get('AUTHORIZED_TELEGRAM_USERS', '').split(',')
 
+# Updates handled at the same time, and keep-alive connections to the backend
+CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', '32'))
+BACKEND_POOL_SIZE = int(os.environ.get('BOT_BACKEND_POOL_SIZE', '20'))
+BACKEND_TIMEOUT = 10
+# 'local' issues login links in-process through app.py's token service (bot
+# deployed next to the web app and its database); 'http' calls BASE_URL
+BOT_BACKEND = os.environ.get('BOT_BACKEND', 'http')
+
+
+def backend_client() -> httpx.AsyncClient:
+    """Pooled async HTTP client for calls to the CocoCRM backend"""
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        timeout=BACKEND_TIMEOUT,
+        limits=httpx.Limits(max_connections=BACKEND_POOL_SIZE, max_keepalive_connections=BACKEND_POOL_SIZE)
+    )
+
+
+async def open_backend(application: Application) -> None:
+    """Create the shared backend client (or load the in-process token service) when the bot starts"""
+    if BOT_BACKEND == 'local':
+        # Just the models and token service: no schema setup, no webhook (which would stop getUpdates)
+        os.environ['COCOCRM_EMBEDDED'] = '1'
+        from app import app, token_service
+        application.bot_data['local'] = (app, token_service)
+    else:
+        application.bot_data['backend'] = backend_client()
+
+
+async def fetch_login_link(bot_data, user) -> tuple:
+    """(HTTP status, response data) for a user's login link, from the backend or in-process"""
+    if 'local' in bot_data:
+        app, token_service = bot_data['local']
+        link = token_service.cached_link(('telegram', str(user.id)))
+        if link is None:
+            def issue():
+                with app.app_context():
+                    return token_service.telegram_login_link(user.id, user.username, user.first_name, user.last_name)
+            # Database work runs in a worker thread, off the event loop
+            link = await asyncio.to_thread(issue)
+        return 200, {'success': True, 'token': link['token'], 'url': link['url'], 'expires_in': link['expires_in']}
+
+    api_path = "/api/telegram/generate-token"
+    payload = {
+        'api_key': TELEGRAM_API_KEY,
+        'telegram_id': str(user.id),
+        'username': user.username
+    }
+    logger.info(f"Calling API: {BASE_URL}{api_path}")
+    # Awaited, so other chats keep being served while the backend answers
+    response = await bot_data['backend'].post(api_path, json=payload)
+    if response.status_code != 200:
+        return response.status_code, response.text
+    return response.status_code, response.json()
+
+
+async def close_backend(application: Application) -> None:
+    """Close the backend client's connections when the bot stops"""
+    client = application.bot_data.pop('backend', None)
+    if client is not None:
+        await client.aclose()
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -66,22 +128,9 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     status_message = await update.message.reply_text("🔐 Generating your login link...")
 
     try:
-        # Call the backend API to generate token
-        api_url = f"{BASE_URL}/api/telegram/generate-token"
-
-        payload = {
-            'api_key': TELEGRAM_API_KEY,
-            'telegram_id': telegram_id,
-            'username': username
-        }
-
-        logger.info(f"Calling API: {api_url}")
-
-        response = requests.post(api_url, json=payload, timeout=10)
-
-        if response.status_code == 200:
-            data = response.json()
+        status_code, data = await fetch_login_link(context.bot_data, user)
 
+        if status_code == 200:
             if data.get('success'):
                 token = data.get('token')
                 login_url = data.get('url')
@@ -106,19 +155,19 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 logger.error(f"API returned error: {error_msg}")
         else:
             await status_message.edit_text(
-                f"❌ Server error (HTTP {response.status_code})\n\n"
+                f"❌ Server error (HTTP {status_code})\n\n"
                 f"Please try again later or contact the administrator."
             )
-            logger.error(f"HTTP error: {response.status_code} - {response.text}")
+            logger.error(f"HTTP error: {status_code} - {data}")
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         await status_message.edit_text(
             "⏰ Request timeout. The server might be starting up.\n"
             "Please try again in a few moments."
         )
         logger.error("Request timeout")
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         await status_message.edit_text(
             f"❌ Connection error: {str(e)}\n\n"
             f"Please try again later."
@@ -143,10 +192,20 @@ def main() -> None:
         logger.warning("⚠️ TELEGRAM_API_KEY not set - using default (not secure!)")
 
     logger.info("🤖 Starting CocoCRM Telegram Bot...")
-    logger.info(f"📍 Base URL: {BASE_URL}")
-
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    if BOT_BACKEND == 'local':
+        logger.info("📍 Issuing login links in-process (BOT_BACKEND=local)")
+    else:
+        logger.info(f"📍 Base URL: {BASE_URL}")
+
+    # Create the Application - updates from different chats are processed concurrently
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(open_backend)
+        .post_shutdown(close_backend)
+        .build()
+    )
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start))
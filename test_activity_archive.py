@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the monthly activity archive
+Runs the app in-process against a temporary instance directory: old
+activities move into their month's archive table with their ids, ids are
+never reused once a tenant's whole hot table has aged out, and the stage
+history backfill still finds deal moves that were archived.
+
+Usage: python test_activity_archive.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import app, db, activity_archive, shards, Activity, Deal, DealStageHistory, User
+from backfill_stage_history import backfill_stage_history
+
+app.config['TESTING'] = True
+
+
+def create_user(username):
+    with app.app_context():
+        user = User(username=username)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def test_archive_moves_old_rows_keeping_ids():
+    user_id = create_user('archive-move')
+    old = datetime.utcnow() - timedelta(days=400)
+    with app.app_context(), shards.tenant(user_id):
+        archived = Activity(user_id=user_id, activity_type='note', description='old', created_at=old)
+        recent = Activity(user_id=user_id, activity_type='note', description='recent')
+        db.session.add_all([archived, recent])
+        db.session.commit()
+        archived_id, recent_id = archived.id, recent.id
+
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+
+        hot = db.session.execute(db.select(Activity.id).where(Activity.user_id == user_id)).scalars().all()
+        table = activity_archive.table(old)
+        cold = db.session.execute(db.select(table.c.id, table.c.description)
+                                  .where(table.c.user_id == user_id)).all()
+        db.session.remove()
+    assert hot == [recent_id]
+    assert [tuple(row) for row in cold] == [(archived_id, 'old')]
+
+
+def test_ids_are_not_reused_after_archiving_everything():
+    user_id = create_user('archive-idle')
+    old = datetime.utcnow() - timedelta(days=400)
+    with app.app_context(), shards.tenant(user_id):
+        db.session.add_all([Activity(user_id=user_id, activity_type='note', description=f'old {i}', created_at=old)
+                            for i in range(3)])
+        db.session.commit()
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+        # Back after a long break: new activity, which ages out in turn
+        db.session.add(Activity(user_id=user_id, activity_type='note', description='later', created_at=old))
+        db.session.commit()
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+
+        table = activity_archive.table(old)
+        ids = db.session.execute(db.select(table.c.id).where(table.c.user_id == user_id)).scalars().all()
+        ids += db.session.execute(db.select(Activity.id).where(Activity.user_id == user_id)).scalars().all()
+        db.session.remove()
+    assert len(ids) == len(set(ids)) == 4
+
+
+def test_backfill_reads_archived_moves():
+    user_id = create_user('archive-backfill')
+    created = datetime.utcnow() - timedelta(days=400)
+    with app.app_context(), shards.tenant(user_id):
+        deal = Deal(user_id=user_id, title='Big one', value=1000, stage='proposal', created_at=created)
+        db.session.add(deal)
+        db.session.flush()
+        db.session.add_all([
+            Activity(user_id=user_id, deal_id=deal.id, activity_type='note',
+                     description='Deal "Big one" moved from lead to qualified', created_at=created + timedelta(days=1)),
+            Activity(user_id=user_id, deal_id=deal.id, activity_type='note',
+                     description='Deal "Big one" moved from qualified to proposal', created_at=datetime.utcnow()),
+        ])
+        db.session.commit()
+        deal_id = deal.id
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+        # A deal from before stage history existed
+        db.session.execute(db.delete(DealStageHistory).where(DealStageHistory.deal_id == deal_id))
+        db.session.commit()
+        db.session.remove()
+
+    backfill_stage_history()
+
+    with app.app_context(), shards.tenant(user_id):
+        history = db.session.execute(
+            db.select(DealStageHistory.from_stage, DealStageHistory.to_stage)
+            .where(DealStageHistory.deal_id == deal_id).order_by(DealStageHistory.changed_at)
+        ).all()
+        db.session.remove()
+    assert [tuple(row) for row in history] == [(None, 'lead'), ('lead', 'qualified'), ('qualified', 'proposal')]
+
+
+TESTS = [
+    test_archive_moves_old_rows_keeping_ids,
+    test_ids_are_not_reused_after_archiving_everything,
+    test_backfill_reads_archived_moves,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Load test for the Telegram bot's /crm command
+Starts a fake backend whose /api/telegram/generate-token answers after a
+delay, then runs N /crm commands at once through the bot's handler and
+pooled client. With non-blocking backend calls they overlap, so the whole
+run takes about one delay instead of N delays.
+
+Usage: python test_bot_load.py [N=20] [delay seconds=1.0]
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import telegram_bot
+
+
+def start_fake_backend(delay):
+    """Slow token endpoint on a free local port; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real backend
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(delay)
+            data = json.dumps({
+                'success': True,
+                'token': f"token-{body['telegram_id']}",
+                'url': f"http://crm.example/auth/telegram-token/token-{body['telegram_id']}",
+                'expires_in': 180
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 256  # the default backlog of 5 would delay the burst of connects
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeMessage:
+    """Stands in for a chat message: records what the bot replies"""
+
+    def __init__(self):
+        self.text = None
+
+    async def reply_text(self, text):
+        self.text = text
+        return self
+
+    async def edit_text(self, text):
+        self.text = text
+
+
+async def crm_command(user_id, bot_data):
+    """Run one /crm command through the bot's handler; returns (seconds, final reply)"""
+    message = FakeMessage()
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id, username=f'user{user_id}'), message=message)
+    context = SimpleNamespace(bot_data=bot_data)
+    started = time.perf_counter()
+    await telegram_bot.login_command(update, context)
+    return time.perf_counter() - started, message.text
+
+
+async def run(count, delay):
+    application = SimpleNamespace(bot_data={})
+    await telegram_bot.open_backend(application)
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*[crm_command(1000 + i, application.bot_data) for i in range(count)])
+        total = time.perf_counter() - started
+    finally:
+        await telegram_bot.close_backend(application)
+    return results, total
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    server = start_fake_backend(delay)
+    telegram_bot.BASE_URL = f'http://127.0.0.1:{server.server_port}'
+    print(f"🧪 {count} concurrent /crm requests, backend delay {delay:.1f}s")
+    print("=" * 60)
+
+    results, total = asyncio.run(run(count, delay))
+    server.shutdown()
+
+    succeeded = sum(1 for _, text in results if text and text.startswith('✅'))
+    slowest = max(seconds for seconds, _ in results)
+    print(f"Succeeded: {succeeded}/{count}")
+    print(f"Slowest request: {slowest:.2f}s")
+    print(f"Wall time: {total:.2f}s (serial would be {count * delay:.1f}s)")
+
+    # Parallel: the batch finishes in a few delays, not one delay per request
+    waves = -(-count // telegram_bot.BACKEND_POOL_SIZE)
+    if succeeded == count and total < (waves + 1) * delay:
+        print("✅ Requests completed in parallel")
+        return 0
+    print("❌ Requests did not run concurrently")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
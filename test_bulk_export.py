@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the bulk export API (/api/export/<collection>.<fmt>)
+Runs the app in-process against a temporary instance directory: activity
+exports include the archived months before the hot table with ids
+ascending, since/until skip archived rows outside the window, and
+malformed filters get a 400.
+
+Usage: python test_bulk_export.py
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import app, db, activity_archive, shards, Activity, User, OPENCLAW_API_KEY
+
+app.config['TESTING'] = True
+client = app.test_client()
+
+
+def create_user(username):
+    with app.app_context():
+        user = User(username=username)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def add_activities(user_id, ages):
+    """One activity per age in days, then archive those past retention; returns their ids"""
+    now = datetime.utcnow()
+    with app.app_context(), shards.tenant(user_id):
+        rows = [Activity(user_id=user_id, activity_type='note', description=f'{days} days ago',
+                         created_at=now - timedelta(days=days)) for days in ages]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        activity_archive.archive(cutoff=now - timedelta(days=180))
+        db.session.remove()
+    return ids
+
+
+def export(collection, **params):
+    """(response, decoded rows) for a JSON Lines export"""
+    response = client.get(f'/api/export/{collection}.jsonl', query_string=params,
+                          headers={'X-API-Key': OPENCLAW_API_KEY})
+    if response.status_code != 200:
+        return response, None
+    return response, [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+def test_activities_include_archived_months():
+    user_id = create_user('export-archive')
+    ids = add_activities(user_id, [500, 300, 3, 2])
+    response, rows = export('activities', username='export-archive')
+    assert response.status_code == 200
+    assert [row['id'] for row in rows] == ids
+    assert [row['description'] for row in rows] == ['500 days ago', '300 days ago', '3 days ago', '2 days ago']
+
+
+def test_since_and_until_skip_archived_rows():
+    user_id = create_user('export-window')
+    add_activities(user_id, [500, 300, 3, 2])
+    since = (datetime.utcnow() - timedelta(days=400)).isoformat()
+    _, rows = export('activities', username='export-window', since=since)
+    assert [row['description'] for row in rows] == ['300 days ago', '3 days ago', '2 days ago']
+
+    until = (datetime.utcnow() - timedelta(days=100)).isoformat()
+    _, rows = export('activities', username='export-window', until=until)
+    assert [row['description'] for row in rows] == ['500 days ago', '300 days ago']
+
+
+def test_malformed_filters_are_rejected():
+    create_user('export-malformed')
+    for params in ({'since': 'yesterday'}, {'no_such_column': '1'}, {'deal_id': 'abc'}):
+        response, _ = export('activities', username='export-malformed', **params)
+        assert response.status_code == 400, params
+    assert export('nothing', username='export-malformed')[0].status_code == 404
+
+
+TESTS = [
+    test_activities_include_archived_months,
+    test_since_and_until_skip_archived_rows,
+    test_malformed_filters_are_rejected,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk operations on contacts, deals and tasks
+Runs the app in-process against a temporary instance directory: bulk
+deletes cascade through deals, tasks, activities (hot and archived) and
+stage history, leave tombstones for the change feed, never touch another
+user's rows, and reject malformed selections with a 400. Bulk edits match
+tags case-insensitively and also update rows whose stage or priority is
+NULL.
+
+Usage: python test_bulk_operations.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import (
+    app, db, activity_archive, shards, Activity, Contact, Deal, DealStageHistory, Task, Tombstone, User
+)
+
+app.config['TESTING'] = True
+
+
+def sign_up(username):
+    """Register (and sign in) a user through the app; returns (client, user id)"""
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': 'pw', 'confirm_password': 'pw'})
+    with app.app_context():
+        return client, db.session.execute(db.select(User.id).where(User.username == username)).scalar_one()
+
+
+def add_contact_graph(user_id, name):
+    """A contact with a deal, a task on each, a recent and an archived activity; returns their ids"""
+    with app.app_context(), shards.tenant(user_id):
+        contact = Contact(user_id=user_id, name=name, tags='lead')
+        db.session.add(contact)
+        db.session.flush()
+        deal = Deal(user_id=user_id, contact_id=contact.id, title=f'{name} deal', value=100, stage='lead')
+        db.session.add(deal)
+        db.session.flush()
+        tasks = [Task(user_id=user_id, contact_id=contact.id, title=f'Call {name}'),
+                 Task(user_id=user_id, deal_id=deal.id, title=f'Quote {name}')]
+        old = datetime.utcnow() - timedelta(days=400)
+        db.session.add_all(tasks + [
+            Activity(user_id=user_id, deal_id=deal.id, activity_type='note', description='old', created_at=old),
+            Activity(user_id=user_id, contact_id=contact.id, activity_type='note', description='recent'),
+        ])
+        db.session.commit()
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+        ids = {'contact': contact.id, 'deal': deal.id, 'tasks': sorted(t.id for t in tasks)}
+        db.session.remove()
+    return ids
+
+
+def remaining(user_id, ids):
+    """Which rows of a contact graph still exist, and the tombstones recorded for them"""
+    with app.app_context(), shards.tenant(user_id):
+        select = db.session.execute
+        archived = sum(select(db.select(db.func.count()).select_from(table)
+                              .where(table.c.deal_id == ids['deal'])).scalar()
+                       for _, table in activity_archive.tables())
+        state = {
+            'contact': select(db.select(Contact.id).where(Contact.id == ids['contact'])).first() is not None,
+            'deal': select(db.select(Deal.id).where(Deal.id == ids['deal'])).first() is not None,
+            'tasks': select(db.select(db.func.count()).where(Task.id.in_(ids['tasks']))).scalar(),
+            'activities': select(db.select(db.func.count()).where(db.or_(
+                Activity.contact_id == ids['contact'], Activity.deal_id == ids['deal']))).scalar() + archived,
+            'history': select(db.select(db.func.count()).where(DealStageHistory.deal_id == ids['deal'])).scalar(),
+            'tombstones': sorted(select(db.select(Tombstone.collection, Tombstone.record_id)
+                                        .where(Tombstone.user_id == user_id)).all()),
+        }
+        db.session.remove()
+    return state
+
+
+def test_bulk_delete_contacts_cascades():
+    client, user_id = sign_up('bulk-cascade')
+    gone = add_contact_graph(user_id, 'Gone')
+    kept = add_contact_graph(user_id, 'Kept')
+
+    response = client.post('/contacts/bulk-delete', json={'ids': [gone['contact']]})
+    assert response.status_code == 200 and response.json['count'] == 1
+
+    state = remaining(user_id, gone)
+    assert state['tombstones'] == sorted([('contacts', gone['contact']), ('deals', gone['deal'])]
+                                         + [('tasks', task_id) for task_id in gone['tasks']])
+    del state['tombstones']
+    assert state == {'contact': False, 'deal': False, 'tasks': 0, 'activities': 0, 'history': 0}
+    kept_state = remaining(user_id, kept)
+    assert kept_state['contact'] and kept_state['deal']
+    assert (kept_state['tasks'], kept_state['activities'], kept_state['history']) == (2, 2, 1)
+
+
+def test_bulk_delete_deals_by_filter():
+    client, user_id = sign_up('bulk-deal-filter')
+    first = add_contact_graph(user_id, 'First')
+    second = add_contact_graph(user_id, 'Second')
+
+    response = client.post('/deals/bulk-delete', json={'filter': {'search': 'First'}})
+    assert response.status_code == 200 and response.json['count'] == 1
+
+    state = remaining(user_id, first)
+    # The contact stays; its deal and everything hanging off the deal go
+    assert state['contact'] and not state['deal']
+    assert (state['tasks'], state['activities'], state['history']) == (1, 1, 0)
+    assert remaining(user_id, second)['deal']
+
+
+def test_other_users_rows_are_untouched():
+    client, _ = sign_up('bulk-intruder')
+    _, victim_id = sign_up('bulk-victim')
+    victim = add_contact_graph(victim_id, 'Victim')
+
+    response = client.post('/contacts/bulk-delete', json={'ids': [victim['contact']]})
+    assert response.status_code == 200 and response.json['count'] == 0
+    assert remaining(victim_id, victim)['contact']
+
+
+def test_malformed_selections_are_rejected():
+    client, user_id = sign_up('bulk-malformed')
+    kept = add_contact_graph(user_id, 'Kept')
+    for body in ({'ids': ['abc']}, {'ids': [True]}, {'ids': [1.5]}, {'ids': 'x'},
+                 {'filter': 'all'}, {'filter': {'contact_id': 'abc'}}):
+        endpoint = '/deals/bulk-delete' if 'filter' in body else '/contacts/bulk-delete'
+        response = client.post(endpoint, json=body)
+        assert response.status_code == 400, body
+        assert response.json['message'] == 'Invalid ids or filter'
+
+    # Form posts get a flash message and a redirect instead
+    response = client.post('/contacts/bulk-delete', data={'ids': ['abc']})
+    assert response.status_code == 302
+    assert remaining(user_id, kept)['contact']
+
+
+def add_rows(user_id, rows):
+    """Insert ORM objects for a user; returns their ids in order"""
+    with app.app_context(), shards.tenant(user_id):
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        db.session.remove()
+    return ids
+
+
+def column_values(user_id, column, ids):
+    with app.app_context(), shards.tenant(user_id):
+        values = dict(db.session.execute(db.select(column.class_.id, column).where(column.class_.id.in_(ids))).all())
+        db.session.remove()
+    return [values[i] for i in ids]
+
+
+def test_bulk_tags_match_case_insensitively():
+    client, user_id = sign_up('bulk-tags')
+    ids = add_rows(user_id, [Contact(user_id=user_id, name='Tagged', tags='VIP, lead'),
+                             Contact(user_id=user_id, name='Untagged')])
+
+    response = client.post('/contacts/bulk-update', json={'ids': ids, 'add_tags': 'vip'})
+    # "VIP" already counts as vip; only the untagged contact changes
+    assert response.json['count'] == 1
+    assert column_values(user_id, Contact.tags, ids) == ['VIP, lead', 'vip']
+
+    response = client.post('/contacts/bulk-update', json={'ids': ids, 'remove_tags': 'Vip'})
+    assert response.json['count'] == 2
+    assert column_values(user_id, Contact.tags, ids) == ['lead', '']
+
+
+def test_bulk_stage_move_includes_null_stage():
+    client, user_id = sign_up('bulk-stage')
+    ids = add_rows(user_id, [Deal(user_id=user_id, title=f'Deal {i}', value=10) for i in range(3)])
+    with app.app_context(), shards.tenant(user_id):
+        db.session.execute(db.update(Deal).where(Deal.id == ids[0]).values(stage=None))
+        db.session.execute(db.update(Deal).where(Deal.id == ids[2]).values(stage='qualified'))
+        db.session.commit()
+        db.session.remove()
+
+    response = client.post('/deals/bulk-update', json={'ids': ids, 'stage': 'qualified'})
+    assert response.json['count'] == 2
+    assert column_values(user_id, Deal.stage, ids) == ['qualified'] * 3
+    with app.app_context(), shards.tenant(user_id):
+        moves = db.session.execute(
+            db.select(DealStageHistory.deal_id, DealStageHistory.from_stage)
+            .where(DealStageHistory.deal_id.in_(ids), DealStageHistory.to_stage == 'qualified')
+            .order_by(DealStageHistory.deal_id)
+        ).all()
+        db.session.remove()
+    # The NULL-stage deal is recorded as leaving no stage; the already-qualified one is not moved
+    assert [tuple(move) for move in moves] == [(ids[0], None), (ids[1], 'lead')]
+
+
+def test_bulk_task_update_includes_null_priority():
+    client, user_id = sign_up('bulk-priority')
+    ids = add_rows(user_id, [Task(user_id=user_id, title='No priority', priority=None),
+                             Task(user_id=user_id, title='Low', priority='low'),
+                             Task(user_id=user_id, title='High', priority='high')])
+    with app.app_context(), shards.tenant(user_id):
+        db.session.execute(db.update(Task).where(Task.id == ids[0]).values(priority=None))
+        db.session.commit()
+        db.session.remove()
+
+    response = client.post('/tasks/bulk-update', json={'ids': ids, 'priority': 'high'})
+    assert response.json['count'] == 2
+    assert column_values(user_id, Task.priority, ids) == ['high'] * 3
+
+
+TESTS = [
+    test_bulk_delete_contacts_cascades,
+    test_bulk_delete_deals_by_filter,
+    test_other_users_rows_are_untouched,
+    test_malformed_selections_are_rejected,
+    test_bulk_tags_match_case_insensitively,
+    test_bulk_stage_move_includes_null_stage,
+    test_bulk_task_update_includes_null_priority,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
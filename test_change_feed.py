@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental change feed (/api/changes)
+Runs the app in-process against a temporary instance directory: rows and
+deletions younger than SYNC_SETTLE_SECONDS are held back until they settle,
+a sync token only returns what changed after it, pages follow the cursor
+without skipping or repeating rows, and a bad token is a 400.
+
+Usage: python test_change_feed.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import app, db, shards, Contact, Tombstone, User, OPENCLAW_API_KEY, SYNC_SETTLE_SECONDS
+
+app.config['TESTING'] = True
+client = app.test_client()
+
+
+def create_user(username):
+    with app.app_context():
+        user = User(username=username)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def add_contacts(user_id, names):
+    with app.app_context(), shards.tenant(user_id):
+        contacts = [Contact(user_id=user_id, name=name) for name in names]
+        db.session.add_all(contacts)
+        db.session.commit()
+        ids = [contact.id for contact in contacts]
+        db.session.remove()
+    return ids
+
+
+def settle(user_id):
+    """Age the user's unsettled changes past the settle window"""
+    horizon = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    past = horizon - timedelta(seconds=5)
+    with app.app_context(), shards.tenant(user_id):
+        db.session.execute(db.update(Contact).where(Contact.user_id == user_id, Contact.updated_at > horizon)
+                           .values(updated_at=past))
+        db.session.execute(db.update(Tombstone).where(Tombstone.user_id == user_id, Tombstone.deleted_at > horizon)
+                           .values(deleted_at=past))
+        db.session.commit()
+        db.session.remove()
+
+
+def changes(username, **params):
+    response = client.get('/api/changes', query_string=dict(params, username=username),
+                          headers={'X-API-Key': OPENCLAW_API_KEY})
+    return response.status_code, response.json
+
+
+def contact_names(body):
+    return [contact['name'] for contact in body['changes']['contacts']]
+
+
+def test_fresh_rows_wait_for_the_settle_window():
+    user_id = create_user('feed-settle')
+    add_contacts(user_id, ['Fresh'])
+    _, body = changes('feed-settle')
+    assert contact_names(body) == []
+
+    # The token did not move past the unsettled row, so it comes with the next poll
+    settle(user_id)
+    _, body = changes('feed-settle', since=body['next_token'])
+    assert contact_names(body) == ['Fresh']
+
+
+def test_token_returns_only_later_changes():
+    user_id = create_user('feed-token')
+    ids = add_contacts(user_id, ['Ada', 'Grace'])
+    settle(user_id)
+    _, body = changes('feed-token')
+    assert contact_names(body) == ['Ada', 'Grace']
+    token = body['next_token']
+
+    with app.app_context(), shards.tenant(user_id):
+        db.session.delete(db.session.get(Contact, ids[0]))
+        db.session.commit()
+        db.session.remove()
+    _, body = changes('feed-token', since=token)
+    assert body['deleted'] == []
+    settle(user_id)
+    _, body = changes('feed-token', since=token)
+    assert contact_names(body) == []
+    assert [(d['collection'], d['id']) for d in body['deleted']] == [('contacts', ids[0])]
+
+
+def test_pages_follow_the_cursor():
+    user_id = create_user('feed-pages')
+    names = [f'Contact {i}' for i in range(5)]
+    add_contacts(user_id, names)
+    settle(user_id)
+    seen, token, has_more = [], '', True
+    while has_more:
+        _, body = changes('feed-pages', since=token, limit=2)
+        seen += contact_names(body)
+        token, has_more = body['next_token'], body['has_more']
+    assert seen == names
+
+
+def test_bad_token_is_rejected():
+    create_user('feed-bad')
+    assert changes('feed-bad', since='not-a-token')[0] == 400
+    assert changes('feed-bad', limit='many')[0] == 400
+
+
+TESTS = [
+    test_fresh_rows_wait_for_the_settle_window,
+    test_token_returns_only_later_changes,
+    test_pages_follow_the_cursor,
+    test_bad_token_is_rejected,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for typo-tolerant (trigram) contact search
+Runs the app in-process against a temporary instance directory: misspelt
+names still find the contact, the contacts page falls back to those
+matches when nothing contains the search text, and its tag filter selects
+the same contacts on the exact and the fuzzy path.
+
+Usage: python test_contact_search.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import app, db, contact_search, shards, Contact, User
+
+app.config['TESTING'] = True
+
+
+def sign_up(username, contacts):
+    """Register a user with some contacts; returns (client, user id)"""
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': 'pw', 'confirm_password': 'pw'})
+    with app.app_context():
+        user_id = db.session.execute(db.select(User.id).where(User.username == username)).scalar_one()
+        with shards.tenant(user_id):
+            db.session.add_all([Contact(user_id=user_id, **fields) for fields in contacts])
+            db.session.commit()
+        db.session.remove()
+    return client, user_id
+
+
+def contact_names(client, **params):
+    """Names on the contacts page, and whether it says they are close matches"""
+    html = client.get('/contacts', query_string=params).data.decode()
+    names = [part.split('</h3>')[0] for part in html.split('<h3>')[1:] if 'No contacts yet' not in part]
+    return names, 'showing close matches' in html
+
+
+def test_typos_find_the_contact():
+    _, user_id = sign_up('search-typos', [
+        {'name': 'John Smith', 'company': 'Acme'},
+        {'name': 'Mary Jones', 'company': 'Globex'},
+    ])
+    with app.app_context(), shards.tenant(user_id):
+        results = contact_search.search(user_id, 'Jonh Smtih')
+        db.session.remove()
+    assert [contact.name for contact, _ in results][:1] == ['John Smith']
+
+
+def test_contacts_page_falls_back_to_fuzzy_matches():
+    client, _ = sign_up('search-page', [{'name': 'Katherine Zeta', 'company': 'Initech'}])
+    assert contact_names(client, search='Katherine') == (['Katherine Zeta'], False)
+    assert contact_names(client, search='Kathrine') == (['Katherine Zeta'], True)
+
+
+def test_tag_filter_is_the_same_on_both_paths():
+    client, _ = sign_up('search-tags', [
+        {'name': 'Peter Parker', 'tags': 'VIP, lead'},
+        {'name': 'Peter Porker', 'tags': 'lead'},
+    ])
+    exact, fuzzy = contact_names(client, search='Peter', tag='vip')
+    assert (exact, fuzzy) == (['Peter Parker'], False)
+    # No contact contains "Petr Parkr", so this goes through the fuzzy path
+    close, fuzzy = contact_names(client, search='Petr Parkr', tag='vip')
+    assert (close, fuzzy) == (['Peter Parker'], True)
+
+
+TESTS = [
+    test_typos_find_the_contact,
+    test_contacts_page_falls_back_to_fuzzy_matches,
+    test_tag_filter_is_the_same_on_both_paths,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for duplicate contact detection and merging
+Runs the app in-process against a temporary instance directory: writes
+record candidate pairs through the blocking keys, a full scan finds the
+same pairs, dismissed pairs stay dismissed, and merging repoints deals,
+tasks and activities (archived ones too) before deleting the duplicate.
+
+Usage: python test_dedupe.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import (
+    app, db, activity_archive, deduper, shards, Activity, Contact, ContactDuplicate, Deal, Task, Tombstone, User,
+    OPENCLAW_API_KEY
+)
+
+app.config['TESTING'] = True
+API_HEADERS = {'X-API-Key': OPENCLAW_API_KEY}
+
+
+def sign_up(username):
+    """Register (and sign in) a user through the app; returns (client, user id)"""
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': 'pw', 'confirm_password': 'pw'})
+    with app.app_context():
+        return client, db.session.execute(db.select(User.id).where(User.username == username)).scalar_one()
+
+
+def add_contacts(user_id, contacts):
+    with app.app_context(), shards.tenant(user_id):
+        rows = [Contact(user_id=user_id, **fields) for fields in contacts]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        db.session.remove()
+    return ids
+
+
+def duplicate_pairs(client, username):
+    response = client.get('/api/contacts/duplicates', query_string={'username': username}, headers=API_HEADERS)
+    return [(pair['contact']['id'], pair['duplicate']['id']) for pair in response.json['duplicates']]
+
+
+PEOPLE = [
+    {'name': 'John Smith', 'email': 'john@acme.com', 'phone': '(555) 010-2000'},
+    {'name': 'Jon Smith', 'email': 'JOHN@acme.com '},
+    {'name': 'Mary Jones', 'phone': '+1 555 010 2999', 'company': 'Globex'},
+]
+
+
+def test_writes_record_candidate_pairs():
+    client, user_id = sign_up('dedupe-write')
+    john, jon, _ = add_contacts(user_id, PEOPLE)
+    assert duplicate_pairs(client, 'dedupe-write') == [(john, jon)]
+
+
+def test_scan_finds_the_same_pairs():
+    client, user_id = sign_up('dedupe-scan')
+    john, jon, _ = add_contacts(user_id, PEOPLE)
+    with app.app_context(), shards.tenant(user_id):
+        assert deduper.scan(user_id) == 1
+        db.session.remove()
+    assert duplicate_pairs(client, 'dedupe-scan') == [(john, jon)]
+
+
+def test_dismissed_pairs_stay_dismissed():
+    client, user_id = sign_up('dedupe-dismiss')
+    john, jon, _ = add_contacts(user_id, PEOPLE)
+    assert client.post(f'/contacts/{jon}/duplicates/{john}/dismiss').status_code == 302
+    assert duplicate_pairs(client, 'dedupe-dismiss') == []
+
+    # Neither editing one of them nor a full rescan brings the pair back
+    with app.app_context(), shards.tenant(user_id):
+        db.session.get(Contact, jon).company = 'Acme'
+        db.session.commit()
+        deduper.scan(user_id)
+        db.session.remove()
+    assert duplicate_pairs(client, 'dedupe-dismiss') == []
+
+
+def test_merge_repoints_everything():
+    client, user_id = sign_up('dedupe-merge')
+    keep, gone = add_contacts(user_id, [{'name': 'Jon Smith', 'email': 'john@acme.com', 'tags': 'lead'},
+                                        {'name': 'John Smith', 'email': 'john@acme.com', 'phone': '555 010 2000',
+                                         'tags': 'vip, lead'}])
+    old = datetime.utcnow() - timedelta(days=400)
+    with app.app_context(), shards.tenant(user_id):
+        deal = Deal(user_id=user_id, contact_id=gone, title='Renewal', value=10)
+        db.session.add_all([deal, Task(user_id=user_id, contact_id=gone, title='Call John'),
+                            Activity(user_id=user_id, contact_id=gone, activity_type='call', created_at=old),
+                            Activity(user_id=user_id, contact_id=gone, activity_type='note')])
+        db.session.commit()
+        activity_archive.archive(cutoff=datetime.utcnow() - timedelta(days=180))
+        db.session.remove()
+
+    response = client.post('/api/contacts/merge', headers=API_HEADERS,
+                           json={'username': 'dedupe-merge', 'keep_id': keep, 'merge_ids': [gone]})
+    assert response.json['merged'] == 1
+    assert response.json['contact']['phone'] == '555 010 2000'
+    assert response.json['contact']['tags'] == 'lead,vip'
+
+    with app.app_context(), shards.tenant(user_id):
+        select = db.session.execute
+        assert select(db.select(Contact.id).where(Contact.user_id == user_id)).scalars().all() == [keep]
+        for model in (Deal, Task, Activity):
+            assert select(db.select(model.contact_id).where(model.user_id == user_id).distinct()).scalars().all() \
+                == [keep], model
+        archived = [table for _, table in activity_archive.tables()]
+        assert [select(db.select(table.c.contact_id).where(table.c.user_id == user_id)).scalars().all()
+                for table in archived] == [[keep]]
+        assert select(db.select(Tombstone.record_id).where(Tombstone.user_id == user_id,
+                                                           Tombstone.collection == 'contacts')).scalars().all() == [gone]
+        assert select(db.select(db.func.count()).select_from(ContactDuplicate)
+                      .where(ContactDuplicate.user_id == user_id)).scalar() == 0
+        db.session.remove()
+
+
+TESTS = [
+    test_writes_record_candidate_pairs,
+    test_scan_finds_the_same_pairs,
+    test_dismissed_pairs_stay_dismissed,
+    test_merge_repoints_everything,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for the durable job queue
+Runs the app in-process against a temporary instance directory: a job is
+claimed by exactly one worker, an expired lock makes it claimable again,
+failures are retried with backoff and then kept as failed, and stats()
+reports what the /metrics job gauges show.
+
+Usage: python test_job_queue.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Never the real instance/: crm.db goes to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from app import app, db, jobs, Job
+from job_queue import DONE, FAILED, QUEUED, RUNNING
+
+app.config['TESTING'] = True
+calls = []
+
+
+@jobs.task('test.record')
+def record_job(value):
+    calls.append(value)
+
+
+@jobs.task('test.flaky')
+def flaky_job(fail_times):
+    calls.append('flaky')
+    if calls.count('flaky') <= fail_times:
+        raise RuntimeError('temporary failure')
+
+
+def reset():
+    """Empty queue and call log"""
+    calls.clear()
+    with app.app_context():
+        db.session.execute(db.delete(Job))
+        db.session.commit()
+
+
+def enqueue(name, payload, **kwargs):
+    with app.app_context():
+        job = jobs.enqueue(name, payload, **kwargs)
+        db.session.commit()
+        return job.id
+
+
+def job_state(job_id):
+    with app.app_context():
+        return db.session.get(Job, job_id)
+
+
+def make_due(job_id, **values):
+    with app.app_context():
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(run_at=datetime.utcnow(), **values))
+        db.session.commit()
+
+
+def test_claim_is_exclusive():
+    reset()
+    job_id = enqueue('test.record', {'value': 1})
+    with app.app_context():
+        first = jobs.claim('worker-a')
+        second = jobs.claim('worker-b')
+    assert first.id == job_id and first.attempts == 1
+    assert second is None
+    assert job_state(job_id).status == RUNNING
+
+
+def test_expired_lock_is_claimed_again():
+    reset()
+    job_id = enqueue('test.record', {'value': 1})
+    with app.app_context():
+        jobs.claim('worker-a')
+    make_due(job_id, locked_until=datetime.utcnow() - timedelta(seconds=1))
+    with app.app_context():
+        again = jobs.claim('worker-b')
+    assert again.id == job_id and again.attempts == 2
+    assert job_state(job_id).locked_by == 'worker-b'
+
+
+def test_priority_then_run_at():
+    reset()
+    low = enqueue('test.record', {'value': 'low'})
+    high = enqueue('test.record', {'value': 'high'}, priority=5)
+    enqueue('test.record', {'value': 'later'}, priority=9, run_at=datetime.utcnow() + timedelta(hours=1))
+    with app.app_context():
+        order = [jobs.claim('worker-a').id, jobs.claim('worker-a').id, jobs.claim('worker-a')]
+    assert order == [high, low, None]
+
+
+def test_failure_is_retried_with_backoff():
+    reset()
+    job_id = enqueue('test.flaky', {'fail_times': 1})
+    with app.app_context():
+        assert jobs.run_one('worker-a')
+    job = job_state(job_id)
+    assert job.status == QUEUED and job.attempts == 1
+    assert job.run_at > datetime.utcnow() + timedelta(seconds=app.config['JOB_RETRY_BASE_SECONDS'] - 1)
+    assert 'temporary failure' in job.last_error
+
+    make_due(job_id)
+    with app.app_context():
+        assert jobs.run_one('worker-a')
+    assert job_state(job_id).status == DONE
+    assert calls == ['flaky', 'flaky']
+
+
+def test_failed_for_good_after_max_attempts():
+    reset()
+    job_id = enqueue('test.flaky', {'fail_times': 5}, max_attempts=2)
+    for _ in range(2):
+        make_due(job_id)
+        with app.app_context():
+            jobs.run_one('worker-a')
+    job = job_state(job_id)
+    assert job.status == FAILED and job.attempts == 2 and job.finished_at is not None
+
+
+def test_stats():
+    reset()
+    enqueue('test.record', {'value': 1})
+    enqueue('test.record', {'value': 2}, run_at=datetime.utcnow() + timedelta(hours=1))
+    with app.app_context():
+        rows = {(task, status): (count, oldest) for task, status, count, oldest in jobs.stats()}
+    count, oldest = rows[('test.record', QUEUED)]
+    # Both are queued, only the due one counts towards the backlog age
+    assert count == 2 and oldest <= datetime.utcnow()
+
+
+TESTS = [
+    test_claim_is_exclusive,
+    test_expired_lock_is_claimed_again,
+    test_priority_then_run_at,
+    test_failure_is_retried_with_backoff,
+    test_failed_for_good_after_max_attempts,
+    test_stats,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
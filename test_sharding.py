@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Tests for database-per-tenant sharding (SHARDING=1)
+Runs the app in-process against a temporary instance directory: signing
+up provisions a shard, tenant rows and live events stay out of crm.db,
+jobs enqueued in a tenant transaction reach the main database only if it
+commits (through the tenant's outbox, even when the main database is
+unavailable at that moment), and a shard left out of date by a deploy is migrated instead of
+failing the request.
+
+Usage: python test_sharding.py
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# Never the real instance/: crm.db and the shards go to a throwaway directory
+os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cococrm-test-')
+
+from sqlalchemy import event
+
+from app import app, db, jobs, shards, Contact, Job, JobOutbox, LiveEvent, User
+from shard_tenants import migrate_tenants
+
+app.config['TESTING'] = True
+app.config['SHARDING'] = True
+os.makedirs(shards.directory, exist_ok=True)
+
+
+def sign_up(username):
+    """Register (and sign in) a user through the app; returns (client, user id)"""
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': 'pw', 'confirm_password': 'pw'})
+    with app.app_context():
+        return client, db.session.execute(db.select(User.id).where(User.username == username)).scalar_one()
+
+
+def shard_version(user_id):
+    connection = sqlite3.connect(shards.path(user_id))
+    try:
+        return connection.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def set_shard_version(user_id, version):
+    """Make a shard look like it was built for another schema"""
+    shards.close_all()
+    connection = sqlite3.connect(shards.path(user_id))
+    connection.execute(f'PRAGMA user_version = {version}')
+    connection.commit()
+    connection.close()
+
+
+def main_db_count(table, user_id):
+    with app.app_context(), db.engine.connect() as connection:
+        return connection.execute(db.select(db.func.count()).select_from(table)
+                                  .where(table.c.user_id == user_id)).scalar()
+
+
+def job_count():
+    with app.app_context():
+        return db.session.execute(db.select(db.func.count()).select_from(Job)).scalar()
+
+
+def outbox_count(user_id):
+    with shards.engine(user_id).connect() as connection:
+        return connection.execute(db.select(db.func.count()).select_from(JobOutbox)).scalar()
+
+
+def test_sign_up_provisions_shard():
+    _, user_id = sign_up('shard-signup')
+    assert os.path.exists(shards.path(user_id))
+    assert shard_version(user_id) == shards.schema_version()
+
+
+def test_tenant_rows_stay_in_shard():
+    client, user_id = sign_up('shard-rows')
+    assert client.post('/contacts/add', data={'name': 'Ada', 'email': 'ada@example.com'}).status_code == 302
+    assert client.post('/tasks/add', data={'title': 'Call Ada'}).status_code == 302
+
+    with shards.engine(user_id).connect() as connection:
+        names = connection.execute(db.select(Contact.name).where(Contact.user_id == user_id)).scalars().all()
+        events = connection.execute(db.select(db.func.count()).select_from(LiveEvent)).scalar()
+    assert names == ['Ada']
+    assert events > 0
+    assert main_db_count(Contact.__table__, user_id) == 0
+    with app.app_context(), db.engine.connect() as connection:
+        assert connection.execute(db.select(db.func.count()).select_from(LiveEvent)).scalar() == 0
+
+
+def test_deferred_jobs_follow_the_tenant_transaction():
+    _, user_id = sign_up('shard-jobs')
+    before = job_count()
+    with app.app_context():
+        with shards.tenant(user_id):
+            assert jobs.enqueue('automations.run', {'trigger': 'new_contact', 'user_id': user_id}) is None
+            db.session.add(Contact(user_id=user_id, name='Rolled back'))
+            db.session.rollback()
+            jobs.enqueue('automations.run', {'trigger': 'new_contact', 'user_id': user_id})
+            db.session.add(Contact(user_id=user_id, name='Committed'))
+            db.session.commit()
+        db.session.remove()
+    assert job_count() == before + 1
+    assert outbox_count(user_id) == 0
+
+
+def test_outbox_keeps_jobs_the_main_database_refused():
+    _, user_id = sign_up('shard-outbox')
+
+    def main_database_down(connection, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO job '):
+            raise RuntimeError('database is locked')
+
+    before = job_count()
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', main_database_down)
+        try:
+            with shards.tenant(user_id):
+                jobs.enqueue('automations.run', {'trigger': 'new_contact', 'user_id': user_id})
+                db.session.add(Contact(user_id=user_id, name='Outboxed'))
+                db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', main_database_down)
+            db.session.remove()
+    assert job_count() == before
+    assert outbox_count(user_id) == 1
+
+    # The worker's housekeeping pass
+    with app.app_context():
+        jobs._drain_outboxes()
+    assert job_count() == before + 1
+    assert outbox_count(user_id) == 0
+
+
+def test_no_tenant_raises():
+    with app.app_context():
+        try:
+            db.session.execute(db.select(Contact)).all()
+        except RuntimeError:
+            return
+        finally:
+            db.session.remove()
+    raise AssertionError('a tenant table was queried with no tenant active')
+
+
+def test_out_of_date_shard_is_migrated_on_first_use():
+    client, user_id = sign_up('shard-stale')
+    set_shard_version(user_id, 1)
+    # Still signed in from before the "deploy": the request must not fail
+    response = client.get('/contacts')
+    assert response.status_code == 200
+    assert shard_version(user_id) == shards.schema_version()
+
+
+def test_migrate_tenants():
+    _, user_id = sign_up('shard-deploy')
+    set_shard_version(user_id, 1)
+    assert migrate_tenants() == 0
+    assert shard_version(user_id) == shards.schema_version()
+
+
+TESTS = [
+    test_sign_up_provisions_shard,
+    test_tenant_rows_stay_in_shard,
+    test_deferred_jobs_follow_the_tenant_transaction,
+    test_outbox_keeps_jobs_the_main_database_refused,
+    test_no_tenant_raises,
+    test_out_of_date_shard_is_migrated_on_first_use,
+    test_migrate_tenants,
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    print(f"\n{len(TESTS) - failed}/{len(TESTS)} passed")
+    shards.close_all()
+    shutil.rmtree(app.instance_path, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Login links for CocoCRM
+
+Issues and verifies the temporary JWT login tokens handed out by the
+Telegram bot (webhook and polling) and /api/telegram/generate-token. A
+user's link is cached until it gets within LOGIN_LINK_REFRESH_MINUTES of
+expiring, so repeated /crm commands reuse it without touching the database
+or signing a new token. Telegram users are looked up and created in bulk:
+two queries and one commit however many are resolved at once.
+
+The standalone bot (telegram_bot.py with BOT_BACKEND=local) calls this in
+process instead of going through the HTTP endpoint.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import jwt
+
+LINK_CACHE_SIZE = 10000
+
+
+class TokenService:
+    """Temporary login tokens and cached login links for the users of user_model"""
+
+    def __init__(self, app, db, user_model):
+        app.config.setdefault('LOGIN_LINK_MINUTES', int(os.environ.get('LOGIN_LINK_MINUTES', '180')))
+        app.config.setdefault('LOGIN_LINK_REFRESH_MINUTES', int(os.environ.get('LOGIN_LINK_REFRESH_MINUTES', '30')))
+        self.app = app
+        self.db = db
+        self.user = user_model
+        self._links = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, user_id, username, expires_in_minutes=None):
+        """Signed temporary login token"""
+        now = datetime.utcnow()
+        payload = {
+            'user_id': user_id,
+            'username': username,
+            'exp': now + timedelta(minutes=expires_in_minutes or self.app.config['LOGIN_LINK_MINUTES']),
+            'iat': now,
+            'type': 'temp_login'
+        }
+        return jwt.encode(payload, self.app.config['SECRET_KEY'], algorithm='HS256')
+
+    def verify(self, token):
+        """Payload of a valid temporary login token, or None"""
+        try:
+            payload = jwt.decode(token, self.app.config['SECRET_KEY'], algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            print("❌ Token expired")
+            return None
+        except jwt.InvalidTokenError as e:
+            print(f"❌ Invalid token: {e}")
+            return None
+        return payload if payload.get('type') == 'temp_login' else None
+
+    def cached_link(self, key):
+        """A cached login link with enough validity left, or None - no database access"""
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                return None
+            remaining = link['expires_at'] - datetime.utcnow()
+            if remaining < timedelta(minutes=self.app.config['LOGIN_LINK_REFRESH_MINUTES']):
+                del self._links[key]
+                return None
+            self._links.move_to_end(key)
+        return dict(link, expires_in=int(remaining.total_seconds() // 60))
+
+    def login_link(self, user_id, username, key=None):
+        """
+        {'token', 'url', 'expires_in' (minutes left), 'expires_at', 'user_id', 'username'}
+
+        Reuses the link cached under key (default: the user id) while it is
+        fresh, otherwise issues and caches a new one.
+        """
+        key = user_id if key is None else key
+        link = self.cached_link(key)
+        if link is not None:
+            return link
+        minutes = self.app.config['LOGIN_LINK_MINUTES']
+        token = self.issue(user_id, username, minutes)
+        base_url = os.environ.get('BASE_URL', 'https://cococrm.onrender.com')
+        link = {
+            'token': token,
+            'url': f"{base_url}/?token={token}",
+            'expires_at': datetime.utcnow() + timedelta(minutes=minutes),
+            'user_id': user_id,
+            'username': username,
+        }
+        with self._lock:
+            self._links[key] = link
+            self._links.move_to_end(key)
+            while len(self._links) > LINK_CACHE_SIZE:
+                self._links.popitem(last=False)
+        return dict(link, expires_in=minutes)
+
+    def telegram_users(self, identities):
+        """
+        {telegram_id: user} for dicts with telegram_id, username, first_name and
+        last_name, creating users that do not exist yet (username clashes get
+        a _<telegram_id> suffix)
+        """
+        db, User = self.db, self.user
+        wanted = {str(i['telegram_id']): i for i in identities if i.get('telegram_id')}
+        if not wanted:
+            return {}
+        found = {user.telegram_id: user for user in User.query.filter(User.telegram_id.in_(list(wanted)))}
+
+        missing = {telegram_id: identity for telegram_id, identity in wanted.items() if telegram_id not in found}
+        if missing:
+            names = {telegram_id: identity.get('username') or f"user_{telegram_id}"
+                     for telegram_id, identity in missing.items()}
+            taken = set(db.session.execute(
+                db.select(User.username).where(User.username.in_(list(names.values())))
+            ).scalars())
+            for telegram_id, identity in missing.items():
+                username = names[telegram_id]
+                if username in taken:
+                    username = f"{username}_{telegram_id}"
+                taken.add(username)
+                user = User(
+                    username=username,
+                    telegram_id=telegram_id,
+                    telegram_username=identity.get('username'),
+                    first_name=identity.get('first_name'),
+                    last_name=identity.get('last_name')
+                )
+                db.session.add(user)
+                found[telegram_id] = user
+                print(f"Created new user from Telegram: {username} (ID: {telegram_id})")
+            db.session.commit()
+        return found
+
+    def telegram_login_link(self, telegram_id, username=None, first_name=None, last_name=None):
+        """Login link for a Telegram user, creating the user if needed; None without a telegram_id"""
+        if not telegram_id:
+            return None
+        key = ('telegram', str(telegram_id))
+        link = self.cached_link(key)
+        if link is not None:
+            return link
+        user = self.telegram_users([{'telegram_id': telegram_id, 'username': username,
+                                     'first_name': first_name, 'last_name': last_name}])[str(telegram_id)]
+        return self.login_link(user.id, user.username, key=key)
@@ -0,0 +1,105 @@
+"""
+In-memory contact autocomplete for CocoCRM
+
+A PrefixIndex holds one account's contacts as a sorted array of
+"word, display name, contact id" keys - one per word of the name and
+company - so all contacts with a word starting with the typed prefix form
+one contiguous slice found with two binary searches. Building it is one
+query over the account's contacts; the app keeps recently used indexes in
+an LRU and, when the account's contacts change, patches in just the rows
+changed or deleted since (rebuilding after large changes).
+"""
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+DEFAULT_LIMIT = 10
+# Highest code point, so prefix + END sorts after every word starting with prefix
+END = '\U0010ffff'
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r'[a-z0-9]+', text)
+
+
+class PrefixIndex:
+    """Prefix search over the name and company words of a list of contacts"""
+
+    def __init__(self, rows):
+        """rows: (id, name, company) tuples"""
+        self.contacts = {}
+        keys = []
+        for row in rows:
+            keys.extend(self._entry(*row))
+        keys.sort()
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def _entry(self, contact_id, name, company):
+        words = set(_words(f'{name or ""} {company or ""}'))
+        self.contacts[contact_id] = (name, company, words)
+        # "word NUL name NUL id": plain strings sort much faster than tuples
+        suffix = f'\0{(name or "").lower()}\0{contact_id}'
+        return [word + suffix for word in words]
+
+    def copy(self):
+        """Independent copy to patch while other threads keep searching the original"""
+        clone = PrefixIndex([])
+        clone.contacts = dict(self.contacts)
+        clone.keys = list(self.keys)
+        return clone
+
+    def update(self, rows):
+        """Add or re-index a few (id, name, company) rows in place"""
+        self.remove([row[0] for row in rows])
+        for row in rows:
+            for key in self._entry(*row):
+                insort(self.keys, key)
+
+    def remove(self, contact_ids):
+        for contact_id in contact_ids:
+            entry = self.contacts.pop(contact_id, None)
+            if entry is None:
+                continue
+            name, _, words = entry
+            suffix = f'\0{(name or "").lower()}\0{contact_id}'
+            for word in words:
+                position = bisect_left(self.keys, word + suffix)
+                if position < len(self.keys) and self.keys[position] == word + suffix:
+                    del self.keys[position]
+
+    def _slice(self, term):
+        start = bisect_left(self.keys, term)
+        return start, bisect_left(self.keys, term + END, start)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        [(id, name, company)] of contacts with a word starting with every query word
+
+        The query word with the fewest matching entries picks the slice to
+        walk, the others are checked against each candidate's words. Results
+        come out ordered by the matched word, then by name.
+        """
+        terms = _words(query)
+        if not terms:
+            return []
+        slices = {term: self._slice(term) for term in terms}
+        lead = min(terms, key=lambda term: slices[term][1] - slices[term][0])
+        rest = [term for term in terms if term != lead]
+        start, stop = slices[lead]
+
+        found, seen = [], set()
+        for position in range(start, stop):
+            contact_id = int(self.keys[position].rsplit('\0', 1)[1])
+            if contact_id in seen:
+                continue
+            seen.add(contact_id)
+            name, company, words = self.contacts[contact_id]
+            if all(any(word.startswith(term) for word in words) for term in rest):
+                found.append((contact_id, name, company))
+                if len(found) >= limit:
+                    break
+        return found
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Background job worker: runs queued jobs (Telegram messages, bot commands,
+automations) with N concurrent consumers until stopped with Ctrl+C/SIGTERM
+gunicorn (gunicorn.conf.py) launches it next to the web workers; more can run against
+the same database, each job is claimed by one of them
+Usage: python worker.py [consumers=JOB_WORKERS or 2]
+"""
+import os
+import sys
+
+from app import jobs
+
+
+if __name__ == '__main__':
+    consumers = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get('JOB_WORKERS', '2'))
+    jobs.run(consumers)